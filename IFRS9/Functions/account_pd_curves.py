@@ -0,0 +1,102 @@
+import math
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import Max
+from ..models import FSI_Expected_Cashflow, FSI_LLFP_APP_PREFERENCES, FSI_PD_Account_Interpolated, Ldn_Financial_Instrument
+from .pd_interpolation_engine import BUCKET_FREQUENCIES, DEFAULT_BUCKET_FREQUENCY, curve_horizon, pd_curve
+from .reference_cache import reference_cache
+
+
+def get_account_pd_mode():
+    """
+    'stored' reads account-level PDs from FSI_PD_Account_Interpolated; 'virtual' computes them on demand from
+    the account's PD, interest frequency and the interpolation method.
+    """
+    return getattr(settings, 'IFRS9_ACCOUNT_PD_MODE', 'stored')
+
+
+def account_pd_curves(fic_mis_date):
+    """The account-level PD source of fic_mis_date for the configured mode."""
+    if get_account_pd_mode() == 'virtual':
+        return VirtualAccountPDCurves(fic_mis_date)
+    return StoredAccountPDCurves(fic_mis_date)
+
+
+class StoredAccountPDCurves:
+    """
+    Account-level PDs read from the materialized FSI_PD_Account_Interpolated rows. Buckets passed to
+    load_buckets are read for all accounts at once; other buckets are queried per lookup.
+    """
+
+    def __init__(self, fic_mis_date):
+        self.fic_mis_date = fic_mis_date
+        self.loaded_buckets = set()
+        self.values = {}
+
+    def load_buckets(self, buckets):
+        buckets = set(buckets) - self.loaded_buckets
+        if not buckets:
+            return
+        # Descending so the first record by pk wins, as with .first().
+        self.values.update(
+            ((account_number, bucket), cumulative_pd)
+            for account_number, bucket, cumulative_pd in FSI_PD_Account_Interpolated.objects.filter(
+                fic_mis_date=self.fic_mis_date, v_cash_flow_bucket_id__in=buckets
+            ).order_by('-pk').values_list('v_account_number', 'v_cash_flow_bucket_id', 'n_cumulative_default_prob')
+        )
+        self.loaded_buckets |= buckets
+
+    def cumulative_pd(self, account_number, bucket):
+        if bucket in self.loaded_buckets:
+            return self.values.get((account_number, bucket))
+        pd_record = FSI_PD_Account_Interpolated.objects.filter(
+            v_account_number=account_number,
+            fic_mis_date=self.fic_mis_date,
+            v_cash_flow_bucket_id=bucket
+        ).first()
+        return pd_record.n_cumulative_default_prob if pd_record else None
+
+
+class VirtualAccountPDCurves:
+    """
+    Account-level PDs computed on demand, matching what pd_interpolation_account_level would have stored: the
+    curve of an account runs up to its last cash flow bucket and values carry the precision of the stored
+    column. Curves are memoized by (PD, bucket frequency, method) in pd_curve and shared between accounts.
+    """
+
+    def __init__(self, fic_mis_date):
+        preferences = reference_cache.first(FSI_LLFP_APP_PREFERENCES)
+        self.pd_interpolation_method = preferences.pd_interpolation_method or 'NL-POISSON'
+        self.accounts = {
+            account_number: (pd_percent, interest_freq_unit)
+            for account_number, pd_percent, interest_freq_unit in Ldn_Financial_Instrument.objects.filter(
+                fic_mis_date=fic_mis_date
+            ).values_list('v_account_number', 'n_pd_percent', 'v_interest_freq_unit')
+        }
+        self.max_buckets = dict(
+            FSI_Expected_Cashflow.objects.filter(fic_mis_date=fic_mis_date)
+            .values_list('v_account_number')
+            .annotate(max_bucket=Max('n_cash_flow_bucket'))
+            .order_by()
+        )
+        self.field = FSI_PD_Account_Interpolated._meta.get_field('n_cumulative_default_prob')
+        self.quantum = Decimal(1).scaleb(-self.field.decimal_places)
+
+    def load_buckets(self, buckets):
+        """Nothing to preload: every lookup is computed."""
+
+    def cumulative_pd(self, account_number, bucket):
+        account = self.accounts.get(account_number)
+        max_bucket = self.max_buckets.get(account_number)
+        if account is None or account[0] is None or max_bucket is None or bucket is None:
+            return None
+        if not 1 <= bucket <= max_bucket:
+            return None
+
+        pd_percent, interest_freq_unit = account
+        bucket_frequency = BUCKET_FREQUENCIES.get(interest_freq_unit, DEFAULT_BUCKET_FREQUENCY)[0]
+        _, cumulative = pd_curve(float(pd_percent), bucket_frequency, self.pd_interpolation_method, curve_horizon(max_bucket))
+        value = float(cumulative[bucket - 1])
+        if math.isnan(value):
+            return None
+        return self.field.to_python(value).quantize(self.quantum)
@@ -1,113 +1,72 @@
-import concurrent.futures
-from django.db import transaction
-from decimal import Decimal
-from ..models import FCT_Stage_Determination, FSI_PD_Account_Interpolated
+from ..models import FCT_Stage_Determination
+from .bulk_sql import update_from_rows
+from .maturity_buckets import maturity_buckets
 from .save_log import save_log
+from .account_pd_curves import account_pd_curves
 
-def calculate_account_level_pd_for_account(account, fic_mis_date, term_unit_to_periods):
-    """
-    Function to calculate 12-month PD and Lifetime PD for a single account using account-level interpolated PD data.
-    """
-    amortization_periods = term_unit_to_periods.get(account.v_amrt_term_unit, 12)  # Default to 12 (monthly)
-    try:
-        # Calculate the number of months and buckets to maturity
-        if account.d_maturity_date and account.fic_mis_date:
-            months_to_maturity = (account.d_maturity_date.year - account.fic_mis_date.year) * 12 + \
-                                 (account.d_maturity_date.month - account.fic_mis_date.month)
-            buckets_to_maturity = months_to_maturity // (12 // amortization_periods)
-        else:
-            return None
-
-        buckets_needed_for_12_months = 12 // (12 // amortization_periods)
-        twelve_months_pd, lifetime_pd = None, None
-
-        # Fetch PD records based on maturity
-        if months_to_maturity > 12:
-            twelve_months_pd_record = FSI_PD_Account_Interpolated.objects.filter(
-                v_account_number=account.n_account_number,
-                fic_mis_date=fic_mis_date,
-                v_cash_flow_bucket_id=buckets_needed_for_12_months
-            ).first()
-            twelve_months_pd = twelve_months_pd_record.n_cumulative_default_prob if twelve_months_pd_record else None
-
-            lifetime_pd_record = FSI_PD_Account_Interpolated.objects.filter(
-                v_account_number=account.n_account_number,
-                fic_mis_date=fic_mis_date,
-                v_cash_flow_bucket_id=buckets_to_maturity
-            ).first()
-            lifetime_pd = lifetime_pd_record.n_cumulative_default_prob if lifetime_pd_record else None
-        else:
-            pd_record = FSI_PD_Account_Interpolated.objects.filter(
-                v_account_number=account.n_account_number,
-                fic_mis_date=fic_mis_date,
-                v_cash_flow_bucket_id=buckets_to_maturity
-            ).first()
-            twelve_months_pd = lifetime_pd = pd_record.n_cumulative_default_prob if pd_record else None
-
-        # Update the account with calculated PDs
-        account.n_twelve_months_pd = twelve_months_pd if twelve_months_pd is not None else account.n_twelve_months_pd
-        account.n_lifetime_pd = lifetime_pd if lifetime_pd is not None else account.n_lifetime_pd
-
-        return account if twelve_months_pd or lifetime_pd else None
-
-    except FSI_PD_Account_Interpolated.DoesNotExist:
-        save_log('calculate_account_level_pd_for_account', 'WARNING', f"Account {account.n_account_number}: No PD records found for specified buckets.")
-    except Exception as e:
-        save_log('calculate_account_level_pd_for_account', 'ERROR', f"Account {account.n_account_number}: Error calculating PD values: {e}")
-
-    return None
 
 def calculate_account_level_pd_for_accounts(fic_mis_date):
     """
-    Main function to calculate the 12-month PD and Lifetime PD for accounts using multi-threading and account-level PDs.
+    Main function to calculate the 12-month PD and Lifetime PD for accounts using account-level PDs. The buckets
+    to maturity of all accounts are computed together and the PDs of those buckets are read in one pass from
+    pd_curves (see account_pd_curves).
     """
-    term_unit_to_periods = {
-        'M': 12,  # Monthly
-        'Q': 4,   # Quarterly
-        'H': 2,   # Half-Yearly
-        'Y': 1    # Yearly
-    }
-
-    accounts = FCT_Stage_Determination.objects.filter(fic_mis_date=fic_mis_date)
-    total_accounts = accounts.count()
+    accounts = list(FCT_Stage_Determination.objects.filter(fic_mis_date=fic_mis_date).values_list(
+        'id', 'n_account_number', 'fic_mis_date', 'd_maturity_date', 'v_amrt_term_unit', 'n_twelve_months_pd',
+        'n_lifetime_pd',
+    ))
+    total_accounts = len(accounts)
     if total_accounts == 0:
         save_log('calculate_account_level_pd_for_accounts', 'INFO', "No accounts found for the given MIS date.")
         return 0
 
     save_log('calculate_account_level_pd_for_accounts', 'INFO', f"Processing {total_accounts} accounts.")
-    updated_accounts = []
     error_logs = {}
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {executor.submit(calculate_account_level_pd_for_account, account, fic_mis_date, term_unit_to_periods): account for account in accounts}
-
-        for future in concurrent.futures.as_completed(futures):
-            account = futures[future]
-            try:
-                result = future.result()
-                if result:
-                    updated_accounts.append(result)
-            except Exception as e:
-                error_message = f"Error occurred while processing account {account.n_account_number}: {e}"
-                error_logs[error_message] = 1
-
-    # Perform bulk update in batches of 5000
-    batch_size = 5000
-    for i in range(0, len(updated_accounts), batch_size):
+    # Accounts without a maturity date get no PD.
+    dated_accounts = [account for account in accounts if account[2] and account[3]]
+    months_to_maturity, buckets_to_maturity, buckets_for_12_months = maturity_buckets(
+        [account[2] for account in dated_accounts],
+        [account[3] for account in dated_accounts],
+        [account[4] for account in dated_accounts],
+    )
+
+    pd_curves = account_pd_curves(fic_mis_date)
+    pd_curves.load_buckets(set(buckets_to_maturity.tolist()) | set(buckets_for_12_months.tolist()))
+
+    updates = []
+    for account, months, lifetime_bucket, twelve_months_bucket in zip(
+        dated_accounts, months_to_maturity.tolist(), buckets_to_maturity.tolist(), buckets_for_12_months.tolist()
+    ):
+        account_id, account_number, _, _, _, twelve_months_pd, lifetime_pd = account
         try:
-            FCT_Stage_Determination.objects.bulk_update(
-                updated_accounts[i:i + batch_size], ['n_twelve_months_pd', 'n_lifetime_pd']
+            new_lifetime_pd = pd_curves.cumulative_pd(account_number, lifetime_bucket)
+            new_twelve_months_pd = (
+                pd_curves.cumulative_pd(account_number, twelve_months_bucket) if months > 12 else new_lifetime_pd
             )
         except Exception as e:
-            error_logs[f"Bulk update error: {e}"] = 1
+            error_logs[f"Error occurred while processing account {account_number}: {e}"] = 1
+            continue
+
+        if new_twelve_months_pd or new_lifetime_pd:
+            updates.append((
+                account_id,
+                new_twelve_months_pd if new_twelve_months_pd is not None else twelve_months_pd,
+                new_lifetime_pd if new_lifetime_pd is not None else lifetime_pd,
+            ))
+
+    try:
+        update_from_rows(FCT_Stage_Determination, ['id'], ['n_twelve_months_pd', 'n_lifetime_pd'], updates)
+    except Exception as e:
+        error_logs[f"Bulk update error: {e}"] = 1
 
     for error_message in error_logs:
         save_log('calculate_account_level_pd_for_accounts', 'ERROR', error_message)
 
     if not error_logs:
-        save_log('calculate_account_level_pd_for_accounts', 'INFO', f"{len(updated_accounts)} out of {total_accounts} accounts were successfully updated.")
+        save_log('calculate_account_level_pd_for_accounts', 'INFO', f"{len(updates)} out of {total_accounts} accounts were successfully updated.")
     
-    return 1 if updated_accounts else 0
+    return 1 if updates else 0
 
 
 
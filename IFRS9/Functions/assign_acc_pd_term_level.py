@@ -1,166 +1,73 @@
-import concurrent.futures
-from django.db import transaction
-from decimal import Decimal
-from ..models import FCT_Stage_Determination, FSI_PD_Interpolated, Ldn_PD_Term_Structure
+from ..models import FCT_Stage_Determination, Ldn_PD_Term_Structure
+from .bulk_sql import update_from_rows
+from .maturity_buckets import maturity_buckets
+from .pd_curve_index import MISSING, PDCurveIndex
+from .reference_cache import reference_cache
 from .save_log import save_log
 
-def calculate_pd_for_rating(account, fic_mis_date, term_unit_to_periods):
-    if not account.d_maturity_date or not account.fic_mis_date:
-        return None  # Skip accounts with missing dates
-
-    amortization_periods = term_unit_to_periods.get(account.v_amrt_term_unit, 12)
-    months_to_maturity = (account.d_maturity_date.year - account.fic_mis_date.year) * 12 + \
-                         (account.d_maturity_date.month - account.fic_mis_date.month)
-    buckets_to_maturity = months_to_maturity // (12 // amortization_periods)
-    buckets_needed_for_12_months = 12 // (12 // amortization_periods)
-
-    twelve_months_pd = None
-    lifetime_pd = None
-
-    try:
-        if months_to_maturity > 12:
-            pd_record = FSI_PD_Interpolated.objects.filter(
-                v_int_rating_code=account.n_credit_rating_code,
-                v_pd_term_structure_id=account.n_pd_term_structure_skey,
-                v_pd_term_structure_type='R',
-                v_cash_flow_bucket_id=buckets_needed_for_12_months
-            ).first()
-            twelve_months_pd = pd_record.n_cumulative_default_prob if pd_record else None
-
-            pd_record = FSI_PD_Interpolated.objects.filter(
-                v_int_rating_code=account.n_credit_rating_code,
-                v_pd_term_structure_id=account.n_pd_term_structure_skey,
-                v_pd_term_structure_type='R',
-                v_cash_flow_bucket_id=buckets_to_maturity
-            ).first()
-            lifetime_pd = pd_record.n_cumulative_default_prob if pd_record else None
-        else:
-            pd_record = FSI_PD_Interpolated.objects.filter(
-                v_int_rating_code=account.n_credit_rating_code,
-                v_pd_term_structure_id=account.n_pd_term_structure_skey,
-                v_pd_term_structure_type='R',
-                v_cash_flow_bucket_id=buckets_to_maturity
-            ).first()
-            twelve_months_pd = pd_record.n_cumulative_default_prob if pd_record else None
-            lifetime_pd = twelve_months_pd
-
-    except Exception as e:
-        save_log('calculate_pd_for_rating', 'ERROR', f"Error calculating PD for account {account.n_account_number} (Rating): {e}")
-        return None
-
-    account.n_twelve_months_pd = twelve_months_pd if twelve_months_pd is not None else account.n_twelve_months_pd
-    account.n_lifetime_pd = lifetime_pd if lifetime_pd is not None else account.n_lifetime_pd
-    return account
-
-def calculate_pd_for_delinquency(account, fic_mis_date, term_unit_to_periods):
-    if not account.d_maturity_date or not account.fic_mis_date:
-        return None  # Skip accounts with missing dates
-
-    amortization_periods = term_unit_to_periods.get(account.v_amrt_term_unit, 12)
-    months_to_maturity = (account.d_maturity_date.year - account.fic_mis_date.year) * 12 + \
-                         (account.d_maturity_date.month - account.fic_mis_date.month)
-    buckets_to_maturity = months_to_maturity // (12 // amortization_periods)
-    buckets_needed_for_12_months = 12 // (12 // amortization_periods)
-
-    twelve_months_pd = None
-    lifetime_pd = None
-
-    try:
-        if months_to_maturity > 12:
-            pd_record = FSI_PD_Interpolated.objects.filter(
-                v_delq_band_code=account.n_delq_band_code,
-                v_pd_term_structure_id=account.n_pd_term_structure_skey,
-                v_pd_term_structure_type='D',
-                v_cash_flow_bucket_id=buckets_needed_for_12_months
-            ).first()
-            twelve_months_pd = pd_record.n_cumulative_default_prob if pd_record else None
-
-            pd_record = FSI_PD_Interpolated.objects.filter(
-                v_delq_band_code=account.n_delq_band_code,
-                v_pd_term_structure_id=account.n_pd_term_structure_skey,
-                v_pd_term_structure_type='D',
-                v_cash_flow_bucket_id=buckets_to_maturity
-            ).first()
-            lifetime_pd = pd_record.n_cumulative_default_prob if pd_record else None
-        else:
-            pd_record = FSI_PD_Interpolated.objects.filter(
-                v_delq_band_code=account.n_delq_band_code,
-                v_pd_term_structure_id=account.n_pd_term_structure_skey,
-                v_pd_term_structure_type='D',
-                v_cash_flow_bucket_id=buckets_to_maturity
-            ).first()
-            twelve_months_pd = pd_record.n_cumulative_default_prob if pd_record else None
-            lifetime_pd = twelve_months_pd
-
-    except Exception as e:
-        save_log('calculate_pd_for_delinquency', 'ERROR', f"Error calculating PD for account {account.n_account_number} (Delinquency): {e}")
-        return None
-
-    account.n_twelve_months_pd = twelve_months_pd if twelve_months_pd is not None else account.n_twelve_months_pd
-    account.n_lifetime_pd = lifetime_pd if lifetime_pd is not None else account.n_lifetime_pd
-    return account
 
 def calculate_pd_for_accounts(fic_mis_date):
-    term_unit_to_periods = {
-        'M': 12,
-        'Q': 4,
-        'H': 2,
-        'Y': 1
-    }
-    
-    accounts = FCT_Stage_Determination.objects.filter(fic_mis_date=fic_mis_date)
-    total_accounts = accounts.count()
-    
+    """
+    Assign the 12-month and lifetime PDs of the accounts from the interpolated PD term structures. Term
+    structure types and the PD curves of fic_mis_date are loaded once and the buckets to maturity of all accounts
+    are computed together, so no query is issued per account.
+    """
+    accounts = list(FCT_Stage_Determination.objects.filter(fic_mis_date=fic_mis_date).values_list(
+        'id', 'n_account_number', 'fic_mis_date', 'd_maturity_date', 'v_amrt_term_unit', 'n_pd_term_structure_skey',
+        'n_credit_rating_code', 'n_delq_band_code', 'n_twelve_months_pd', 'n_lifetime_pd',
+    ))
+    total_accounts = len(accounts)
+
     if total_accounts == 0:
         return 0
 
-    updated_accounts = []
     error_logs = {}
-    
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {}
-        for account in accounts:
-            try:
-                pd_term_structure = Ldn_PD_Term_Structure.objects.get(v_pd_term_structure_id=account.n_pd_term_structure_skey)
-                term_structure_type = pd_term_structure.v_pd_term_structure_type
-
-                if term_structure_type == 'R':
-                    futures[executor.submit(calculate_pd_for_rating, account, fic_mis_date, term_unit_to_periods)] = account
-                elif term_structure_type == 'D':
-                    futures[executor.submit(calculate_pd_for_delinquency, account, fic_mis_date, term_unit_to_periods)] = account
-
-            except Ldn_PD_Term_Structure.DoesNotExist:
-                warning_message = f"No matching PD term structure found for account {account.n_account_number}. Skipping."
-                error_logs[warning_message] = 1
-                continue
-
-        for future in concurrent.futures.as_completed(futures):
-            account = futures[future]
-            try:
-                result = future.result()
-                if result:
-                    updated_accounts.append(result)
-            except Exception as e:
-                error_message = f"Error processing account {account.n_account_number}: {e}"
-                error_logs[error_message] = 1
-
-    # Perform bulk update in batches of 5000
-    batch_size = 5000
-    for i in range(0, len(updated_accounts), batch_size):
-        try:
-            FCT_Stage_Determination.objects.bulk_update(
-                updated_accounts[i:i + batch_size], ['n_twelve_months_pd', 'n_lifetime_pd']
-            )
-        except Exception as e:
-            error_logs[f"Bulk update error: {e}"] = 1
+    structure_types = reference_cache.mapping(Ldn_PD_Term_Structure, 'v_pd_term_structure_id', 'v_pd_term_structure_type')
+    pd_curves = PDCurveIndex(fic_mis_date, by_record_type=True)
+
+    assigned_accounts = []
+    for account in accounts:
+        structure_type = structure_types.get(str(account[5])) if account[5] is not None else None
+        if structure_type is None:
+            warning_message = f"No matching PD term structure found for account {account[1]}. Skipping."
+            error_logs[warning_message] = 1
+        elif structure_type in ('R', 'D') and account[2] and account[3]:
+            assigned_accounts.append((account, structure_type))
+
+    months_to_maturity, buckets_to_maturity, buckets_for_12_months = maturity_buckets(
+        [account[2] for account, _ in assigned_accounts],
+        [account[3] for account, _ in assigned_accounts],
+        [account[4] for account, _ in assigned_accounts],
+    )
+
+    updates = []
+    for (account, structure_type), months, lifetime_bucket, twelve_months_bucket in zip(
+        assigned_accounts, months_to_maturity.tolist(), buckets_to_maturity.tolist(), buckets_for_12_months.tolist()
+    ):
+        account_id, _, _, _, _, term_structure_skey, rating_code, delq_band_code, twelve_months_pd, lifetime_pd = account
+        curve = pd_curves.curve(term_structure_skey, rating_code, delq_band_code, structure_type=structure_type)
+
+        new_lifetime_pd = pd_curves.cumulative_pd(curve, lifetime_bucket)
+        new_twelve_months_pd = pd_curves.cumulative_pd(curve, twelve_months_bucket) if months > 12 else new_lifetime_pd
+
+        updates.append((
+            account_id,
+            twelve_months_pd if new_twelve_months_pd in (MISSING, None) else new_twelve_months_pd,
+            lifetime_pd if new_lifetime_pd in (MISSING, None) else new_lifetime_pd,
+        ))
+
+    try:
+        update_from_rows(FCT_Stage_Determination, ['id'], ['n_twelve_months_pd', 'n_lifetime_pd'], updates)
+    except Exception as e:
+        error_logs[f"Bulk update error: {e}"] = 1
 
     for error_message in error_logs:
         save_log('calculate_pd_for_accounts', 'ERROR', error_message)
 
     if not error_logs:
-        save_log('calculate_pd_for_accounts', 'INFO', f"{len(updated_accounts)} out of {total_accounts} accounts were successfully updated.")
+        save_log('calculate_pd_for_accounts', 'INFO', f"{len(updates)} out of {total_accounts} accounts were successfully updated.")
     
-    return 1 if updated_accounts else 0
+    return 1 if updates else 0
 
 
 
@@ -0,0 +1,103 @@
+import numpy as np
+from ..models import Dim_Delinquency_Band, FSI_DPD_Stage_Mapping
+from .reference_cache import reference_cache
+from .save_log import save_log
+
+
+class BandResolver:
+    """
+    Finds the band that contains a value, per key (such as the amortisation term unit). bands are
+    (key, lower, upper, label) tuples with inclusive integer bounds, None standing for an unbounded side. The
+    bands of each key are kept as sorted arrays of lower bounds, upper bounds and labels, so a value is resolved
+    with a binary search and a whole column of values with one searchsorted per key.
+    Overlapping bands, gaps between bands and empty bands are logged when the bands are loaded. Where bands
+    overlap, the band with the higher lower bound wins.
+    """
+
+    def __init__(self, bands, name='Band'):
+        bands_by_key = {}
+        self.problems = []
+        for key, lower, upper, label in bands:
+            lower = -np.inf if lower is None else lower
+            upper = np.inf if upper is None else upper
+            if lower > upper:
+                self.problems.append(f"{name} {label} for {key} is empty: lower bound {lower} is above upper bound {upper}.")
+                continue
+            bands_by_key.setdefault(key, []).append((lower, upper, label))
+
+        self.lowers = {}
+        self.uppers = {}
+        self.labels = {}
+        for key, key_bands in bands_by_key.items():
+            key_bands.sort(key=lambda band: (band[0], band[1]))
+            for (lower, upper, label), (next_lower, next_upper, next_label) in zip(key_bands, key_bands[1:]):
+                if next_lower <= upper:
+                    self.problems.append(f"{name}s {label} and {next_label} for {key} overlap from {next_lower} to {min(upper, next_upper)}.")
+                elif next_lower > upper + 1:
+                    self.problems.append(f"{name}s for {key} leave a gap from {upper + 1} to {next_lower - 1}.")
+            self.lowers[key] = np.array([band[0] for band in key_bands], dtype=float)
+            self.uppers[key] = np.array([band[1] for band in key_bands], dtype=float)
+            self.labels[key] = np.array([band[2] for band in key_bands], dtype=object)
+
+        for problem in self.problems:
+            save_log('BandResolver', 'WARNING', problem)
+
+    def __contains__(self, key):
+        return key in self.lowers
+
+    def resolve(self, key, value):
+        """The label of the band of key that contains value, or None."""
+        if value is None or key not in self.lowers:
+            return None
+        index = int(np.searchsorted(self.lowers[key], value, side='right')) - 1
+        if index < 0 or value > self.uppers[key][index]:
+            return None
+        return self.labels[key][index]
+
+    def resolve_many(self, keys, values):
+        """The labels of the bands that contain values[i] for keys[i], as a list with None where there is none."""
+        keys = np.asarray(keys, dtype=object)
+        values = np.array([np.nan if value is None else value for value in values], dtype=float)
+        labels = np.full(len(values), None, dtype=object)
+        known = ~np.isnan(values)
+        for key, lowers in self.lowers.items():
+            positions = np.flatnonzero((keys == key) & known)
+            if not len(positions):
+                continue
+            key_values = values[positions]
+            indexes = np.searchsorted(lowers, key_values, side='right') - 1
+            found = (indexes >= 0) & (key_values <= self.uppers[key][np.maximum(indexes, 0)])
+            labels[positions[found]] = self.labels[key][indexes[found]]
+        return labels.tolist()
+
+
+def delinquency_band_resolver():
+    """The bands of Dim_Delinquency_Band by amortisation term unit, labelled with their band codes."""
+    def load():
+        return BandResolver((
+            (band.v_amrt_term_unit, band.n_delq_lower_value, band.n_delq_upper_value, band.n_delq_band_code)
+            for band in Dim_Delinquency_Band.objects.all()
+        ), 'Delinquency band')
+    return reference_cache.get(Dim_Delinquency_Band, load, variant='resolver')
+
+
+def dpd_stage_resolver():
+    """
+    The DPD thresholds of FSI_DPD_Stage_Mapping by payment frequency as stage bands: 'Stage 1' up to
+    stage_1_threshold days, 'Stage 2' up to stage_2_threshold days and 'Stage 3' above. The last mapping of a
+    payment frequency applies.
+    """
+    def load():
+        thresholds = {
+            mapping.payment_frequency: (mapping.stage_1_threshold, mapping.stage_2_threshold)
+            for mapping in FSI_DPD_Stage_Mapping.objects.all()
+        }
+        bands = []
+        for payment_frequency, (stage_1_threshold, stage_2_threshold) in thresholds.items():
+            bands += [
+                (payment_frequency, None, stage_1_threshold, 'Stage 1'),
+                (payment_frequency, stage_1_threshold + 1, stage_2_threshold, 'Stage 2'),
+                (payment_frequency, max(stage_1_threshold, stage_2_threshold) + 1, None, 'Stage 3'),
+            ]
+        return BandResolver(bands, 'DPD stage band')
+    return reference_cache.get(FSI_DPD_Stage_Mapping, load, variant='resolver')
@@ -0,0 +1,88 @@
+from django.db import connection, transaction
+
+# Rows sent per INSERT batch when loading the temporary table.
+LOAD_BATCH_SIZE = 5000
+
+# Vendors with a joined UPDATE: UPDATE ... JOIN on MySQL, UPDATE ... FROM on PostgreSQL and SQLite.
+JOINED_UPDATE_VENDORS = ('mysql', 'postgresql', 'sqlite')
+
+
+def joined_update_sql(table, source, join_sql, assignments, where_sql=None):
+    """
+    Build an UPDATE of table from source for the current vendor. Both are given as 'quoted_name AS alias'
+    and join_sql, the assignment values and where_sql refer to them through their aliases. assignments pairs
+    each quoted target column with its new value.
+    """
+    target_alias = table.split()[-1]
+    if connection.vendor == 'mysql':
+        set_sql = ', '.join(f"{target_alias}.{column} = {value}" for column, value in assignments)
+        sql = f"UPDATE {table} JOIN {source} ON {join_sql} SET {set_sql}"
+        return sql + (f" WHERE {where_sql}" if where_sql else '')
+    set_sql = ', '.join(f"{column} = {value}" for column, value in assignments)
+    sql = f"UPDATE {table} SET {set_sql} FROM {source} WHERE {join_sql}"
+    return sql + (f" AND {where_sql}" if where_sql else '')
+
+
+def update_from_rows(model, keys, fields, rows):
+    """
+    Update many rows of model with one joined UPDATE. Each row holds the values of keys followed by the new
+    values of fields; the rows are loaded into a temporary table that is joined to the model's table.
+    Returns the number of rows updated.
+    """
+    if not rows:
+        return 0
+
+    meta = model._meta
+    qn = connection.ops.quote_name
+    key_fields = [meta.get_field(key) for key in keys]
+    update_fields = [meta.get_field(field) for field in fields]
+    columns = key_fields + update_fields
+    table = qn(meta.db_table)
+    temp_table = qn(f"tmp_{meta.db_table.lower()}_update")
+    drop_sql = f"DROP {'TEMPORARY ' if connection.vendor == 'mysql' else ''}TABLE IF EXISTS {temp_table}"
+
+    prepared = (
+        [f.get_db_prep_save(value, connection) for f, value in zip(columns, row)]
+        for row in rows
+    )
+
+    if connection.vendor not in JOINED_UPDATE_VENDORS:
+        # No joined UPDATE syntax to rely on: fall back to one parameterised UPDATE per row.
+        set_sql = ', '.join(f"{qn(f.column)} = %s" for f in update_fields)
+        where_sql = ' AND '.join(f"{qn(f.column)} = %s" for f in key_fields)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {table} SET {set_sql} WHERE {where_sql}",
+                [row[len(keys):] + row[:len(keys)] for row in prepared],
+            )
+        return len(rows)
+
+    column_sql = ', '.join(qn(f.column) for f in columns)
+    definitions = ', '.join(f"{qn(f.column)} {f.rel_db_type(connection)}" for f in columns)
+    update_sql = joined_update_sql(
+        f"{table} AS m", f"{temp_table} AS t",
+        ' AND '.join(f"m.{qn(f.column)} = t.{qn(f.column)}" for f in key_fields),
+        [(qn(f.column), f"t.{qn(f.column)}") for f in update_fields],
+    )
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # A temporary table left behind by a failed run on this connection is dropped first.
+        cursor.execute(drop_sql)
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {temp_table} ({definitions}, "
+            f"PRIMARY KEY ({', '.join(qn(f.column) for f in key_fields)}))"
+        )
+        insert_sql = f"INSERT INTO {temp_table} ({column_sql}) VALUES ({', '.join(['%s'] * len(columns))})"
+        batch = []
+        for row in prepared:
+            batch.append(row)
+            if len(batch) == LOAD_BATCH_SIZE:
+                cursor.executemany(insert_sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert_sql, batch)
+
+        cursor.execute(update_sql)
+        updated = cursor.rowcount
+        cursor.execute(drop_sql)
+    return updated
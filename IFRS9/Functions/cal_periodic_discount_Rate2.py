@@ -3,6 +3,7 @@ from decimal import Decimal
 from math import pow
 from django.db import transaction
 from ..models import fsi_Financial_Cash_Flow_Cal, Dim_Run
+from .reference_cache import reference_cache
 from .save_log import save_log
 
 def get_latest_run_skey():
@@ -10,7 +11,7 @@ def get_latest_run_skey():
     Retrieve the latest_run_skey from Dim_Run table.
     """
     try:
-        run_record = Dim_Run.objects.first()
+        run_record = reference_cache.first(Dim_Run)
         if not run_record:
             raise ValueError("No run key is available in the Dim_Run table.")
         return run_record.latest_run_skey
@@ -5,6 +5,7 @@ from django.db.models import Sum
 from django.utils import timezone
 from decimal import Decimal
 from ..models import DimExchangeRateConf, Ldn_Exchange_Rate, FCT_Reporting_Lines, ReportingCurrency, Dim_Run
+from .reference_cache import reference_cache
 from .save_log import save_log
 
 EXCHANGE_RATE_API_URL = 'https://v6.exchangerate-api.com/v6/'
@@ -12,7 +13,7 @@ EXCHANGE_RATE_API_URL = 'https://v6.exchangerate-api.com/v6/'
 def get_latest_run_skey():
     """Retrieve the latest_run_skey from Dim_Run table."""
     try:
-        run_record = Dim_Run.objects.first()
+        run_record = reference_cache.first(Dim_Run)
         if not run_record:
             save_log('get_latest_run_skey', 'ERROR', "No run key available in Dim_Run table.")
             return None
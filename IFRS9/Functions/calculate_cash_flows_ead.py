@@ -1,130 +1,108 @@
-from django.db import transaction
-from decimal import Decimal
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from ..models import FSI_Expected_Cashflow, Ldn_Financial_Instrument
+from .bulk_sql import update_from_rows
+from .keyset import account_ranges
 from .save_log import save_log
 
-def calculate_accrued_interest(principal, interest_rate, days, day_count_ind):
-    """
-    Calculate accrued interest based on principal, interest rate, number of days, and day count convention.
-    """
-    day_count = Decimal(360 if day_count_ind == '30/360' else 365)
-    accrued_interest = principal * (interest_rate / Decimal(100)) * (Decimal(days) / day_count)
-    return accrued_interest
+# Approximate number of cash flow rows processed per columnar pass. Chunks always hold whole accounts.
+CHUNK_SIZE = 100000
 
-def calculate_exposure_and_accrued_interest(loan, cash_flow, previous_cash_flow_date):
-    """
-    Calculate the exposure at default and accrued interest for a given cash flow.
-    """
-    try:
-        n_balance = Decimal(cash_flow.n_balance or 0)
-        n_exposure_at_default = n_balance
-
-        if loan.n_curr_interest_rate:
-            interest_rate = Decimal(loan.n_curr_interest_rate)
-            days_since_last_payment = (cash_flow.d_cash_flow_date - previous_cash_flow_date).days
-
-            accrued_interest = calculate_accrued_interest(
-                n_balance,
-                interest_rate,
-                days_since_last_payment,
-                loan.v_day_count_ind
-            )
-            
-            n_exposure_at_default += accrued_interest
-            cash_flow.n_accrued_interest = accrued_interest
-        return n_exposure_at_default
-    except Exception as e:
-        save_log('calculate_exposure_and_accrued_interest', 'ERROR', f"Error for account {loan.v_account_number}, bucket {cash_flow.n_cash_flow_bucket}: {e}")
-        return None
 
-def load_loans_with_id_mapping(fic_mis_date):
+def load_loan_terms(fic_mis_date):
     """
-    Load all loans for the given MIS date into a dictionary with integer-based indexing for quick access.
+    Load the interest rate, day count convention and last payment date of every loan for the MIS date,
+    keyed by account number.
     """
-    loans = Ldn_Financial_Instrument.objects.filter(fic_mis_date=fic_mis_date)
-    loans_cache = {}
-    account_id_mapping = {}  # Map account numbers to integer IDs
-    reverse_id_mapping = {}  # Map integer IDs back to loan records
-    next_id = 1
-
-    for loan in loans:
-        account_number = loan.v_account_number
-        account_id_mapping[account_number] = next_id
-        reverse_id_mapping[next_id] = loan
-        next_id += 1
-    
-    save_log('update_cash_flows_with_ead', 'INFO', f"Loaded {len(account_id_mapping)} loan records with integer indexing for MIS date {fic_mis_date}.")
-    return account_id_mapping, reverse_id_mapping
+    loans = Ldn_Financial_Instrument.objects.filter(fic_mis_date=fic_mis_date).values_list(
+        'v_account_number', 'n_curr_interest_rate', 'v_day_count_ind', 'd_last_payment_date'
+    )
+    loan_terms = {account_number: terms for account_number, *terms in loans}
+    save_log('update_cash_flows_with_ead', 'INFO', f"Loaded {len(loan_terms)} loan records for MIS date {fic_mis_date}.")
+    return loan_terms
+
 
-def process_cash_flows(cash_flows, account_id_mapping, reverse_id_mapping, fic_mis_date):
+def calculate_ead_columns(rows, loan_terms):
     """
-    Process cash flows and update accrued interest and exposure at default using integer-indexed loan data.
+    Calculate accrued interest and exposure at default for cash flow rows (id, account number, cash flow date,
+    balance, accrued interest) ordered by account and date. Each bucket accrues from the account's previous
+    cash flow date, and the first bucket from the loan's last payment date.
+    Returns the (id, exposure at default, accrued interest) updates and the accounts without loan data.
     """
-    bulk_updates = []
-    previous_dates = {}
-    no_update_reasons = {}
-    error_logs = {}
-
-    for cash_flow in cash_flows:
-        try:
-            account_id = account_id_mapping.get(cash_flow.v_account_number)
-            if account_id:
-                loan = reverse_id_mapping[account_id]
-                previous_date = previous_dates.get(account_id, loan.d_last_payment_date or cash_flow.d_cash_flow_date)
-                
-                n_exposure_at_default = calculate_exposure_and_accrued_interest(loan, cash_flow, previous_date)
-                if n_exposure_at_default is not None:
-                    cash_flow.n_exposure_at_default = n_exposure_at_default
-                    bulk_updates.append(cash_flow)
-
-                previous_dates[account_id] = cash_flow.d_cash_flow_date
-            else:
-                reason = f"Loan data not found for account {cash_flow.v_account_number} on MIS date {fic_mis_date}."
-                no_update_reasons[reason] = no_update_reasons.get(reason, 0) + 1
-        except Exception as e:
-            error_message = f"Error processing cash flow for account {cash_flow.v_account_number}, bucket {cash_flow.n_cash_flow_bucket}: {e}"
-            error_logs[error_message] = error_logs.get(error_message, 0) + 1
-
-    if bulk_updates:
-        try:
-            for i in range(0, len(bulk_updates), 5000):
-                FSI_Expected_Cashflow.objects.bulk_update(bulk_updates[i:i + 5000], ['n_exposure_at_default', 'n_accrued_interest'])
-        except Exception as e:
-            error_message = f"Bulk update error: {e}"
-            error_logs[error_message] = error_logs.get(error_message, 0) + 1
-
-    # Log any unique errors and reasons for no updates
-    for reason, count in no_update_reasons.items():
-        save_log('process_cash_flows', 'INFO', f"{reason} occurred for {count} entries.")
-    for error_message, count in error_logs.items():
-        save_log('process_cash_flows', 'ERROR', f"{error_message} occurred {count} times.")
-
-def update_cash_flows_with_ead(fic_mis_date, max_workers=8, batch_size=1000):
+    ids, account_numbers, cash_flow_dates, balances, accrued_interest = zip(*rows)
+    account_numbers = np.array(account_numbers, dtype=object)
+    accounts, account_index = np.unique(account_numbers, return_inverse=True)
+
+    has_loan = np.array([account in loan_terms for account in accounts], dtype=bool)
+    terms = [loan_terms.get(account, (None, None, None)) for account in accounts]
+    interest_rates = np.array([float(rate or 0) for rate, _, _ in terms])[account_index]
+    day_counts = np.array([360 if day_count_ind == '30/360' else 365 for _, day_count_ind, _ in terms])[account_index]
+    last_payment_dates = np.array([last_payment_date for _, _, last_payment_date in terms], dtype='datetime64[D]')[account_index]
+
+    cash_flow_dates = np.array(cash_flow_dates, dtype='datetime64[D]')
+    balances = np.array([float(balance or 0) for balance in balances])
+
+    # Previous cash flow date of the same account, or the last payment date (else the own date) for the first bucket.
+    first_bucket = np.ones(len(ids), dtype=bool)
+    first_bucket[1:] = account_numbers[1:] != account_numbers[:-1]
+    previous_dates = np.empty_like(cash_flow_dates)
+    previous_dates[1:] = cash_flow_dates[:-1]
+    previous_dates[first_bucket] = np.where(
+        np.isnat(last_payment_dates), cash_flow_dates, last_payment_dates
+    )[first_bucket]
+    days = (cash_flow_dates - previous_dates).astype(np.int64)
+
+    accrued = balances * (interest_rates / 100) * (days / day_counts)
+    accrues = interest_rates != 0
+    exposure_at_default = np.where(accrues, balances + accrued, balances)
+
+    updates = [
+        (cash_flow_id, ead, accrued_value if accrues_interest else existing)
+        for cash_flow_id, ead, accrued_value, accrues_interest, existing, loan_found in zip(
+            ids, exposure_at_default.tolist(), accrued.tolist(), accrues.tolist(), accrued_interest,
+            has_loan[account_index].tolist(),
+        )
+        if loan_found
+    ]
+    return updates, accounts[~has_loan].tolist()
+
+
+def update_cash_flows_with_ead(fic_mis_date, chunk_size=CHUNK_SIZE):
     """
-    Main function to update cash flows with Exposure at Default and Accrued Interest.
+    Main function to update cash flows with Exposure at Default and Accrued Interest. Cash flows are
+    processed as column arrays, whole accounts at a time, and written back with one joined UPDATE per chunk.
     """
     try:
-        account_id_mapping, reverse_id_mapping = load_loans_with_id_mapping(fic_mis_date)
+        loan_terms = load_loan_terms(fic_mis_date)
 
-        cash_flows = FSI_Expected_Cashflow.objects.filter(fic_mis_date=fic_mis_date).order_by('v_account_number', 'd_cash_flow_date')
-        total_cash_flows = cash_flows.count()
-        if total_cash_flows == 0:
+        cash_flows = FSI_Expected_Cashflow.objects.filter(fic_mis_date=fic_mis_date)
+        ranges = account_ranges(cash_flows, chunk_size)
+        if not ranges:
             save_log('update_cash_flows_with_ead', 'INFO', f"No cash flows found for fic_mis_date {fic_mis_date}.")
             return 0
 
-        cash_flow_batches = [cash_flows[i:i + batch_size] for i in range(0, total_cash_flows, batch_size)]
-        save_log('update_cash_flows_with_ead', 'INFO', f"Processing {total_cash_flows} cash flow buckets in {len(cash_flow_batches)} batches...")
+        save_log('update_cash_flows_with_ead', 'INFO', f"Processing cash flow buckets in {len(ranges)} account chunks...")
+
+        total_updated = 0
+        missing_accounts = []
+        for first_account, last_account in ranges:
+            rows = list(cash_flows.filter(
+                v_account_number__gte=first_account, v_account_number__lte=last_account
+            ).order_by('v_account_number', 'd_cash_flow_date').values_list(
+                'id', 'v_account_number', 'd_cash_flow_date', 'n_balance', 'n_accrued_interest'
+            ))
+            updates, chunk_missing = calculate_ead_columns(rows, loan_terms)
+            total_updated += update_from_rows(
+                FSI_Expected_Cashflow, ['id'], ['n_exposure_at_default', 'n_accrued_interest'], updates
+            )
+            missing_accounts.extend(chunk_missing)
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(process_cash_flows, batch, account_id_mapping, reverse_id_mapping, fic_mis_date) for batch in cash_flow_batches]
-            for future in as_completed(futures):
-                try:
-                    future.result()  # Retrieve results to raise any exceptions
-                except Exception as exc:
-                    save_log('update_cash_flows_with_ead', 'ERROR', f"Thread encountered an error: {exc}")
+        if missing_accounts:
+            save_log(
+                'update_cash_flows_with_ead', 'INFO',
+                f"Loan data not found for {len(missing_accounts)} accounts on MIS date {fic_mis_date} (first: {missing_accounts[0]})."
+            )
 
-        save_log('update_cash_flows_with_ead', 'INFO', f"Updated {total_cash_flows} cash flow buckets with Exposure at Default and Accrued Interest.")
+        save_log('update_cash_flows_with_ead', 'INFO', f"Updated {total_updated} cash flow buckets with Exposure at Default and Accrued Interest.")
         return 1
     except Exception as e:
         save_log('update_cash_flows_with_ead', 'ERROR', f"Error updating cash flows for fic_mis_date {fic_mis_date}: {e}")
@@ -136,7 +114,6 @@ def update_cash_flows_with_ead(fic_mis_date, max_workers=8, batch_size=1000):
 
 
 
-
 # from django.db import transaction
 # from decimal import Decimal
 # from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -2,13 +2,14 @@ from concurrent.futures import ThreadPoolExecutor
 from django.db.models import Sum
 from django.db import transaction
 from ..models import FCT_Reporting_Lines, fsi_Financial_Cash_Flow_Cal, ECLMethod, Dim_Run
+from .reference_cache import reference_cache
 from .save_log import save_log
 
 BATCH_SIZE = 5000
 
 def get_latest_run_skey():
     try:
-        run_record = Dim_Run.objects.first()
+        run_record = reference_cache.first(Dim_Run)
         if not run_record:
             save_log('get_latest_run_skey', 'ERROR', "No run key is available in the Dim_Run table.")
             return None
@@ -23,7 +24,7 @@ def calculate_ecl_based_on_method(fic_mis_date):
         if not n_run_key:
             return '0'
 
-        ecl_method_record = ECLMethod.objects.first()
+        ecl_method_record = reference_cache.first(ECLMethod)
         if not ecl_method_record:
             save_log('calculate_ecl_based_on_method', 'ERROR', "No ECL method is defined in the ECLMethod table.")
             return '0'
@@ -2,6 +2,7 @@ from decimal import Decimal, InvalidOperation
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from math import pow
 from ..models import FCT_Stage_Determination
+from .keyset import keyset_batches
 from .save_log import save_log
 
 MAX_EIR = Decimal('999.99999999999')  # Max value with 15 digits and 11 decimal places
@@ -50,8 +51,7 @@ def update_stage_determination_eir(fic_mis_date, max_workers=8, batch_size=5000)
         )
         
         total_entries = stage_determination_entries.count()
-        batches = [stage_determination_entries[i:i + batch_size] for i in range(0, total_entries, batch_size)]
-        save_log('update_stage_determination_eir', 'INFO', f"Processing {total_entries} entries in {len(batches)} batches...")
+        save_log('update_stage_determination_eir', 'INFO', f"Processing {total_entries} entries in {-(-total_entries // batch_size)} batches...")
 
         error_logs = {}
 
@@ -77,7 +77,10 @@ def update_stage_determination_eir(fic_mis_date, max_workers=8, batch_size=5000)
                     error_logs[f"Bulk update error: {e}"] = 1
 
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(process_batch, batch) for batch in batches]
+            futures = [
+                executor.submit(process_batch, batch)
+                for batch in keyset_batches(stage_determination_entries, batch_size)
+            ]
             for future in as_completed(futures):
                 try:
                     future.result()
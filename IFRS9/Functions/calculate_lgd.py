@@ -2,6 +2,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.db import transaction
 from decimal import Decimal
 from ..models import FCT_Stage_Determination, CollateralLGD, Ldn_LGD_Term_Structure
+from .reference_cache import reference_cache
 from .save_log import save_log
 
 def update_lgd_for_stage_determination_term_structure(mis_date):
@@ -10,7 +11,7 @@ def update_lgd_for_stage_determination_term_structure(mis_date):
     """
     try:
         # Cache term structure data for fast lookup
-        term_structure_cache = {ts.v_lgd_term_structure_id: ts.n_lgd_percent for ts in Ldn_LGD_Term_Structure.objects.all()}
+        term_structure_cache = reference_cache.mapping(Ldn_LGD_Term_Structure, 'v_lgd_term_structure_id', 'n_lgd_percent')
 
         # Get entries with NULL `n_lgd_percent` for the given MIS date
         stage_determination_entries = FCT_Stage_Determination.objects.filter(
@@ -1,88 +1,42 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from django.db.models import F
+from django.db import connection, transaction
 from ..models import fsi_Financial_Cash_Flow_Cal, Dim_Run
+from .bulk_sql import JOINED_UPDATE_VENDORS, joined_update_sql, update_from_rows
+from .keyset import account_ranges
+from .reference_cache import reference_cache
 from .save_log import save_log
 
+# Rows per account range read by the streaming Python path.
+ACCOUNT_CHUNK_SIZE = 50000
+
 def get_latest_run_skey():
     try:
-        run_record = Dim_Run.objects.first()
+        run_record = reference_cache.first(Dim_Run)
         if not run_record:
             raise ValueError("No run key is available in the Dim_Run table.")
         return run_record.latest_run_skey
     except Dim_Run.DoesNotExist:
         raise ValueError("Dim_Run table is missing.")
 
-def update_marginal_pd(fic_mis_date, max_workers=5, batch_size=1000):
+def update_marginal_pd(fic_mis_date, chunk_size=ACCOUNT_CHUNK_SIZE):
+    """
+    Derive the per-period PDs of each cash flow as the change in cumulative PD from the account's previous
+    bucket. Databases with window functions and a joined UPDATE do this in one statement with LAG(); others
+    stream the cash flows in account and bucket order, keeping only the previous row.
+    """
     try:
         n_run_skey = get_latest_run_skey()
         cash_flows = fsi_Financial_Cash_Flow_Cal.objects.filter(
             fic_mis_date=fic_mis_date, n_run_skey=n_run_skey
-        ).order_by('v_account_number', 'n_cash_flow_bucket_id')
+        )
         
         if not cash_flows.exists():
             save_log('update_marginal_pd', 'INFO', f"No cash flows found for fic_mis_date {fic_mis_date} and run_skey {n_run_skey}.")
             return 0
 
-        total_updated_records = 0
-        cash_flow_dict = {}
-        
-        # Populate dictionary with all cash flows for quick access
-        for cash_flow in cash_flows:
-            account_key = (cash_flow.v_account_number, cash_flow.n_cash_flow_bucket_id)
-            cash_flow_dict[account_key] = cash_flow
-
-        def process_batch(batch):
-            try:
-                updates = []
-                for cash_flow in batch:
-                    prev_key = (cash_flow.v_account_number, cash_flow.n_cash_flow_bucket_id - 1)
-                    previous_cash_flow = cash_flow_dict.get(prev_key)
-
-                    # Calculate n_per_period_impaired_prob
-                    if cash_flow.n_cumulative_impaired_prob is not None:
-                        if previous_cash_flow and previous_cash_flow.n_cumulative_impaired_prob is not None:
-                            cash_flow.n_per_period_impaired_prob = abs(cash_flow.n_cumulative_impaired_prob - previous_cash_flow.n_cumulative_impaired_prob)
-                        else:
-                            cash_flow.n_per_period_impaired_prob = abs(cash_flow.n_cumulative_impaired_prob)
-
-                    # Calculate n_12m_per_period_pd
-                    if cash_flow.n_12m_cumulative_pd is not None:
-                        if previous_cash_flow and previous_cash_flow.n_12m_cumulative_pd is not None:
-                            cash_flow.n_12m_per_period_pd = abs(cash_flow.n_12m_cumulative_pd - previous_cash_flow.n_12m_cumulative_pd)
-                        else:
-                            cash_flow.n_12m_per_period_pd = abs(cash_flow.n_12m_cumulative_pd)
-
-                    updates.append(cash_flow)
-
-                # Bulk update for the current batch
-                if updates:
-                    fsi_Financial_Cash_Flow_Cal.objects.bulk_update(
-                        updates, ['n_per_period_impaired_prob', 'n_12m_per_period_pd']
-                    )
-                return len(updates)
-
-            except Exception as e:
-                save_log('update_marginal_pd', 'ERROR', f"Error updating batch: {e}")
-                return 0
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            batch = []
-            for cash_flow in cash_flows.iterator(chunk_size=batch_size):
-                batch.append(cash_flow)
-                if len(batch) >= batch_size:
-                    futures.append(executor.submit(process_batch, batch))
-                    batch = []
-
-            if batch:
-                futures.append(executor.submit(process_batch, batch))
-
-            for future in as_completed(futures):
-                try:
-                    total_updated_records += future.result()
-                except Exception as exc:
-                    save_log('update_marginal_pd', 'ERROR', f"Thread encountered an error: {exc}")
-                    return 0
+        if connection.vendor in JOINED_UPDATE_VENDORS and connection.features.supports_over_clause:
+            total_updated_records = update_marginal_pd_sql(fic_mis_date, n_run_skey)
+        else:
+            total_updated_records = update_marginal_pd_python(cash_flows, chunk_size)
 
         save_log('update_marginal_pd', 'INFO', f"Total updated records for run_skey {n_run_skey} and fic_mis_date {fic_mis_date}: {total_updated_records}")
         return 1 if total_updated_records > 0 else 0
@@ -90,3 +44,87 @@ def update_marginal_pd(fic_mis_date, max_workers=5, batch_size=1000):
     except Exception as e:
         save_log('update_marginal_pd', 'ERROR', f"Error during marginal PD update process: {e}")
         return 0
+
+
+def update_marginal_pd_sql(fic_mis_date, n_run_skey):
+    """
+    Single UPDATE joined to a LAG() window over each account's cash flows in bucket order. The previous row only
+    counts when it is the immediately preceding bucket.
+    """
+    meta = fsi_Financial_Cash_Flow_Cal._meta
+    qn = connection.ops.quote_name
+    column = {f.name: qn(f.column) for f in meta.concrete_fields}
+    pk = qn(meta.pk.column)
+    bucket = column['n_cash_flow_bucket_id']
+    window = f"OVER (PARTITION BY {column['v_account_number']} ORDER BY {bucket}, {pk})"
+
+    source = (
+        f"(SELECT {pk}, LAG({bucket}) {window} AS prev_bucket, "
+        f"LAG({column['n_cumulative_impaired_prob']}) {window} AS prev_impaired_prob, "
+        f"LAG({column['n_12m_cumulative_pd']}) {window} AS prev_12m_pd "
+        f"FROM {qn(meta.db_table)} "
+        f"WHERE {column['fic_mis_date']} = %s AND {column['n_run_skey']} = %s AND {bucket} IS NOT NULL) AS p"
+    )
+
+    def per_period(cumulative, previous, target):
+        return (
+            f"CASE WHEN m.{cumulative} IS NULL THEN m.{target} "
+            f"ELSE ABS(m.{cumulative} - COALESCE(CASE WHEN p.prev_bucket = m.{bucket} - 1 THEN p.{previous} END, 0)) END"
+        )
+
+    sql = joined_update_sql(
+        f"{qn(meta.db_table)} AS m", source, f"m.{pk} = p.{pk}",
+        [
+            (column['n_per_period_impaired_prob'], per_period(column['n_cumulative_impaired_prob'], 'prev_impaired_prob', column['n_per_period_impaired_prob'])),
+            (column['n_12m_per_period_pd'], per_period(column['n_12m_cumulative_pd'], 'prev_12m_pd', column['n_12m_per_period_pd'])),
+        ],
+    )
+    params = [
+        meta.get_field('fic_mis_date').get_db_prep_value(fic_mis_date, connection),
+        n_run_skey,
+    ]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def update_marginal_pd_python(cash_flows, chunk_size=ACCOUNT_CHUNK_SIZE):
+    """
+    Stream the cash flows of each account range in account and bucket order, keeping only the previous row,
+    and write each range with one joined UPDATE.
+    """
+    cash_flows = cash_flows.filter(n_cash_flow_bucket_id__isnull=False)
+    total_updated_records = 0
+
+    for first_account, last_account in account_ranges(cash_flows, chunk_size):
+        rows = cash_flows.filter(
+            v_account_number__gte=first_account, v_account_number__lte=last_account
+        ).order_by('v_account_number', 'n_cash_flow_bucket_id', 'pk').values_list(
+            'pk', 'v_account_number', 'n_cash_flow_bucket_id', 'n_cumulative_impaired_prob', 'n_12m_cumulative_pd',
+            'n_per_period_impaired_prob', 'n_12m_per_period_pd',
+        )
+
+        updates = []
+        previous = None
+        for pk, account_number, bucket, impaired_prob, twelve_month_pd, per_period_impaired_prob, twelve_month_per_period_pd in rows:
+            if previous is None or previous[0] != account_number or previous[1] != bucket - 1:
+                previous_impaired_prob = previous_12m_pd = None
+            else:
+                _, _, previous_impaired_prob, previous_12m_pd = previous
+
+            # Calculate n_per_period_impaired_prob
+            if impaired_prob is not None:
+                per_period_impaired_prob = abs(impaired_prob - (previous_impaired_prob or 0))
+
+            # Calculate n_12m_per_period_pd
+            if twelve_month_pd is not None:
+                twelve_month_per_period_pd = abs(twelve_month_pd - (previous_12m_pd or 0))
+
+            updates.append((pk, per_period_impaired_prob, twelve_month_per_period_pd))
+            previous = (account_number, bucket, impaired_prob, twelve_month_pd)
+
+        total_updated_records += update_from_rows(
+            fsi_Financial_Cash_Flow_Cal, ['id'], ['n_per_period_impaired_prob', 'n_12m_per_period_pd'], updates
+        )
+
+    return total_updated_records
@@ -1,43 +1,73 @@
+import calendar
 from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from django.conf import settings
 from django.db import transaction
-from datetime import timedelta, date
+from datetime import date
 from ..models import *
+from .cashflow_writer import CASH_FLOW_COLUMNS, CashFlowWriter
+from .payment_dates import get_date_convention, get_payment_interval, payment_count, payment_date_grid, periods_per_year
+from .query_counter import QueryCounter
+from .reference_cache import reference_cache
 from .save_log import save_log
 
 BATCH_SIZE = 5000
 
-def get_payment_interval(v_amrt_term_unit, day_count_ind):
-    """Determine the payment interval in days based on repayment type and day count convention."""
-    if day_count_ind == '30/360':
-        return {
-            'D': timedelta(days=1),
-            'W': timedelta(weeks=1),
-            'M': timedelta(days=30),
-            'Q': timedelta(days=90),
-            'H': timedelta(days=180),
-            'Y': timedelta(days=360)
-        }.get(v_amrt_term_unit, timedelta(days=30))
-    elif day_count_ind == '30/365':
-        return {
-            'D': timedelta(days=1),
-            'W': timedelta(weeks=1),
-            'M': timedelta(days=30),
-            'Q': timedelta(days=91),
-            'H': timedelta(days=182),
-            'Y': timedelta(days=365)
-        }.get(v_amrt_term_unit, timedelta(days=30))
-    else:
-        return timedelta(days=30)
+# Maximum number of account numbers bound into a single IN (...) filter.
+FILTER_CHUNK_SIZE = 900
+
+# Maximum number of (rate, periods, periods per year) combinations kept by annuity_factor.
+ANNUITY_CACHE_SIZE = 4096
+
+# Reasons a loan cannot be projected, shared by the projection engines so their logs agree.
+NO_PAYMENT_DATES = "no payment date on or before the maturity date"
+ZERO_AMORTIZED_RATE = "zero interest rate for amortized loan"
+MISSING_START_DATE = "missing start date"
+FEE_ANNIVERSARY_29_FEB = "fee anniversary of a 29 February start date falls in a non-leap year"
+MISSING_REPAYMENT_TYPE_OR_CURRENCY = "missing repayment type or currency code"
+
+
+@lru_cache(maxsize=ANNUITY_CACHE_SIZE)
+def annuity_factor(fixed_interest_rate, periods, rate_periods_per_year):
+    """
+    Periodic rate and annuity factor for an amortized loan. Loans sharing a product rate and tenor share the
+    same factors, so results are cached for the run.
+    """
+    interest_rate_per_period = fixed_interest_rate / rate_periods_per_year
+    if periods <= 0:
+        raise ValueError(NO_PAYMENT_DATES)
+    if interest_rate_per_period == 0:
+        raise ValueError(ZERO_AMORTIZED_RATE)
+    return interest_rate_per_period, interest_rate_per_period / (1 - (1 + interest_rate_per_period) ** -periods)
+
 
+def fee_anniversary(start_date, year):
+    """The anniversary of start_date in year, on which the management fee is due."""
+    if start_date is None:
+        raise ValueError(MISSING_START_DATE)
+    if start_date.month == 2 and start_date.day == 29 and not calendar.isleap(year):
+        raise ValueError(FEE_ANNIVERSARY_29_FEB)
+    return start_date.replace(year=year)
 
-def calculate_cash_flows_for_loan(loan):
+
+def calculate_cash_flows_for_loan(loan, payment_schedule=None, interest_method=None, writer=None):
+    """
+    Project the cash flows of one loan. payment_schedule is the loan's entry from load_payment_schedules
+    and interest_method the Fsi_Interest_Method to use; either is looked up when not given. The rows are
+    handed to writer when given and bulk-created otherwise.
+    """
     try:
         cashflows_to_create = []
 
-        payment_schedule = Ldn_Payment_Schedule.objects.filter(
-            v_account_number=loan.v_account_number,
-            fic_mis_date=loan.fic_mis_date
-        ).order_by('d_payment_date')
+        if payment_schedule is None:
+            # Only this loan's schedule rows are read.
+            payment_schedule = [
+                (payment_date, float(principal or 0.0), float(interest or 0.0))
+                for payment_date, principal, interest in Ldn_Payment_Schedule.objects.filter(
+                    v_account_number=loan.v_account_number,
+                    fic_mis_date=loan.fic_mis_date
+                ).order_by('d_payment_date').values_list('d_payment_date', 'n_principal_payment_amt', 'n_interest_payment_amt')
+            ]
 
         balance = float(loan.n_eop_bal) if loan.n_eop_bal is not None else 0.0
         starting_balance = balance
@@ -48,51 +78,45 @@ def calculate_cash_flows_for_loan(loan):
         v_amrt_term_unit = loan.v_amrt_term_unit
         repayment_type = loan.v_amrt_repayment_type
         v_day_count_ind = loan.v_day_count_ind
-        cashflow_bucket = 1
+        convention = get_date_convention()
 
-        interest_method = Fsi_Interest_Method.objects.first() or Fsi_Interest_Method.objects.create(
-            v_interest_method='Simple', description="Default Simple Interest Method"
-        )
+        if interest_method is None:
+            interest_method = get_interest_method()
 
-        payment_interval = get_payment_interval(v_amrt_term_unit, v_day_count_ind)
-        periods = ((loan.d_maturity_date - current_date).days // payment_interval.days) + 1
+        periods = payment_count(current_date, loan.d_maturity_date, v_amrt_term_unit, v_day_count_ind, convention)
 
-        if payment_schedule.exists():
-            for bucket, schedule in enumerate(payment_schedule, start=1):
-                principal_payment = schedule.n_principal_payment_amt or 0.0
-                interest_payment = schedule.n_interest_payment_amt or 0.0
+        if payment_schedule:
+            for bucket, (payment_date, principal_payment, interest_payment) in enumerate(payment_schedule, start=1):
                 total_payment = principal_payment + interest_payment
                 balance -= principal_payment
 
-                cashflows_to_create.append(FSI_Expected_Cashflow(
-                    fic_mis_date=loan.fic_mis_date,
-                    v_account_number=loan.v_account_number,
-                    n_cash_flow_bucket=bucket,
-                    d_cash_flow_date=schedule.d_payment_date,
-                    n_principal_payment=principal_payment,
-                    n_interest_payment=interest_payment,
-                    n_cash_flow_amount=total_payment,
-                    n_balance=balance,
-                    V_CCY_CODE=loan.v_ccy_code,
+                cashflows_to_create.append((
+                    loan.fic_mis_date, loan.v_account_number, bucket, payment_date, principal_payment,
+                    interest_payment, total_payment, balance, '', 0.0, loan.v_ccy_code,
                 ))
         else:
+            if periods == 0:
+                raise ValueError(NO_PAYMENT_DATES)
             fixed_principal_payment = round(starting_balance / periods, 2)
+            payment_dates, accrual_fractions = payment_date_grid(
+                current_date, v_amrt_term_unit, periods, v_day_count_ind, convention
+            )
+            rate_periods_per_year = periods_per_year(v_amrt_term_unit, v_day_count_ind, convention)
 
-            while current_date <= loan.d_maturity_date:
+            for cashflow_bucket, (current_date, accrual_fraction) in enumerate(
+                zip(payment_dates.tolist(), accrual_fractions.tolist()), start=1
+            ):
                 principal_payment, interest_payment = 0.0, 0.0
 
-                day_count_factor = 360 if v_day_count_ind == '30/360' else 365
                 if interest_method.v_interest_method == 'Simple':
-                    interest_payment = balance * fixed_interest_rate * (payment_interval.days / day_count_factor)
+                    interest_payment = balance * fixed_interest_rate * accrual_fraction
                 elif interest_method.v_interest_method == 'Amortized':
-                    interest_rate_per_period = fixed_interest_rate / (day_count_factor / payment_interval.days)
-                    if interest_rate_per_period == 0 or periods <= 0:
-                        raise ValueError("Invalid interest rate per period or periods for amortized calculation")
-                    total_payment = starting_balance * (interest_rate_per_period / (1 - (1 + interest_rate_per_period) ** -periods))
+                    interest_rate_per_period, factor = annuity_factor(fixed_interest_rate, periods, rate_periods_per_year)
+                    total_payment = starting_balance * factor
                     interest_payment = balance * interest_rate_per_period
                     principal_payment = total_payment - interest_payment
                 else:
-                    interest_payment = balance * fixed_interest_rate * (payment_interval.days / day_count_factor)
+                    interest_payment = balance * fixed_interest_rate * accrual_fraction
 
                 wht_payment = interest_payment * withholding_tax
                 interest_payment_net = interest_payment - wht_payment
@@ -103,31 +127,29 @@ def calculate_cash_flows_for_loan(loan):
                     principal_payment = fixed_principal_payment
 
                 management_fee_net = 0.0
-                management_fee_date = loan.d_start_date.replace(year=current_date.year + 1)
+                management_fee_date = fee_anniversary(loan.d_start_date, current_date.year + 1)
                 if current_date.month == management_fee_date.month and current_date.year == management_fee_date.year and management_fee_rate:
                     management_fee_net = balance * management_fee_rate - (balance * management_fee_rate * withholding_tax)
 
                 total_payment = principal_payment + interest_payment_net + management_fee_net
 
-                cashflows_to_create.append(FSI_Expected_Cashflow(
-                    fic_mis_date=loan.fic_mis_date,
-                    v_account_number=loan.v_account_number,
-                    n_cash_flow_bucket=cashflow_bucket,
-                    d_cash_flow_date=current_date,
-                    n_principal_payment=principal_payment,
-                    n_interest_payment=interest_payment + management_fee_net,
-                    n_cash_flow_amount=total_payment,
-                    n_balance=balance - principal_payment,
-                    V_CASH_FLOW_TYPE=repayment_type,
-                    management_fee_added=management_fee_net,
-                    V_CCY_CODE=loan.v_ccy_code,
+                cashflows_to_create.append((
+                    loan.fic_mis_date, loan.v_account_number, cashflow_bucket, current_date, principal_payment,
+                    interest_payment + management_fee_net, total_payment, balance - principal_payment,
+                    repayment_type, management_fee_net, loan.v_ccy_code,
                 ))
 
                 balance -= principal_payment
-                current_date += payment_interval
-                cashflow_bucket += 1
                 periods -= 1
 
+        if loan.v_ccy_code is None or (not payment_schedule and repayment_type is None):
+            raise ValueError(MISSING_REPAYMENT_TYPE_OR_CURRENCY)
+
+        if writer is not None:
+            writer.put_rows(cashflows_to_create)
+            return
+
+        cashflows_to_create = [FSI_Expected_Cashflow(**dict(zip(CASH_FLOW_COLUMNS, row))) for row in cashflows_to_create]
         with transaction.atomic():
             for i in range(0, len(cashflows_to_create), BATCH_SIZE):
                 FSI_Expected_Cashflow.objects.bulk_create(cashflows_to_create[i:i + BATCH_SIZE])
@@ -140,25 +162,104 @@ def calculate_cash_flows_for_loan(loan):
         )
 
 
+def get_interest_method():
+    return reference_cache.first(Fsi_Interest_Method) or Fsi_Interest_Method.objects.create(
+        v_interest_method='Simple', description="Default Simple Interest Method"
+    )
+
+
+def load_payment_schedules(fic_mis_date, account_numbers=None):
+    """
+    Load every payment schedule for the MIS date in one ordered query and index it by account number.
+    Each entry is a list of (d_payment_date, principal, interest) tuples in payment date order.
+    When account_numbers is given only the schedules of those accounts are read, in chunks of
+    FILTER_CHUNK_SIZE accounts per query.
+    """
+    schedules = {}
+    payment_schedules = Ldn_Payment_Schedule.objects.filter(fic_mis_date=fic_mis_date)
+    if account_numbers is None:
+        querysets = [payment_schedules]
+    else:
+        account_numbers = list(account_numbers)
+        querysets = [
+            payment_schedules.filter(v_account_number__in=account_numbers[i:i + FILTER_CHUNK_SIZE])
+            for i in range(0, len(account_numbers), FILTER_CHUNK_SIZE)
+        ]
+
+    for queryset in querysets:
+        rows = queryset.order_by('v_account_number', 'd_payment_date').values_list(
+            'v_account_number', 'd_payment_date', 'n_principal_payment_amt', 'n_interest_payment_amt'
+        )
+        for account_number, payment_date, principal, interest in rows.iterator(chunk_size=BATCH_SIZE):
+            schedules.setdefault(account_number, []).append(
+                (payment_date, float(principal or 0.0), float(interest or 0.0))
+            )
+    return schedules
+
+
 def project_cash_flows(fic_mis_date):
+    engine = getattr(settings, 'IFRS9_CASHFLOW_ENGINE', 'loan')
+    # Imported here because the engines reuse the helpers defined in this module.
+    if getattr(settings, 'IFRS9_CASHFLOW_INCREMENTAL', False):
+        from .cashflow_incremental import project_cash_flows_incremental
+        return project_cash_flows_incremental(fic_mis_date)
+    if engine == 'vectorized':
+        from .cashflow_engine import project_cash_flows_vectorized
+        return project_cash_flows_vectorized(fic_mis_date)
+    if engine == 'sharded':
+        from .cashflow_shards import project_cash_flows_sharded
+        return project_cash_flows_sharded(fic_mis_date)
+
+    queries = QueryCounter()
+
+    def project_loans(executor, loans, schedules, interest_method, writer):
+        futures = [
+            executor.submit(
+                calculate_cash_flows_for_loan, loan, schedules.get(loan.v_account_number, []), interest_method, writer
+            )
+            for loan in loans
+        ]
+        for future in futures:
+            future.result()
+
     try:
-        FSI_Expected_Cashflow.objects.filter(fic_mis_date=fic_mis_date).delete()
-        loans = Ldn_Financial_Instrument.objects.filter(fic_mis_date=fic_mis_date)
-        if not loans.exists():
-            save_log('project_cash_flows', 'ERROR', f"No loans found for the given fic_mis_date: {fic_mis_date}", status='FAILURE')
-            return 0
+        with queries.install():
+            FSI_Expected_Cashflow.objects.filter(fic_mis_date=fic_mis_date).delete()
+            FSI_Cashflow_Fingerprint.objects.filter(fic_mis_date=fic_mis_date).delete()
+            loans = Ldn_Financial_Instrument.objects.filter(fic_mis_date=fic_mis_date)
+            if not loans.exists():
+                save_log('project_cash_flows', 'ERROR', f"No loans found for the given fic_mis_date: {fic_mis_date}", status='FAILURE')
+                return 0
 
-        num_threads = min(10, loans.count())
+            schedules = load_payment_schedules(fic_mis_date)
+            interest_method = get_interest_method()
+        annuity_factor.cache_clear()
 
-        with ThreadPoolExecutor(max_workers=num_threads) as executor:
-            futures = [executor.submit(calculate_cash_flows_for_loan, loan) for loan in loans]
-            for future in futures:
-                future.result()
+        # Loans are streamed in chunks so only one chunk and the writer queue are held in memory.
+        total_loans = 0
+        with CashFlowWriter(queries=queries) as writer, ThreadPoolExecutor(max_workers=10) as executor, queries.install():
+            chunk = []
+            for loan in loans.iterator(chunk_size=BATCH_SIZE):
+                chunk.append(loan)
+                if len(chunk) == BATCH_SIZE:
+                    project_loans(executor, chunk, schedules, interest_method, writer)
+                    total_loans += len(chunk)
+                    chunk = []
+            project_loans(executor, chunk, schedules, interest_method, writer)
+            total_loans += len(chunk)
 
-        total_cash_flows = FSI_Expected_Cashflow.objects.filter(fic_mis_date=fic_mis_date).count()
+        annuity_cache = annuity_factor.cache_info()
+        if annuity_cache.hits or annuity_cache.misses:
+            save_log(
+                'project_cash_flows', 'INFO',
+                f"Annuity factor cache: {annuity_cache.hits} hits, {annuity_cache.misses} misses "
+                f"({annuity_cache.hits / (annuity_cache.hits + annuity_cache.misses):.1%} hit ratio), "
+                f"{annuity_cache.currsize} entries."
+            )
         save_log(
             'project_cash_flows', 'INFO', 
-            f"Total of {total_cash_flows} cash flows projected for {loans.count()} loans for MIS date {fic_mis_date}.", 
+            f"Total of {writer.rows_written} cash flows projected for {total_loans} loans for MIS date {fic_mis_date} "
+            f"using {queries.count} database queries.",
             status='SUCCESS'
         )
         return 1
@@ -2,6 +2,7 @@ from concurrent.futures import ThreadPoolExecutor
 from django.db import transaction
 from datetime import timedelta, date
 from ..models import *
+from .reference_cache import reference_cache
 from .save_log import save_log
 
 
@@ -62,7 +63,7 @@ def calculate_cash_flows_for_loan(loan):
             v_day_count_ind = loan.v_day_count_ind
             cashflow_bucket = 1
 
-            interest_method = Fsi_Interest_Method.objects.first() or Fsi_Interest_Method.objects.create(
+            interest_method = reference_cache.first(Fsi_Interest_Method) or Fsi_Interest_Method.objects.create(
                 v_interest_method='Simple', description="Default Simple Interest Method"
             )
 
@@ -0,0 +1,311 @@
+import calendar
+import numpy as np
+from collections import defaultdict
+from ..models import FSI_Cashflow_Fingerprint, FSI_Expected_Cashflow, Ldn_Financial_Instrument
+from .cashflow import (
+    FEE_ANNIVERSARY_29_FEB, FILTER_CHUNK_SIZE, MISSING_REPAYMENT_TYPE_OR_CURRENCY, MISSING_START_DATE,
+    NO_PAYMENT_DATES, ZERO_AMORTIZED_RATE, get_interest_method, load_payment_schedules,
+)
+from .cashflow_writer import CashFlowWriter
+from .payment_dates import get_date_convention, payment_counts, payment_date_grid, periods_per_year
+from .query_counter import QueryCounter
+from .save_log import save_log
+
+# Number of loans projected together in one set of period arrays. Keeps the
+# (loans x periods) matrices bounded for long-dated books.
+LOAN_CHUNK_SIZE = 10000
+
+LOAN_FIELDS = (
+    'v_account_number', 'n_eop_bal', 'n_curr_interest_rate', 'n_wht_percent', 'v_management_fee_rate',
+    'v_amrt_term_unit', 'v_amrt_repayment_type', 'v_day_count_ind', 'v_ccy_code',
+    'd_start_date', 'd_next_payment_date', 'd_maturity_date', 'fic_mis_date',
+)
+
+
+def load_loan_arrays(fic_mis_date, account_numbers=None):
+    """
+    Load the projection attributes of every loan for the MIS date into column arrays.
+    When account_numbers is given only those loans are loaded.
+    """
+    loans = Ldn_Financial_Instrument.objects.filter(fic_mis_date=fic_mis_date)
+    if account_numbers is None:
+        rows = list(loans.values_list(*LOAN_FIELDS))
+    else:
+        rows = []
+        for i in range(0, len(account_numbers), FILTER_CHUNK_SIZE):
+            rows.extend(loans.filter(
+                v_account_number__in=account_numbers[i:i + FILTER_CHUNK_SIZE]
+            ).values_list(*LOAN_FIELDS))
+    return loan_rows_to_arrays(rows)
+
+
+def loan_rows_to_arrays(rows):
+    """
+    Convert LOAN_FIELDS value rows into the column arrays used by the projection.
+    """
+    columns = dict(zip(LOAN_FIELDS, zip(*rows))) if rows else {field: () for field in LOAN_FIELDS}
+
+    def to_float(values, scale=1.0):
+        return np.array([float(v) / scale if v is not None else 0.0 for v in values], dtype=np.float64)
+
+    return {
+        'count': len(rows),
+        'account_number': np.array(columns['v_account_number'], dtype=object),
+        'balance': to_float(columns['n_eop_bal']),
+        'interest_rate': to_float(columns['n_curr_interest_rate'], 100.0),
+        'wht_rate': to_float(columns['n_wht_percent']),
+        'amrt_term_unit': np.array(columns['v_amrt_term_unit'], dtype=object),
+        'repayment_type': np.array(columns['v_amrt_repayment_type'], dtype=object),
+        'day_count_ind': np.array(columns['v_day_count_ind'], dtype=object),
+        'ccy_code': np.array(columns['v_ccy_code'], dtype=object),
+        'start_date': np.array(columns['d_start_date'], dtype=object),
+        'next_payment_date': np.array(columns['d_next_payment_date'], dtype=object),
+        'maturity_date': np.array(columns['d_maturity_date'], dtype=object),
+        'fic_mis_date': np.array(columns['fic_mis_date'], dtype=object),
+    }
+
+
+def group_loans(loans, indices):
+    """
+    Group loan indices by (amortization unit, day count, repayment type).
+    """
+    groups = {}
+    for i in indices:
+        key = (loans['amrt_term_unit'][i], loans['day_count_ind'][i], loans['repayment_type'][i])
+        groups.setdefault(key, []).append(i)
+    return {key: np.array(members, dtype=np.int64) for key, members in groups.items()}
+
+
+def fails_management_fee_date(start_date, first_date, last_date):
+    """
+    The per-loan path looks up the fee anniversary of d_start_date in the year after every payment, which
+    fails for a 29 February start date whenever that year is not a leap year.
+    """
+    if start_date.month != 2 or start_date.day != 29:
+        return False
+    return any(not calendar.isleap(year + 1) for year in range(first_date.year, last_date.year + 1))
+
+
+def project_group(loans, idx, amrt_term_unit, day_count_ind, repayment_type, interest_method, skipped):
+    """
+    Project the cash flows of one loan group as array operations over the period index.
+    Returns the projected rows as column arrays, ordered by account and bucket.
+    """
+    convention = get_date_convention()
+    rate_periods_per_year = periods_per_year(amrt_term_unit, day_count_ind, convention)
+
+    next_dates = loans['next_payment_date'][idx]
+    periods = payment_counts(
+        next_dates.astype('datetime64[D]'), loans['maturity_date'][idx].astype('datetime64[D]'),
+        amrt_term_unit, day_count_ind, convention
+    )
+
+    valid = np.ones(len(idx), dtype=bool)
+    for pos in np.flatnonzero(periods == 0):
+        skipped[NO_PAYMENT_DATES].append(loans['account_number'][idx[pos]])
+        valid[pos] = False
+
+    rate = loans['interest_rate'][idx]
+    if interest_method == 'Amortized':
+        rate_per_period = rate / rate_periods_per_year
+        for pos in np.flatnonzero(valid & (periods > 0) & (rate_per_period == 0)):
+            skipped[ZERO_AMORTIZED_RATE].append(loans['account_number'][idx[pos]])
+            valid[pos] = False
+
+    grids = {}
+    for pos in np.flatnonzero(valid & (periods > 0)):
+        start_date = loans['start_date'][idx[pos]]
+        account_number = loans['account_number'][idx[pos]]
+        grids[pos] = payment_date_grid(next_dates[pos], amrt_term_unit, int(periods[pos]), day_count_ind, convention)
+        last_date = grids[pos][0][-1].astype(object)
+        if start_date is None:
+            skipped[MISSING_START_DATE].append(account_number)
+            valid[pos] = False
+        elif fails_management_fee_date(start_date, next_dates[pos], last_date):
+            skipped[FEE_ANNIVERSARY_29_FEB].append(account_number)
+            valid[pos] = False
+        elif repayment_type is None or loans['ccy_code'][idx[pos]] is None:
+            skipped[MISSING_REPAYMENT_TYPE_OR_CURRENCY].append(account_number)
+            valid[pos] = False
+
+    kept = np.flatnonzero(valid)
+    idx, periods, rate = idx[valid], periods[valid], rate[valid]
+    periods = np.maximum(periods, 0)
+    max_periods = int(periods.max()) if len(periods) else 0
+
+    # Payment dates and accrual fractions per loan, from the shared grids.
+    dates = np.full((len(idx), max_periods), np.datetime64('NaT'), dtype='datetime64[D]')
+    accrual_fractions = np.zeros((len(idx), max_periods))
+    for row, pos in enumerate(kept):
+        if pos in grids:
+            grid_dates, grid_fractions = grids[pos]
+            dates[row, :len(grid_dates)] = grid_dates
+            accrual_fractions[row, :len(grid_fractions)] = grid_fractions
+
+    starting_balance = loans['balance'][idx]
+    wht_rate = loans['wht_rate'][idx]
+    fixed_principal = np.array(
+        [round(b / p, 2) if p > 0 else 0.0 for b, p in zip(starting_balance, periods)], dtype=np.float64
+    )
+    rate_per_period = rate / rate_periods_per_year
+
+    shape = (len(idx), max_periods)
+    principal_grid = np.zeros(shape)
+    interest_grid = np.zeros(shape)
+    amount_grid = np.zeros(shape)
+    balance_grid = np.zeros(shape)
+
+    balance = starting_balance.copy()
+    # Columns past a loan's last period are masked out below; silence the overflow they produce.
+    with np.errstate(all='ignore'):
+        for k in range(max_periods):
+            remaining = periods - k
+            if interest_method == 'Amortized':
+                total_payment = starting_balance * (rate_per_period / (1 - (1 + rate_per_period) ** -remaining.astype(np.float64)))
+                interest_payment = balance * rate_per_period
+                principal_payment = total_payment - interest_payment
+            else:
+                interest_payment = balance * rate * accrual_fractions[:, k]
+                principal_payment = np.zeros(len(idx))
+
+            interest_payment_net = interest_payment - interest_payment * wht_rate
+
+            if repayment_type == 'bullet':
+                principal_payment = np.where(remaining == 1, balance, principal_payment)
+            elif repayment_type == 'amortized':
+                principal_payment = fixed_principal
+
+            # The per-loan path compares each payment date with the fee anniversary one year ahead,
+            # so no management fee is ever added; the engine keeps that behaviour.
+            management_fee_net = 0.0
+
+            principal_grid[:, k] = principal_payment
+            interest_grid[:, k] = interest_payment + management_fee_net
+            amount_grid[:, k] = principal_payment + interest_payment_net + management_fee_net
+            balance_grid[:, k] = balance - principal_payment
+            balance = balance - principal_payment
+
+    mask = np.arange(max_periods) < periods[:, None]
+    buckets = np.broadcast_to(np.arange(1, max_periods + 1), shape)
+    rows_per_loan = mask.sum(axis=1)
+
+    return {
+        'account_number': np.repeat(loans['account_number'][idx], rows_per_loan),
+        'fic_mis_date': np.repeat(loans['fic_mis_date'][idx], rows_per_loan),
+        'ccy_code': np.repeat(loans['ccy_code'][idx], rows_per_loan),
+        'bucket': buckets[mask],
+        'cash_flow_date': dates[mask].astype(object),
+        'principal': principal_grid[mask],
+        'interest': interest_grid[mask],
+        'amount': amount_grid[mask],
+        'balance': balance_grid[mask],
+        'cash_flow_type': repayment_type,
+    }
+
+
+def project_scheduled_loans(loans, idx, schedules):
+    """
+    Build cash flow rows, in CASH_FLOW_COLUMNS order, straight from the contractual payment schedule of each loan.
+    """
+    rows = []
+    for i in idx:
+        account_number = loans['account_number'][i]
+        balance = loans['balance'][i]
+        for bucket, (payment_date, principal, interest) in enumerate(schedules[account_number], start=1):
+            balance -= principal
+            rows.append((
+                loans['fic_mis_date'][i], account_number, bucket, payment_date, principal, interest,
+                principal + interest, float(balance), '', 0.0, loans['ccy_code'][i],
+            ))
+    return rows
+
+
+def group_rows(projected):
+    """
+    Convert the column arrays of a projected group into cash flow rows in CASH_FLOW_COLUMNS order.
+    """
+    return [
+        (
+            fic_mis_date, account_number, int(bucket), cash_flow_date, float(principal), float(interest),
+            float(amount), float(balance), projected['cash_flow_type'], 0.0, ccy_code,
+        )
+        for account_number, fic_mis_date, ccy_code, bucket, cash_flow_date, principal, interest, amount, balance in zip(
+            projected['account_number'], projected['fic_mis_date'], projected['ccy_code'], projected['bucket'],
+            projected['cash_flow_date'], projected['principal'], projected['interest'], projected['amount'],
+            projected['balance'],
+        )
+    ]
+
+
+def project_book(loans, schedules, interest_method, skipped):
+    """
+    Project every loan in the loan arrays and yield the cash flows in chunks of rows in CASH_FLOW_COLUMNS order.
+    Accounts that cannot be projected are recorded in skipped (error message -> account numbers).
+    """
+    has_dates = np.array([
+        first_date is not None and maturity_date is not None
+        for first_date, maturity_date in zip(loans['next_payment_date'], loans['maturity_date'])
+    ], dtype=bool)
+    for i in np.flatnonzero(~has_dates):
+        skipped['missing first payment or maturity date'].append(loans['account_number'][i])
+
+    has_schedule = np.array([a in schedules for a in loans['account_number']], dtype=bool)
+    has_ccy_code = np.array([c is not None for c in loans['ccy_code']], dtype=bool)
+    for i in np.flatnonzero(has_dates & has_schedule & ~has_ccy_code):
+        skipped[MISSING_REPAYMENT_TYPE_OR_CURRENCY].append(loans['account_number'][i])
+    scheduled_idx = np.flatnonzero(has_dates & has_schedule & has_ccy_code)
+    projected_idx = np.flatnonzero(has_dates & ~has_schedule)
+
+    for start in range(0, len(scheduled_idx), LOAN_CHUNK_SIZE):
+        yield project_scheduled_loans(loans, scheduled_idx[start:start + LOAN_CHUNK_SIZE], schedules)
+
+    for (amrt_term_unit, day_count_ind, repayment_type), idx in group_loans(loans, projected_idx).items():
+        for start in range(0, len(idx), LOAN_CHUNK_SIZE):
+            projected = project_group(
+                loans, idx[start:start + LOAN_CHUNK_SIZE], amrt_term_unit, day_count_ind, repayment_type,
+                interest_method, skipped
+            )
+            yield group_rows(projected)
+
+
+def project_cash_flows_vectorized(fic_mis_date):
+    """
+    Columnar equivalent of project_cash_flows: loads the whole book for the MIS date once, groups loans by
+    (amortization unit, day count, repayment type) and projects every group with array operations.
+    """
+    queries = QueryCounter()
+    try:
+        with queries.install():
+            FSI_Expected_Cashflow.objects.filter(fic_mis_date=fic_mis_date).delete()
+            FSI_Cashflow_Fingerprint.objects.filter(fic_mis_date=fic_mis_date).delete()
+            loans = load_loan_arrays(fic_mis_date)
+            if loans['count'] == 0:
+                save_log('project_cash_flows_vectorized', 'ERROR', f"No loans found for the given fic_mis_date: {fic_mis_date}", status='FAILURE')
+                return 0
+
+            interest_method = get_interest_method().v_interest_method
+            schedules = load_payment_schedules(fic_mis_date)
+            skipped = defaultdict(list)  # error message -> accounts skipped for that reason
+
+            with CashFlowWriter(queries=queries) as writer:
+                for rows in project_book(loans, schedules, interest_method, skipped):
+                    writer.put_rows(rows)
+            total_cash_flows = writer.rows_written
+
+        for reason, accounts in skipped.items():
+            save_log(
+                'project_cash_flows_vectorized', 'ERROR',
+                f"{len(accounts)} accounts skipped due to error: {reason} (first: {accounts[0]})"
+            )
+
+        save_log(
+            'project_cash_flows_vectorized', 'INFO',
+            f"Total of {total_cash_flows} cash flows projected for {loans['count']} loans for MIS date {fic_mis_date} "
+            f"using {queries.count} database queries.",
+            status='SUCCESS'
+        )
+        return 1
+
+    except Exception as e:
+        save_log('project_cash_flows_vectorized', 'ERROR', f"Error occurred: {str(e)}", status='FAILURE')
+        return 0
@@ -0,0 +1,99 @@
+import hashlib
+from collections import defaultdict
+from django.db import transaction
+from ..models import FSI_Cashflow_Fingerprint, FSI_Expected_Cashflow, Ldn_Financial_Instrument
+from .cashflow import BATCH_SIZE, get_interest_method, load_payment_schedules
+from .cashflow_engine import FILTER_CHUNK_SIZE, LOAN_FIELDS, loan_rows_to_arrays, project_book
+from .cashflow_writer import insert_cash_flow_rows
+from .payment_dates import get_date_convention
+from .query_counter import QueryCounter
+from .save_log import save_log
+
+
+def loan_fingerprint(loan_row, payment_schedule, interest_method, date_convention):
+    """
+    Hash of everything the projection of one loan depends on: its LOAN_FIELDS values, its payment schedule,
+    the interest method and the payment date convention (IFRS9_PAYMENT_DATE_CONVENTION).
+    """
+    payload = repr((interest_method, date_convention, loan_row, payment_schedule))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def delete_for_accounts(model, fic_mis_date, account_numbers):
+    for i in range(0, len(account_numbers), FILTER_CHUNK_SIZE):
+        model.objects.filter(
+            fic_mis_date=fic_mis_date,
+            v_account_number__in=account_numbers[i:i + FILTER_CHUNK_SIZE]
+        ).delete()
+
+
+def project_cash_flows_incremental(fic_mis_date):
+    """
+    Re-project only the loans whose fingerprint changed since the last run for the MIS date. Cash flows of
+    unchanged loans are kept and those of loans no longer in Ldn_Financial_Instrument are removed.
+    """
+    queries = QueryCounter()
+    try:
+        with queries.install():
+            rows = list(Ldn_Financial_Instrument.objects.filter(fic_mis_date=fic_mis_date).values_list(*LOAN_FIELDS))
+            if not rows:
+                save_log('project_cash_flows_incremental', 'ERROR', f"No loans found for the given fic_mis_date: {fic_mis_date}", status='FAILURE')
+                return 0
+
+            interest_method = get_interest_method().v_interest_method
+            date_convention = get_date_convention()
+            schedules = load_payment_schedules(fic_mis_date)
+            stored = dict(
+                FSI_Cashflow_Fingerprint.objects.filter(fic_mis_date=fic_mis_date).values_list('v_account_number', 'v_fingerprint')
+            )
+
+            fingerprints = {}
+            changed_rows = []
+            for row in rows:
+                account_number = row[0]
+                fingerprints[account_number] = loan_fingerprint(row, schedules.get(account_number), interest_method, date_convention)
+                if stored.get(account_number) != fingerprints[account_number]:
+                    changed_rows.append(row)
+            changed = list(dict.fromkeys(row[0] for row in changed_rows))
+            removed = [account_number for account_number in stored if account_number not in fingerprints]
+
+            skipped = defaultdict(list)  # error message -> accounts skipped for that reason
+            total_cash_flows = 0
+            with transaction.atomic():
+                if stored:
+                    delete_for_accounts(FSI_Expected_Cashflow, fic_mis_date, changed + removed)
+                    delete_for_accounts(FSI_Cashflow_Fingerprint, fic_mis_date, changed + removed)
+                else:
+                    # No fingerprints yet: cash flows left by a full projection cannot be trusted.
+                    FSI_Expected_Cashflow.objects.filter(fic_mis_date=fic_mis_date).delete()
+
+                for cashflows in project_book(loan_rows_to_arrays(changed_rows), schedules, interest_method, skipped):
+                    insert_cash_flow_rows(cashflows, BATCH_SIZE)
+                    total_cash_flows += len(cashflows)
+
+                FSI_Cashflow_Fingerprint.objects.bulk_create([
+                    FSI_Cashflow_Fingerprint(
+                        fic_mis_date=fic_mis_date,
+                        v_account_number=account_number,
+                        v_fingerprint=fingerprints[account_number],
+                    )
+                    for account_number in changed
+                ], batch_size=BATCH_SIZE)
+
+        for reason, accounts in skipped.items():
+            save_log(
+                'project_cash_flows_incremental', 'ERROR',
+                f"{len(accounts)} accounts skipped due to error: {reason} (first: {accounts[0]})"
+            )
+
+        save_log(
+            'project_cash_flows_incremental', 'INFO',
+            f"{len(changed)} of {len(fingerprints)} loans changed and {len(removed)} removed for MIS date {fic_mis_date}. "
+            f"Total of {total_cash_flows} cash flows projected using {queries.count} database queries.",
+            status='SUCCESS'
+        )
+        return 1
+
+    except Exception as e:
+        save_log('project_cash_flows_incremental', 'ERROR', f"Error occurred: {str(e)}", status='FAILURE')
+        return 0
@@ -0,0 +1,109 @@
+import os
+import zlib
+import django
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.conf import settings
+from django.db import connections
+from ..models import FSI_Cashflow_Fingerprint, FSI_Expected_Cashflow, Ldn_Financial_Instrument
+from .cashflow import get_interest_method, load_payment_schedules
+from .cashflow_engine import load_loan_arrays, project_book
+from .cashflow_writer import CashFlowWriter
+from .query_counter import QueryCounter
+from .save_log import save_log
+
+
+def get_shard_count():
+    return getattr(settings, 'IFRS9_CASHFLOW_SHARDS', None) or os.cpu_count() or 1
+
+
+def shard_for_account(account_number, shard_count):
+    """
+    Stable shard index for an account number. crc32 is used instead of hash() because string hashes
+    are randomised per process.
+    """
+    return zlib.crc32(account_number.encode('utf-8')) % shard_count
+
+
+def partition_accounts(account_numbers, shard_count):
+    shards = [[] for _ in range(shard_count)]
+    for account_number in account_numbers:
+        shards[shard_for_account(account_number, shard_count)].append(account_number)
+    return [shard for shard in shards if shard]
+
+
+def project_cash_flow_shard(fic_mis_date, account_numbers, interest_method):
+    """
+    Project one shard of the book. Runs in a worker process with its own database connection.
+    Returns the number of cash flows written, the accounts skipped per error message and the number of
+    queries issued.
+    """
+    queries = QueryCounter()
+    try:
+        with queries.install():
+            loans = load_loan_arrays(fic_mis_date, account_numbers)
+            schedules = load_payment_schedules(fic_mis_date, account_numbers)
+            skipped = defaultdict(list)
+
+            with CashFlowWriter(queries=queries) as writer:
+                for rows in project_book(loans, schedules, interest_method, skipped):
+                    writer.put_rows(rows)
+        return writer.rows_written, dict(skipped), queries.count
+    finally:
+        connections.close_all()
+
+
+def project_cash_flows_sharded(fic_mis_date):
+    """
+    Split the loans for the MIS date into IFRS9_CASHFLOW_SHARDS shards by account number hash and project
+    each shard in a separate worker process.
+    """
+    queries = QueryCounter()
+    try:
+        with queries.install():
+            FSI_Expected_Cashflow.objects.filter(fic_mis_date=fic_mis_date).delete()
+            FSI_Cashflow_Fingerprint.objects.filter(fic_mis_date=fic_mis_date).delete()
+            account_numbers = list(
+                Ldn_Financial_Instrument.objects.filter(fic_mis_date=fic_mis_date).values_list('v_account_number', flat=True)
+            )
+            if not account_numbers:
+                save_log('project_cash_flows_sharded', 'ERROR', f"No loans found for the given fic_mis_date: {fic_mis_date}", status='FAILURE')
+                return 0
+
+            interest_method = get_interest_method().v_interest_method
+        shards = partition_accounts(account_numbers, get_shard_count())
+
+        # Worker processes must open their own connections rather than share this one.
+        connections.close_all()
+
+        total_cash_flows = 0
+        skipped = defaultdict(list)
+        with ProcessPoolExecutor(max_workers=len(shards), initializer=django.setup) as executor:
+            futures = [
+                executor.submit(project_cash_flow_shard, fic_mis_date, shard, interest_method)
+                for shard in shards
+            ]
+            for future in as_completed(futures):
+                shard_cash_flows, shard_skipped, shard_queries = future.result()
+                total_cash_flows += shard_cash_flows
+                queries.count += shard_queries
+                for reason, accounts in shard_skipped.items():
+                    skipped[reason].extend(accounts)
+
+        for reason, accounts in skipped.items():
+            save_log(
+                'project_cash_flows_sharded', 'ERROR',
+                f"{len(accounts)} accounts skipped due to error: {reason} (first: {accounts[0]})"
+            )
+
+        save_log(
+            'project_cash_flows_sharded', 'INFO',
+            f"Total of {total_cash_flows} cash flows projected for {len(account_numbers)} loans "
+            f"in {len(shards)} shards for MIS date {fic_mis_date} using {queries.count} database queries.",
+            status='SUCCESS'
+        )
+        return 1
+
+    except Exception as e:
+        save_log('project_cash_flows_sharded', 'ERROR', f"Error occurred: {str(e)}", status='FAILURE')
+        return 0
@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from django.conf import settings
+from django.db import connection, transaction
+from ..models import FSI_Expected_Cashflow
+
+# Column order of the row tuples accepted by insert_cash_flow_rows and CashFlowWriter.
+CASH_FLOW_COLUMNS = (
+    'fic_mis_date', 'v_account_number', 'n_cash_flow_bucket', 'd_cash_flow_date', 'n_principal_payment',
+    'n_interest_payment', 'n_cash_flow_amount', 'n_balance', 'V_CASH_FLOW_TYPE', 'management_fee_added', 'V_CCY_CODE',
+)
+
+
+def insert_cash_flow_rows(rows, batch_size=5000):
+    """
+    Insert rows in CASH_FLOW_COLUMNS order into FSI_Expected_Cashflow on the current connection, with multi-row
+    INSERT statements of batch_size rows. Values are prepared by the model fields, so they are stored exactly as
+    the ORM would store them.
+    """
+    fields = [FSI_Expected_Cashflow._meta.get_field(column) for column in CASH_FLOW_COLUMNS]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(FSI_Expected_Cashflow._meta.db_table),
+        ', '.join(connection.ops.quote_name(f.column) for f in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(0, len(rows), batch_size):
+            cursor.executemany(sql, [
+                [f.get_db_prep_save(value, connection) for f, value in zip(fields, row)]
+                for row in rows[i:i + batch_size]
+            ])
+
+
+class CashFlowWriter:
+    """
+    Shared background writer for FSI_Expected_Cashflow rows. Producers put plain tuples in CASH_FLOW_COLUMNS
+    order on a bounded queue and block while it is full. A single thread drains the queue and inserts the rows
+    with insert_cash_flow_rows in batches of batch_size rows, flushing at least every flush_interval seconds.
+    An insert failure is raised from close() once the producers are done.
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size=None, flush_interval=None, queue_size=None, queries=None):
+        self.batch_size = batch_size or getattr(settings, 'IFRS9_CASHFLOW_WRITER_BATCH_SIZE', 5000)
+        self.flush_interval = flush_interval or getattr(settings, 'IFRS9_CASHFLOW_WRITER_FLUSH_INTERVAL', 2.0)
+        self.queue = queue.Queue(maxsize=queue_size or getattr(settings, 'IFRS9_CASHFLOW_WRITER_QUEUE_SIZE', 50000))
+        self.queries = queries
+        self.rows_written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='cashflow-writer', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def put(self, row):
+        self.queue.put(row)
+
+    def put_rows(self, rows):
+        for row in rows:
+            self.queue.put(row)
+
+    def close(self):
+        self.queue.put(self._STOP)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        stopped = False
+        try:
+            with self.queries.install() if self.queries is not None else nullcontext():
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                while not stopped:
+                    try:
+                        row = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        row = None
+                    if row is self._STOP:
+                        stopped = True
+                    elif row is not None:
+                        batch.append(row)
+
+                    if stopped or len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                        self._flush(batch)
+                        batch = []
+                        deadline = time.monotonic() + self.flush_interval
+        except Exception as e:
+            self.error = e
+            # Keep draining so producers blocked on a full queue can finish.
+            while not stopped:
+                stopped = self.queue.get() is self._STOP
+        finally:
+            connection.close()
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        insert_cash_flow_rows(batch, self.batch_size)
+        self.rows_written += len(batch)
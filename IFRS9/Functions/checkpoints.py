@@ -0,0 +1,114 @@
+import hashlib
+from django.apps import apps
+from django.db import models
+from django.db.models import Count, ExpressionWrapper, F, Max, Min, Sum
+from django.db.models.functions import Length
+from ..models import FunctionCheckpoint
+from .process_scheduler import parse_tables
+from .save_log import save_log
+
+# Field types summed as numbers and as text lengths in input fingerprints; other columns contribute their
+# minimum and maximum.
+NUMERIC_FIELDS = (models.IntegerField, models.DecimalField, models.FloatField)
+TEXT_FIELDS = (models.CharField, models.TextField)
+
+
+def column_aggregates(model, columns):
+    """
+    Aggregates over the given columns of model (all of them when columns is None) that change when a value
+    is updated in place: for numbers and text lengths their sum and their sum weighted by the primary key,
+    for other columns their count, minimum and maximum.
+    """
+    weighted = isinstance(model._meta.pk, models.IntegerField)
+    aggregates = {'rows': Count('pk'), 'last_pk': Max('pk')}
+    for field in model._meta.concrete_fields:
+        if field.primary_key or (columns is not None and field.column.lower() not in columns and field.name.lower() not in columns):
+            continue
+        name = field.name
+        numeric = isinstance(field.target_field if field.is_relation else field, NUMERIC_FIELDS)
+        aggregates[f"{name}__count"] = Count(name)
+        if numeric or isinstance(field, TEXT_FIELDS):
+            value = F(name) if numeric else Length(name)
+            aggregates[f"{name}__sum"] = Sum(value, output_field=models.FloatField())
+            if weighted:
+                aggregates[f"{name}__weighted"] = Sum(ExpressionWrapper(value * F('pk'), output_field=models.FloatField()))
+        else:
+            aggregates[f"{name}__min"] = Min(name)
+            aggregates[f"{name}__max"] = Max(name)
+    return aggregates
+
+
+def input_fingerprint(function, fic_mis_date):
+    """
+    A hash of the inputs of function for fic_mis_date, or None when the function declares no reads_tables, in
+    which case it is never skipped on resume. Each declared table contributes aggregates of the columns read
+    (all its columns when it is declared without columns), over the rows of fic_mis_date for tables that have
+    that column, so rows loaded, deleted or updated in place since a run change the hash.
+    """
+    read_tables = parse_tables(function.reads_tables)
+    if not read_tables:
+        return None
+
+    columns_by_table = {}
+    for name in sorted(read_tables):
+        table, _, column = name.partition('.')
+        if not column:
+            columns_by_table[table] = None  # Declared on its own: every column is read
+        elif columns_by_table.get(table, set()) is not None:
+            columns_by_table.setdefault(table, set()).add(column)
+
+    models_by_table = {model._meta.db_table.lower(): model for model in apps.get_app_config('IFRS9').get_models()}
+    digest = hashlib.sha256(f"{function.function_name}|{fic_mis_date}".encode())
+    for table in sorted(columns_by_table):
+        model = models_by_table.get(table)
+        if model is None:
+            digest.update(f"|{table}:unknown".encode())
+            continue
+        queryset = model.objects.all()
+        if any(field.name == 'fic_mis_date' for field in model._meta.concrete_fields):
+            queryset = queryset.filter(fic_mis_date=fic_mis_date)
+        summary = queryset.aggregate(**column_aggregates(model, columns_by_table[table]))
+        digest.update(f"|{table}:{sorted(summary.items())}".encode())
+    return digest.hexdigest()
+
+
+def record_checkpoint(status_entry, fingerprint):
+    """Record that the function of status_entry completed from the inputs with the given fingerprint."""
+    FunctionCheckpoint.objects.update_or_create(
+        process_run_id=status_entry.process_run_id,
+        function=status_entry.function,
+        defaults={'reporting_date': status_entry.reporting_date, 'input_fingerprint': fingerprint},
+    )
+
+
+def skip_completed_functions(function_status_entries, dependencies, resume_from, fic_mis_date):
+    """
+    Mark as 'Skipped' the functions that completed in run resume_from from the same inputs, and return their
+    indexes. A function is only skipped when every function it depends on was skipped as well, so anything
+    downstream of a function that runs again runs again too. Skipped functions keep their checkpoint in the
+    new run, so it can be resumed in turn.
+    """
+    skipped = set()
+    if not resume_from:
+        return skipped
+
+    checkpoints = dict(
+        FunctionCheckpoint.objects.filter(process_run_id=resume_from).values_list('function_id', 'input_fingerprint')
+    )
+    for index, status_entry in enumerate(function_status_entries):
+        checkpoint = checkpoints.get(status_entry.function_id)
+        if checkpoint is None or not dependencies[index] <= skipped:
+            continue
+        fingerprint = input_fingerprint(status_entry.function, fic_mis_date)
+        if fingerprint is None:
+            continue  # Functions without declared inputs always run again
+        if fingerprint != checkpoint:
+            save_log('skip_completed_functions', 'INFO', f"Inputs of {status_entry.function.function_name} changed since run {resume_from}; it runs again.")
+            continue
+        status_entry.status = 'Skipped'
+        status_entry.save()
+        record_checkpoint(status_entry, checkpoint)
+        skipped.add(index)
+
+    save_log('skip_completed_functions', 'INFO', f"Resuming run {resume_from}: skipped {len(skipped)} of {len(function_status_entries)} functions.")
+    return skipped
@@ -1,113 +1,98 @@
-import concurrent.futures
-from datetime import timedelta
 from ..models import CoolingPeriodDefinition, FCT_Stage_Determination
+from .bulk_sql import update_from_rows
+from .prior_stages import invalidate_prior_stage_snapshot, load_prior_stages
+from .reference_cache import reference_cache
 from .save_log import save_log
 
-def get_previous_stage_and_cooling_status(account, fic_mis_date):
-    """
-    Get the latest previous stage and cooling period status for the account by checking the latest previous fic_mis_date
-    that is strictly before the input fic_mis_date.
-    """
-    previous_record = FCT_Stage_Determination.objects.filter(
-        n_account_number=account.n_account_number,
-        fic_mis_date__lt=fic_mis_date
-    ).order_by('-fic_mis_date').first()
+# Fields of FCT_Stage_Determination set by the cooling period state machine, in the order apply_cooling_period
+# takes and returns them.
+COOLING_FIELDS = [
+    'n_curr_ifrs_stage_skey', 'n_stage_descr', 'n_in_cooling_period_flag', 'd_cooling_start_date',
+    'n_cooling_period_duration', 'n_target_ifrs_stage_skey',
+]
 
-    if previous_record:
-        return previous_record.n_curr_ifrs_stage_skey, previous_record.n_in_cooling_period_flag
-    else:
-        return None, False
+# Fields of the latest previous record of an account that the state machine reads.
+PRIOR_FIELDS = [
+    'n_curr_ifrs_stage_skey', 'n_in_cooling_period_flag', 'd_cooling_start_date', 'n_cooling_period_duration',
+    'n_target_ifrs_stage_skey',
+]
 
-def is_cooling_period_expired(account):
-    """
-    Check if the cooling period has expired based on the start date and expected duration.
-    """
-    if account.d_cooling_start_date:
-        days_in_cooling_period = (account.fic_mis_date - account.d_cooling_start_date).days
-        if days_in_cooling_period >= account.n_cooling_period_duration:
-            return True
-    return False
 
-def start_cooling_period(account, current_stage, target_stage, fic_mis_date):
+def apply_cooling_period(current, prior, fic_mis_date, cooling_period_days):
     """
-    Start a new cooling period for the account when moving from a higher to a lower stage.
+    Cooling period state machine for one account. current holds the account's COOLING_FIELDS values and prior
+    its PRIOR_FIELDS values in the previous period; returns the new COOLING_FIELDS values.
+    An account moving to a lower stage keeps its previous stage for cooling_period_days before the move takes
+    effect. While it cools, the start date, duration and target stage are carried over from period to period.
     """
-    try:
-        cooling_period_def = CoolingPeriodDefinition.objects.get(v_amrt_term_unit=account.v_amrt_term_unit)
-    except CoolingPeriodDefinition.DoesNotExist:
-        save_log('start_cooling_period', 'WARNING', f"Cooling period not defined for amortization unit {account.v_amrt_term_unit}. Skipping cooling period.")
-        return
+    current_stage, stage_descr, in_cooling_period, cooling_start_date, cooling_period_duration, target_stage = current
+    previous_stage, was_in_cooling_period, previous_start_date, previous_duration, previous_target_stage = prior
 
-    account.d_cooling_start_date = fic_mis_date
-    account.n_target_ifrs_stage_skey = target_stage
-    account.n_in_cooling_period_flag = True
-    account.n_cooling_period_duration = cooling_period_def.n_cooling_period_days
+    if was_in_cooling_period:
+        if current_stage >= previous_stage:
+            # Back at (or above) the previous stage: the cooling period ends.
+            return current_stage, stage_descr, False, None, None, None
+
+        start_date = cooling_start_date or previous_start_date
+        duration = cooling_period_duration if cooling_period_duration is not None else previous_duration
+        if start_date and duration is not None and (fic_mis_date - start_date).days >= duration:
+            # Cooling period over: the lower stage takes effect.
+            return current_stage, f"Stage {current_stage}", False, cooling_start_date, cooling_period_duration, None
+
+        # Still cooling: the account stays in its previous stage.
+        return previous_stage, f"Stage {previous_stage}", True, start_date, duration, target_stage or previous_target_stage
+
+    if current_stage < previous_stage:
+        # Moving to a lower stage starts a cooling period.
+        return previous_stage, f"Stage {previous_stage}", True, fic_mis_date, cooling_period_days, current_stage
+
+    return current_stage, f"Stage {current_stage}", in_cooling_period, cooling_start_date, cooling_period_duration, target_stage
 
-def process_single_account(account, fic_mis_date):
-    """
-    Process cooling period and stage determination for a single account.
-    """
-    current_stage = account.n_curr_ifrs_stage_skey
-    previous_stage, was_in_cooling_period = get_previous_stage_and_cooling_status(account, fic_mis_date)
-    
-    if previous_stage:
-        if was_in_cooling_period:
-            if account.n_curr_ifrs_stage_skey >= previous_stage:
-                account.n_in_cooling_period_flag = False
-                account.d_cooling_start_date = None
-                account.n_cooling_period_duration = None
-                account.n_target_ifrs_stage_skey = None
-            else:
-                if is_cooling_period_expired(account):
-                    account.n_in_cooling_period_flag = False
-                    account.n_target_ifrs_stage_skey = None
-                    account.n_curr_ifrs_stage_skey = current_stage
-                    account.n_stage_descr = f"Stage {current_stage}"
-                else:
-                    account.n_curr_ifrs_stage_skey = previous_stage
-                    account.n_stage_descr = f"Stage {previous_stage}"
-                    return
-        else:
-            if current_stage < previous_stage:
-                start_cooling_period(account, previous_stage, current_stage, fic_mis_date)
-                account.n_curr_ifrs_stage_skey = previous_stage
-                account.n_stage_descr = f"Stage {previous_stage}"
-            else:
-                account.n_curr_ifrs_stage_skey = current_stage
-                account.n_stage_descr = f"Stage {current_stage}"
-    else:
-        save_log('process_single_account', 'INFO', f"No previous stage found for account {account.n_account_number}.")
-
-    account.save()
 
 def process_cooling_period_for_accounts(fic_mis_date):
     """
-    Process cooling period logic for accounts based on a given fic_mis_date using multi-threading.
+    Process cooling period logic for the accounts of fic_mis_date in one pass. The latest previous stage and
+    cooling state of all accounts are read with a single query, the state machine runs in memory and the
+    changed accounts are written back with one bulk update.
     """
     try:
-        valid_amrt_term_units = CoolingPeriodDefinition.objects.values_list('v_amrt_term_unit', flat=True)
-        accounts_to_process = FCT_Stage_Determination.objects.filter(
+        fic_mis_date = FCT_Stage_Determination._meta.get_field('fic_mis_date').to_python(fic_mis_date)
+        cooling_period_days = reference_cache.mapping(CoolingPeriodDefinition, 'v_amrt_term_unit', 'n_cooling_period_days')
+        accounts = list(FCT_Stage_Determination.objects.filter(
             fic_mis_date=fic_mis_date,
-            v_amrt_term_unit__in=valid_amrt_term_units
-        )
+            v_amrt_term_unit__in=list(cooling_period_days)
+        ).values_list('id', 'n_account_number', 'v_amrt_term_unit', *COOLING_FIELDS))
 
-        if not accounts_to_process.exists():
+        if not accounts:
             save_log('process_cooling_period_for_accounts', 'INFO', f"No accounts found for fic_mis_date {fic_mis_date} with valid amortization term units.")
             return 0
 
-        updated_accounts_count = 0
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(process_single_account, account, fic_mis_date) for account in accounts_to_process]
+        prior_stages = load_prior_stages(fic_mis_date, PRIOR_FIELDS)
+
+        updated_rows = []
+        no_previous_stage = 0
+        no_current_stage = 0
+        for pk, account_number, amrt_term_unit, *current in accounts:
+            prior = prior_stages.get(account_number)
+            if prior is None or not prior[0]:
+                no_previous_stage += 1
+                continue
+            if current[0] is None:
+                no_current_stage += 1
+                continue
+            updated = apply_cooling_period(current, prior, fic_mis_date, cooling_period_days[amrt_term_unit])
+            if list(updated) != current:
+                updated_rows.append((pk, *updated))
 
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    future.result()
-                    updated_accounts_count += 1
-                except Exception as exc:
-                    save_log('process_cooling_period_for_accounts', 'ERROR', f"An error occurred during account processing: {exc}")
-                    return 0
+        if updated_rows:
+            invalidate_prior_stage_snapshot(fic_mis_date)  # The snapshot may hold the cooling state being replaced
+        update_from_rows(FCT_Stage_Determination, ['id'], COOLING_FIELDS, updated_rows)
 
-        save_log('process_cooling_period_for_accounts', 'INFO', f"Successfully processed cooling periods for {updated_accounts_count} accounts on fic_mis_date {fic_mis_date}.")
+        if no_previous_stage:
+            save_log('process_cooling_period_for_accounts', 'INFO', f"No previous stage found for {no_previous_stage} accounts.")
+        if no_current_stage:
+            save_log('process_cooling_period_for_accounts', 'WARNING', f"Skipped {no_current_stage} accounts without a current stage.")
+        save_log('process_cooling_period_for_accounts', 'INFO', f"Successfully processed cooling periods for {len(accounts)} accounts on fic_mis_date {fic_mis_date}; {len(updated_rows)} accounts changed.")
         return 1
 
     except Exception as e:
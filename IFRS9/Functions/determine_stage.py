@@ -1,20 +1,23 @@
 from django.db import transaction
-from ..models import FSI_CreditRating_Stage, FSI_DPD_Stage_Mapping, FCT_Stage_Determination
+from ..models import FSI_CreditRating_Stage, FCT_Stage_Determination
+from .band_resolver import dpd_stage_resolver
+from .prior_stages import invalidate_prior_stage_snapshot, load_prior_stages
+from .reference_cache import reference_cache
 from .save_log import save_log
 
-def determine_stage_for_account(account, credit_rating_cache, dpd_stage_mapping_cache):
+def determine_stage_for_account(account, credit_rating_cache, dpd_stages):
     """
     Determine the stage for an account based on credit rating or DPD.
     Priority is given to the credit rating if available, otherwise, DPD is used.
     """
     credit_rating_code = account.n_credit_rating_code
     if credit_rating_code in credit_rating_cache:
-        return credit_rating_cache[credit_rating_code]  # Return the cached stage based on the credit rating
+        return credit_rating_cache[credit_rating_code], None  # Return the cached stage based on the credit rating
     
     # Fallback to DPD stage determination if no valid credit rating found
-    return determine_stage_by_dpd(account, dpd_stage_mapping_cache)
+    return determine_stage_by_dpd(account, dpd_stages)
 
-def determine_stage_by_dpd(account, dpd_stage_mapping_cache):
+def determine_stage_by_dpd(account, dpd_stages):
     """
     Determine the stage for an account based on Days Past Due (DPD) and payment frequency.
     """
@@ -24,31 +27,25 @@ def determine_stage_by_dpd(account, dpd_stage_mapping_cache):
     if delinquent_days is None or not payment_frequency:
         return 'Unknown Stage', f"Missing DPD or payment frequency for account {account.n_account_number}"
 
-    dpd_stage_mapping = dpd_stage_mapping_cache.get(payment_frequency)
-    if not dpd_stage_mapping:
+    if payment_frequency not in dpd_stages:
         return 'Unknown Stage', f"DPD stage mapping not found for payment frequency {payment_frequency} in account {account.n_account_number}"
 
-    # Determine stage based on thresholds
-    if delinquent_days <= dpd_stage_mapping['stage_1_threshold']:
-        return 'Stage 1', None
-    elif dpd_stage_mapping['stage_1_threshold'] < delinquent_days <= dpd_stage_mapping['stage_2_threshold']:
-        return 'Stage 2', None
-    else:
-        return 'Stage 3', None
+    # Determine stage from the threshold bands of the payment frequency
+    return dpd_stages.resolve(payment_frequency, delinquent_days), None
 
-def update_stage_for_account(account, fic_mis_date, credit_rating_cache, dpd_stage_mapping_cache, previous_stages):
+def update_stage_for_account(account, fic_mis_date, credit_rating_cache, dpd_stages, previous_stages):
     """
     Update the stage of a single account, setting both the stage description and the numeric value.
     """
-    stage, error = determine_stage_for_account(account, credit_rating_cache, dpd_stage_mapping_cache)
+    stage, error = determine_stage_for_account(account, credit_rating_cache, dpd_stages)
 
     if stage:
         account.n_stage_descr = stage
         account.n_curr_ifrs_stage_skey = {'Stage 1': 1, 'Stage 2': 2, 'Stage 3': 3}.get(stage)
 
-        # Get previous stage from the cached dictionary
-        previous_stage = previous_stages.get((account.n_account_number, fic_mis_date))
-        account.n_prev_ifrs_stage_skey = previous_stage if previous_stage else None
+        # Get the stage of the account's latest previous record
+        previous_stage = previous_stages.get(account.n_account_number)
+        account.n_prev_ifrs_stage_skey = previous_stage[0] if previous_stage and previous_stage[0] else None
 
         return account, error
     return None, error
@@ -64,20 +61,11 @@ def update_stage(fic_mis_date):
             return 0
 
         # Cache related data for fast lookup to avoid repetitive queries
-        credit_rating_cache = {cr.credit_rating: cr.stage for cr in FSI_CreditRating_Stage.objects.all()}
-        dpd_stage_mapping_cache = {
-            mapping.payment_frequency: {
-                'stage_1_threshold': mapping.stage_1_threshold,
-                'stage_2_threshold': mapping.stage_2_threshold
-            }
-            for mapping in FSI_DPD_Stage_Mapping.objects.all()
-        }
+        credit_rating_cache = reference_cache.mapping(FSI_CreditRating_Stage, 'credit_rating', 'stage')
+        dpd_stages = dpd_stage_resolver()
         
-        # Cache previous stages by account number and `fic_mis_date`
-        previous_stages = {
-            (entry.n_account_number, entry.fic_mis_date): entry.n_curr_ifrs_stage_skey
-            for entry in FCT_Stage_Determination.objects.filter(fic_mis_date__lt=fic_mis_date).order_by('n_account_number', '-fic_mis_date')
-        }
+        # Latest previous stage of each account, one entry per account whatever the length of the history
+        previous_stages = load_prior_stages(fic_mis_date, ['n_curr_ifrs_stage_skey'])
 
         # Initialize a dictionary to log unique errors
         error_logs = {}
@@ -85,7 +73,7 @@ def update_stage(fic_mis_date):
         # Update stages for each account
         updated_accounts = []
         for account in accounts_to_update:
-            updated_account, error = update_stage_for_account(account, fic_mis_date, credit_rating_cache, dpd_stage_mapping_cache, previous_stages)
+            updated_account, error = update_stage_for_account(account, fic_mis_date, credit_rating_cache, dpd_stages, previous_stages)
             if updated_account:
                 updated_accounts.append(updated_account)
             if error and error not in error_logs:
@@ -94,6 +82,7 @@ def update_stage(fic_mis_date):
         # Perform a bulk update for all updated accounts in batches of 5000
         batch_size = 5000
         if updated_accounts:
+            invalidate_prior_stage_snapshot(fic_mis_date)  # The snapshot may hold the stages being replaced
             with transaction.atomic():
                 for i in range(0, len(updated_accounts), batch_size):
                     FCT_Stage_Determination.objects.bulk_update(
@@ -0,0 +1,200 @@
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from ..models import FunctionExecutionStatus, ProcessJob
+from .save_log import save_log
+
+
+def get_process_runner():
+    """
+    'thread' runs a queued process in a thread of the web process that queued it; 'worker' leaves it to the
+    `manage.py ifrs9_worker` processes, which may run on other hosts.
+    """
+    return getattr(settings, 'IFRS9_PROCESS_RUNNER', 'thread')
+
+
+def get_lease_seconds():
+    return getattr(settings, 'IFRS9_JOB_LEASE_SECONDS', 300)
+
+
+def get_heartbeat_seconds():
+    return getattr(settings, 'IFRS9_JOB_HEARTBEAT_SECONDS', 30)
+
+
+def get_max_attempts():
+    return getattr(settings, 'IFRS9_JOB_MAX_ATTEMPTS', 3)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def enqueue_job(process, process_run_id, mis_date, resume_from=None):
+    return ProcessJob.objects.create(process=process, process_run_id=process_run_id, mis_date=mis_date, resume_from=resume_from)
+
+
+def claim_job(worker_id, job_id=None):
+    """
+    Claim the oldest queued job (or job_id) for worker_id and return it, or None when there is nothing to claim.
+    A job is claimed with a conditional UPDATE, so of several workers racing for it exactly one wins.
+    """
+    candidates = ProcessJob.objects.filter(status='Queued').order_by('created_at', 'pk')
+    if job_id is not None:
+        candidates = candidates.filter(pk=job_id)
+    for job_pk in candidates.values_list('pk', flat=True)[:10]:
+        now = timezone.now()
+        claimed = ProcessJob.objects.filter(pk=job_pk, status='Queued').update(
+            status='Running',
+            worker_id=worker_id,
+            started_at=now,
+            heartbeat_at=now,
+            lease_expires_at=now + timedelta(seconds=get_lease_seconds()),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return ProcessJob.objects.get(pk=job_pk)
+    return None
+
+
+def renew_lease(job, worker_id):
+    """Extend the lease of a running job. False when the worker no longer holds it."""
+    now = timezone.now()
+    return ProcessJob.objects.filter(pk=job.pk, status='Running', worker_id=worker_id).update(
+        heartbeat_at=now, lease_expires_at=now + timedelta(seconds=get_lease_seconds())
+    ) == 1
+
+
+# Process run ids of the jobs whose lease this process lost. Their functions stop at the next function boundary,
+# as the job may already run again elsewhere.
+_lost_leases = set()
+
+
+def is_lease_lost(process_run_id):
+    return process_run_id in _lost_leases
+
+
+def is_cancel_requested(process_run_id):
+    return ProcessJob.objects.filter(process_run_id=process_run_id, cancel_requested=True).exists()
+
+
+def request_cancel(process_run_id):
+    """Flag the job of process_run_id for cancellation. Queued jobs are cancelled at once."""
+    ProcessJob.objects.filter(process_run_id=process_run_id, status='Queued').update(
+        status='Cancelled', cancel_requested=True, finished_at=timezone.now()
+    )
+    return ProcessJob.objects.filter(process_run_id=process_run_id, status='Running').update(cancel_requested=True)
+
+
+def recover_stale_jobs(requeue=True):
+    """
+    Recover the running jobs whose lease ran out because their worker died. A job with attempts left is queued
+    again (when requeue is set) and resumes from its own checkpoints; otherwise the job and its unfinished
+    functions are marked as failed.
+    """
+    recovered = 0
+    for job in ProcessJob.objects.filter(status='Running', lease_expires_at__lt=timezone.now()):
+        retry = requeue and job.attempts < get_max_attempts()
+        with transaction.atomic():
+            updated = ProcessJob.objects.filter(pk=job.pk, status='Running', lease_expires_at=job.lease_expires_at).update(
+                status='Queued' if retry else 'Failed',
+                resume_from=job.process_run_id if retry else job.resume_from,
+                worker_id=None,
+                lease_expires_at=None,
+                finished_at=None if retry else timezone.now(),
+                error=f"Lease of worker {job.worker_id} expired after attempt {job.attempts}.",
+            )
+            if not updated:
+                continue  # Renewed or recovered by someone else meanwhile
+            function_statuses = FunctionExecutionStatus.objects.filter(process_run_id=job.process_run_id)
+            if retry:
+                # The next attempt skips the functions that completed with unchanged inputs.
+                function_statuses.exclude(status='Cancelled').update(status='Pending')
+            else:
+                function_statuses.filter(status='Ongoing').update(status='Failed', execution_end_date=timezone.now())
+        recovered += 1
+        save_log('recover_stale_jobs', 'ERROR', f"Recovered job {job.process_run_id} from worker {job.worker_id}; {'queued again' if retry else 'marked as failed'}.")
+    return recovered
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Renews the lease of a job every IFRS9_JOB_HEARTBEAT_SECONDS while it runs. A renewal that fails (a locked
+    database, a dropped connection) is retried as long as the lease may still be valid. Once the lease is lost,
+    is_lease_lost() is true for the job so its run stops at the next function boundary.
+    """
+
+    def __init__(self, job, worker_id):
+        super().__init__(daemon=True)
+        self.job = job
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        # Monotonic time by which the lease has expired at the latest, should no renewal get through.
+        valid_until = time.monotonic() + (self.job.lease_expires_at - timezone.now()).total_seconds()
+        try:
+            while not self.stopped.wait(get_heartbeat_seconds()):
+                renewed_at = time.monotonic()
+                try:
+                    renewed = renew_lease(self.job, self.worker_id)
+                except Exception as e:
+                    connections.close_all()  # Start the next attempt on a fresh connection
+                    if time.monotonic() < valid_until:
+                        save_log('LeaseHeartbeat', 'WARNING', f"Worker {self.worker_id} could not renew the lease of job {self.job.process_run_id}, retrying: {e}")
+                        continue
+                    save_log('LeaseHeartbeat', 'ERROR', f"Worker {self.worker_id} could not renew the lease of job {self.job.process_run_id} before it expired: {e}")
+                    renewed = False
+                if not renewed:
+                    save_log('LeaseHeartbeat', 'ERROR', f"Worker {self.worker_id} lost the lease of job {self.job.process_run_id}; the run stops.")
+                    _lost_leases.add(self.job.process_run_id)
+                    break
+                valid_until = renewed_at + get_lease_seconds()
+        finally:
+            connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job, worker_id, execute):
+    """
+    Run the functions of a claimed job with execute(function_status_entries, process_run_id, mis_date) while
+    keeping its lease alive, and record how the job ended. Returns the job's final status, or 'Lost' when the
+    worker lost the lease and left the job to whoever recovered it.
+    """
+    heartbeat = LeaseHeartbeat(job, worker_id)
+    heartbeat.start()
+    error = ''
+    try:
+        function_status_entries = list(
+            FunctionExecutionStatus.objects.filter(process_run_id=job.process_run_id, status='Pending')
+            .select_related('function').prefetch_related('function__depends_on').order_by('execution_order')
+        )
+        execute(function_status_entries, job.process_run_id, job.mis_date.strftime('%Y-%m-%d'))
+    except Exception as e:
+        error = str(e)
+        save_log('run_job', 'ERROR', f"Error running job {job.process_run_id}: {e}")
+    finally:
+        heartbeat.stop()
+
+    if is_lease_lost(job.process_run_id):
+        # The job was recovered meanwhile and belongs to whoever runs it now.
+        _lost_leases.discard(job.process_run_id)
+        return 'Lost'
+    if is_cancel_requested(job.process_run_id):
+        status = 'Cancelled'
+    elif not error and not FunctionExecutionStatus.objects.filter(process_run_id=job.process_run_id).exclude(status__in=['Success', 'Skipped']).exists():
+        status = 'Succeeded'
+    else:
+        status = 'Failed'
+    ProcessJob.objects.filter(pk=job.pk, worker_id=worker_id).update(
+        status=status, finished_at=timezone.now(), lease_expires_at=None, error=error
+    )
+    return status
@@ -0,0 +1,40 @@
+from django.db.models import Count
+
+
+def keyset_batches(queryset, batch_size=1000, key='pk'):
+    """
+    Yield the objects of queryset in lists of batch_size, ordered by key. Each batch is fetched with
+    WHERE key > last ORDER BY key LIMIT batch_size rather than OFFSET slicing, so every query is an index seek
+    and batches neither overlap nor skip rows when rows are updated between batches.
+    """
+    queryset = queryset.order_by(key)
+    last_key = None
+    while True:
+        batch_queryset = queryset if last_key is None else queryset.filter(**{f'{key}__gt': last_key})
+        batch = list(batch_queryset[:batch_size])
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        last_key = getattr(batch[-1], key)
+
+
+def account_ranges(queryset, chunk_size, account_field='v_account_number'):
+    """
+    Split the accounts of queryset into consecutive (first, last) account number ranges holding about
+    chunk_size rows each, so every account is processed in a single pass.
+    """
+    ranges = []
+    first_account, rows = None, 0
+    counts = queryset.order_by(account_field).values_list(account_field).annotate(rows=Count('pk'))
+    for account_number, account_rows in counts:
+        if first_account is None:
+            first_account = account_number
+        rows += account_rows
+        if rows >= chunk_size:
+            ranges.append((first_account, account_number))
+            first_account, rows = None, 0
+    if first_account is not None:
+        ranges.append((first_account, account_number))
+    return ranges
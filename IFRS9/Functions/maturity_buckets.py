@@ -0,0 +1,22 @@
+import numpy as np
+
+# PD buckets per year of each amortization term unit. Other units use monthly buckets.
+TERM_UNIT_TO_PERIODS = {
+    'M': 12,
+    'Q': 4,
+    'H': 2,
+    'Y': 1,
+}
+
+
+def maturity_buckets(fic_mis_dates, maturity_dates, term_units):
+    """
+    Months to maturity, buckets to maturity and buckets covering 12 months of each account, as integer arrays.
+    Months are counted between calendar months, and a bucket spans 12 // periods-per-year months.
+    """
+    months_to_maturity = (
+        np.asarray(maturity_dates, dtype='datetime64[M]') - np.asarray(fic_mis_dates, dtype='datetime64[M]')
+    ).astype(np.int64)
+    periods = np.array([TERM_UNIT_TO_PERIODS.get(unit, 12) for unit in term_units], dtype=np.int64)
+    months_per_bucket = 12 // periods
+    return months_to_maturity, months_to_maturity // months_per_bucket, 12 // months_per_bucket
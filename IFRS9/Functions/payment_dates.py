@@ -0,0 +1,153 @@
+import numpy as np
+from datetime import timedelta
+from functools import lru_cache
+from django.conf import settings
+
+# Maximum number of payment date grids kept by payment_date_grid.
+GRID_CACHE_SIZE = 16384
+
+# Calendar step of each amortization term unit as (months, days). Unknown units pay monthly.
+UNIT_STEPS = {
+    'D': (0, 1),
+    'W': (0, 7),
+    'M': (1, 0),
+    'Q': (3, 0),
+    'H': (6, 0),
+    'Y': (12, 0),
+}
+
+
+def get_payment_interval(v_amrt_term_unit, day_count_ind):
+    """Determine the payment interval in days based on repayment type and day count convention."""
+    if day_count_ind == '30/360':
+        return {
+            'D': timedelta(days=1),
+            'W': timedelta(weeks=1),
+            'M': timedelta(days=30),
+            'Q': timedelta(days=90),
+            'H': timedelta(days=180),
+            'Y': timedelta(days=360)
+        }.get(v_amrt_term_unit, timedelta(days=30))
+    elif day_count_ind == '30/365':
+        return {
+            'D': timedelta(days=1),
+            'W': timedelta(weeks=1),
+            'M': timedelta(days=30),
+            'Q': timedelta(days=91),
+            'H': timedelta(days=182),
+            'Y': timedelta(days=365)
+        }.get(v_amrt_term_unit, timedelta(days=30))
+    else:
+        return timedelta(days=30)
+
+
+def get_date_convention():
+    """
+    'calendar' steps payment dates by calendar months (or days for 'D' and 'W'); 'interval' reproduces the
+    fixed-day intervals of get_payment_interval.
+    """
+    return getattr(settings, 'IFRS9_PAYMENT_DATE_CONVENTION', 'calendar')
+
+
+def get_day_count_factor(day_count_ind):
+    return 360 if day_count_ind == '30/360' else 365
+
+
+def periods_per_year(v_amrt_term_unit, day_count_ind, convention):
+    """Number of payment periods in a year, used to derive the periodic rate of amortized loans."""
+    if convention == 'interval':
+        return get_day_count_factor(day_count_ind) / get_payment_interval(v_amrt_term_unit, day_count_ind).days
+    months, days = UNIT_STEPS.get(v_amrt_term_unit, (1, 0))
+    return 12 / months if months else get_day_count_factor(day_count_ind) / days
+
+
+def month_length(months):
+    """Number of days in each month of a datetime64[M] array."""
+    return ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.int64)
+
+
+def shift_months(dates, months):
+    """
+    Add calendar months to datetime64[D] dates. The day of month is kept and clamped to shorter months,
+    and dates on the last day of a month stay on month ends.
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    month_start = dates.astype('datetime64[M]')
+    day = (dates - month_start.astype('datetime64[D]')).astype(np.int64) + 1
+    month_end = day == month_length(month_start)
+
+    target = month_start + np.asarray(months, dtype=np.int64)
+    target_length = month_length(target)
+    target_day = np.where(month_end, target_length, np.minimum(day, target_length))
+    return target.astype('datetime64[D]') + (target_day - 1)
+
+
+def payment_counts(first_dates, maturity_dates, v_amrt_term_unit, day_count_ind, convention):
+    """
+    Number of payment dates from each first date up to and including its maturity date. Zero or negative
+    when the maturity date falls before the first date.
+    """
+    first_dates = np.asarray(first_dates, dtype='datetime64[D]')
+    maturity_dates = np.asarray(maturity_dates, dtype='datetime64[D]')
+    days_between = (maturity_dates - first_dates).astype(np.int64)
+    if convention == 'interval':
+        return days_between // get_payment_interval(v_amrt_term_unit, day_count_ind).days + 1
+
+    months, days = UNIT_STEPS.get(v_amrt_term_unit, (1, 0))
+    if days:
+        return days_between // days + 1
+    month_diff = (maturity_dates.astype('datetime64[M]') - first_dates.astype('datetime64[M]')).astype(np.int64)
+    steps = month_diff // months
+    # The last step lands in the maturity month and may still fall after the maturity day.
+    steps = np.where(shift_months(first_dates, steps * months) > maturity_dates, steps - 1, steps)
+    return steps + 1
+
+
+def payment_count(first_date, maturity_date, v_amrt_term_unit, day_count_ind, convention):
+    """Scalar payment_counts for a single loan."""
+    if first_date is None or maturity_date is None:
+        raise ValueError("missing first payment or maturity date")
+    return int(payment_counts([first_date], [maturity_date], v_amrt_term_unit, day_count_ind, convention)[0])
+
+
+def year_fractions(start_dates, end_dates, day_count_ind):
+    """
+    Accrual year fraction between datetime64[D] dates. '30/360' and '30/365' count 30-day months
+    (30E convention) over a 360 or 365 day year; other conventions count actual days over 365.
+    """
+    if day_count_ind not in ('30/360', '30/365'):
+        return (end_dates - start_dates).astype(np.int64) / 365
+
+    def parts(dates):
+        months = dates.astype('datetime64[M]')
+        day = (dates - months.astype('datetime64[D]')).astype(np.int64) + 1
+        return months.astype(np.int64), np.minimum(day, 30)
+
+    start_months, start_days = parts(start_dates)
+    end_months, end_days = parts(end_dates)
+    days = 30 * (end_months - start_months) + (end_days - start_days)
+    return days / get_day_count_factor(day_count_ind)
+
+
+@lru_cache(maxsize=GRID_CACHE_SIZE)
+def payment_date_grid(first_date, v_amrt_term_unit, count, day_count_ind, convention):
+    """
+    Payment dates (datetime64[D]) and accrual year fractions of the first count periods starting at
+    first_date. Loans sharing a next payment date share the grid, so the arrays are cached and read-only.
+    """
+    offsets = np.arange(-1, max(count, 0))
+    first = np.datetime64(first_date, 'D')
+    if convention == 'interval':
+        interval_days = get_payment_interval(v_amrt_term_unit, day_count_ind).days
+        dates = first + offsets * interval_days
+        fractions = np.full(max(count, 0), interval_days / get_day_count_factor(day_count_ind))
+    else:
+        months, days = UNIT_STEPS.get(v_amrt_term_unit, (1, 0))
+        dates = shift_months(first, offsets * months) if months else first + offsets * days
+        # The first period accrues from one step before the first payment date.
+        fractions = year_fractions(dates[:-1], dates[1:], day_count_ind)
+
+    dates = dates[1:]
+    dates.flags.writeable = False
+    fractions.flags.writeable = False
+    return dates, fractions
@@ -1,14 +1,16 @@
 from django.db import transaction
 from concurrent.futures import ThreadPoolExecutor
 from ..models import *
-from ..Functions import save_log
+from .reference_cache import reference_cache
+from .save_log import save_log
+from .account_pd_curves import account_pd_curves
 
 def get_latest_run_skey():
     """
     Retrieve the latest_run_skey from Dim_Run table.
     """
     try:
-        run_record = Dim_Run.objects.first()
+        run_record = reference_cache.first(Dim_Run)
         if not run_record:
             raise ValueError("No run key is available in the Dim_Run table.")
         return run_record.latest_run_skey
@@ -17,8 +19,9 @@ def get_latest_run_skey():
 
 def update_cash_flow_with_account_pd_buckets(fic_mis_date, batch_size=1000, max_workers=8):
     """
-    This function updates the fsi_Financial_Cash_Flow_Cal table using account-level PD values from 
-    FSI_PD_Account_Interpolated. It directly aligns the PD values to the cash flow buckets of each account.
+    This function updates the fsi_Financial_Cash_Flow_Cal table using account-level PD values, read from
+    FSI_PD_Account_Interpolated or computed on demand (see account_pd_curves). It directly aligns the PD values
+    to the cash flow buckets of each account.
     """
     try:
         n_run_skey = get_latest_run_skey()
@@ -28,31 +31,38 @@ def update_cash_flow_with_account_pd_buckets(fic_mis_date, batch_size=1000, max_
             save_log('update_cash_flow_with_account_pd_buckets', 'INFO', f"No cash flows found for fic_mis_date {fic_mis_date} and run_skey {n_run_skey}.")
             return 0  # Return 0 if no records are found
 
+        pd_curves = account_pd_curves(fic_mis_date)
+        # Cash flows carry no amortization term unit; it comes from the account's stage determination.
+        term_units = dict(
+            FCT_Stage_Determination.objects.filter(fic_mis_date=fic_mis_date).order_by('-pk').values_list(
+                'n_account_number', 'v_amrt_term_unit'
+            )
+        )
+        # Read the PDs of every bucket looked up below once, for all accounts, before the batches run.
+        pd_curves.load_buckets(
+            set(cash_flows.order_by().values_list('n_cash_flow_bucket_id', flat=True).distinct())
+            | {get_buckets_for_12_months(term_unit) for term_unit in set(term_units.values()) | {None}}
+        )
+
         def process_batch(batch):
             updates = []
             for cash_flow in batch:
                 try:
-                    account_pd_records = FSI_PD_Account_Interpolated.objects.filter(
-                        v_account_number=cash_flow.v_account_number,
-                        fic_mis_date=fic_mis_date
-                    )
-
-                    if account_pd_records.exists():
-                        pd_record = account_pd_records.filter(v_cash_flow_bucket_id=cash_flow.n_cash_flow_bucket_id).first()
-
-                        if pd_record:
-                            cash_flow.n_cumulative_loss_rate = pd_record.n_cumulative_default_prob * cash_flow.n_lgd_percent
-                            cash_flow.n_cumulative_impaired_prob = pd_record.n_cumulative_default_prob
-
-                            months_to_12m = get_buckets_for_12_months(cash_flow.v_amrt_term_unit)
-                            if cash_flow.n_cash_flow_bucket_id <= months_to_12m:
-                                cash_flow.n_12m_cumulative_pd = pd_record.n_cumulative_default_prob
-                            else:
-                                pd_record_12 = account_pd_records.filter(v_cash_flow_bucket_id=months_to_12m).first()
-                                if pd_record_12:
-                                    cash_flow.n_12m_cumulative_pd = pd_record_12.n_cumulative_default_prob
-
-                            updates.append(cash_flow)
+                    cumulative_pd = pd_curves.cumulative_pd(cash_flow.v_account_number, cash_flow.n_cash_flow_bucket_id)
+
+                    if cumulative_pd is not None:
+                        cash_flow.n_cumulative_loss_rate = cumulative_pd * cash_flow.n_lgd_percent
+                        cash_flow.n_cumulative_impaired_prob = cumulative_pd
+
+                        months_to_12m = get_buckets_for_12_months(term_units.get(cash_flow.v_account_number))
+                        if cash_flow.n_cash_flow_bucket_id <= months_to_12m:
+                            cash_flow.n_12m_cumulative_pd = cumulative_pd
+                        else:
+                            twelve_month_pd = pd_curves.cumulative_pd(cash_flow.v_account_number, months_to_12m)
+                            if twelve_month_pd is not None:
+                                cash_flow.n_12m_cumulative_pd = twelve_month_pd
+
+                        updates.append(cash_flow)
 
                 except Exception as e:
                     save_log('process_batch', 'ERROR', f"Error updating account {cash_flow.v_account_number}: {str(e)}")
@@ -1,6 +1,8 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from django.db.models import Sum
-from ..models import FCT_Stage_Determination, fsi_Financial_Cash_Flow_Cal, FSI_PD_Interpolated, Dim_Run
+from ..models import FCT_Stage_Determination, fsi_Financial_Cash_Flow_Cal, Dim_Run
+from .bulk_sql import update_from_rows
+from .keyset import keyset_batches
+from .pd_curve_index import MISSING, PDCurveIndex
+from .reference_cache import reference_cache
 from .save_log import save_log
 
 def get_latest_run_skey():
@@ -8,16 +10,17 @@ def get_latest_run_skey():
     Retrieve the latest_run_skey from Dim_Run table.
     """
     try:
-        run_record = Dim_Run.objects.first()
+        run_record = reference_cache.first(Dim_Run)
         if not run_record:
             raise ValueError("No run key is available in the Dim_Run table.")
         return run_record.latest_run_skey
     except Dim_Run.DoesNotExist:
         raise ValueError("Dim_Run table is missing.")
 
-def update_cash_flow_with_pd_buckets(fic_mis_date, max_workers=5, batch_size=1000):
+def update_cash_flow_with_pd_buckets(fic_mis_date, batch_size=5000):
     """
-    Updates cash flow records with PD buckets using bulk updates and multi-threading.
+    Updates cash flow records with PD buckets. Stage determination rows and PD curves are loaded once, so the
+    number of queries depends on the number of batches rather than on the number of cash flows.
     """
     try:
         n_run_skey = get_latest_run_skey()
@@ -27,79 +30,57 @@ def update_cash_flow_with_pd_buckets(fic_mis_date, max_workers=5, batch_size=100
             save_log('update_cash_flow_with_pd_buckets', 'INFO', f"No cash flows found for fic_mis_date {fic_mis_date} and run_skey {n_run_skey}.")
             return 0
 
-        total_updated_records = 0
+        accounts = {
+            account_number: account_data
+            for account_number, *account_data in FCT_Stage_Determination.objects.filter(
+                fic_mis_date=fic_mis_date
+            ).order_by('-pk').values_list(
+                'n_account_number', 'n_pd_term_structure_skey', 'n_credit_rating_code', 'n_delq_band_code',
+                'n_lgd_percent', 'v_amrt_term_unit',
+            )
+        }
+        pd_curves = PDCurveIndex(fic_mis_date)
 
-        def process_batch(batch):
+        total_updated_records = 0
+        batches = keyset_batches(
+            cash_flows.only('id', 'v_account_number', 'n_cash_flow_bucket_id', 'n_12m_cumulative_pd'), batch_size
+        )
+        for batch in batches:
             try:
                 updates = []
                 for cash_flow in batch:
-                    account_data = FCT_Stage_Determination.objects.filter(
-                        n_account_number=cash_flow.v_account_number,
-                        fic_mis_date=fic_mis_date
-                    ).first()
-
-                    if account_data:
-                        pd_records = FSI_PD_Interpolated.objects.filter(
-                            v_pd_term_structure_id=account_data.n_pd_term_structure_skey,
-                            fic_mis_date=fic_mis_date,
-                        )
-
-                        if pd_records.exists():
-                            pd_record = None
-                            if pd_records.first().v_pd_term_structure_type == 'R':
-                                pd_record = pd_records.filter(
-                                    v_int_rating_code=account_data.n_credit_rating_code,
-                                    v_cash_flow_bucket_id=cash_flow.n_cash_flow_bucket_id
-                                ).first()
-                            elif pd_records.first().v_pd_term_structure_type == 'D':
-                                pd_record = pd_records.filter(
-                                    v_delq_band_code=account_data.n_delq_band_code,
-                                    v_cash_flow_bucket_id=cash_flow.n_cash_flow_bucket_id
-                                ).first()
-
-                            if pd_record:
-                                cash_flow.n_cumulative_loss_rate = pd_record.n_cumulative_default_prob * account_data.n_lgd_percent
-                                cash_flow.n_cumulative_impaired_prob = pd_record.n_cumulative_default_prob
-
-                                months_to_12m = get_buckets_for_12_months(account_data.v_amrt_term_unit)
-                                if cash_flow.n_cash_flow_bucket_id <= months_to_12m:
-                                    cash_flow.n_12m_cumulative_pd = pd_record.n_cumulative_default_prob
-                                else:
-                                    pd_record_12 = pd_records.filter(v_cash_flow_bucket_id=months_to_12m).first()
-                                    if pd_record_12:
-                                        cash_flow.n_12m_cumulative_pd = pd_record_12.n_cumulative_default_prob
-
-                                updates.append(cash_flow)
-
-                if updates:
-                    fsi_Financial_Cash_Flow_Cal.objects.bulk_update(
-                        updates, 
-                        ['n_cumulative_loss_rate', 'n_cumulative_impaired_prob', 'n_12m_cumulative_pd']
-                    )
-                return len(updates)
+                    account_data = accounts.get(cash_flow.v_account_number)
+                    if account_data is None:
+                        continue
+                    term_structure_skey, rating_code, delq_band_code, lgd_percent, v_amrt_term_unit = account_data
+
+                    curve = pd_curves.curve(term_structure_skey, rating_code, delq_band_code)
+                    cumulative_pd = pd_curves.cumulative_pd(curve, cash_flow.n_cash_flow_bucket_id)
+                    if cumulative_pd is MISSING:
+                        continue
+
+                    cumulative_loss_rate = None
+                    if cumulative_pd is not None and lgd_percent is not None:
+                        cumulative_loss_rate = cumulative_pd * lgd_percent
+
+                    months_to_12m = get_buckets_for_12_months(v_amrt_term_unit)
+                    if cash_flow.n_cash_flow_bucket_id <= months_to_12m:
+                        twelve_month_pd = cumulative_pd
+                    else:
+                        twelve_month_pd = pd_curves.cumulative_pd(curve, months_to_12m)
+                        if twelve_month_pd is MISSING:
+                            twelve_month_pd = cash_flow.n_12m_cumulative_pd
+
+                    updates.append((cash_flow.id, cumulative_loss_rate, cumulative_pd, twelve_month_pd))
+
+                total_updated_records += update_from_rows(
+                    fsi_Financial_Cash_Flow_Cal, ['id'],
+                    ['n_cumulative_loss_rate', 'n_cumulative_impaired_prob', 'n_12m_cumulative_pd'],
+                    updates,
+                )
 
             except Exception as e:
                 save_log('update_cash_flow_with_pd_buckets', 'ERROR', f"Error updating batch: {e}")
-                return 0
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            batch = []
-            for cash_flow in cash_flows.iterator(chunk_size=batch_size):
-                batch.append(cash_flow)
-                if len(batch) >= batch_size:
-                    futures.append(executor.submit(process_batch, batch))
-                    batch = []
-
-            if batch:
-                futures.append(executor.submit(process_batch, batch))
-
-            for future in as_completed(futures):
-                try:
-                    total_updated_records += future.result()
-                except Exception as exc:
-                    save_log('update_cash_flow_with_pd_buckets', 'ERROR', f"Thread encountered an error: {exc}")
-                    return 0
 
         save_log('update_cash_flow_with_pd_buckets', 'INFO', f"Updated {total_updated_records} records for run_skey {n_run_skey} and fic_mis_date {fic_mis_date}.")
         return 1 if total_updated_records > 0 else 0
@@ -0,0 +1,58 @@
+from ..models import FSI_PD_Interpolated
+
+# Marks buckets that have no FSI_PD_Interpolated record in a curve.
+MISSING = object()
+
+
+class PDCurveIndex:
+    """
+    The interpolated PD curves of one MIS date, loaded from FSI_PD_Interpolated in a single query.
+    Curves are keyed by (term structure id, term structure type, rating or delinquency band code) and hold the
+    cumulative default probability of bucket n at index n. By default a record belongs to both the rating and
+    the band curve of its term structure; with by_record_type it only belongs to the curve of its own type.
+    """
+
+    def __init__(self, fic_mis_date, by_record_type=False):
+        self.structure_types = {}
+        self.curves = {}
+        records = FSI_PD_Interpolated.objects.filter(fic_mis_date=fic_mis_date).order_by('pk').values_list(
+            'v_pd_term_structure_id', 'v_pd_term_structure_type', 'v_int_rating_code', 'v_delq_band_code',
+            'v_cash_flow_bucket_id', 'n_cumulative_default_prob',
+        )
+        for term_structure_id, structure_type, rating_code, delq_band_code, bucket, cumulative_pd in records:
+            # The type of a term structure is the type of its first record.
+            self.structure_types.setdefault(term_structure_id, structure_type)
+            if by_record_type:
+                keys = ((term_structure_id, structure_type, rating_code if structure_type == 'R' else delq_band_code),)
+            else:
+                keys = ((term_structure_id, 'R', rating_code), (term_structure_id, 'D', delq_band_code))
+            for key in keys:
+                curve = self.curves.setdefault(key, [])
+                if bucket >= len(curve):
+                    curve.extend([MISSING] * (bucket + 1 - len(curve)))
+                if curve[bucket] is MISSING:
+                    curve[bucket] = cumulative_pd
+
+    def curve(self, term_structure_skey, rating_code, delq_band_code, structure_type=None):
+        """
+        The curve that applies to an account: by rating code for rating ('R') term structures and by
+        delinquency band for DPD ('D') term structures. None when there is no such curve. structure_type
+        defaults to the type of the term structure's first record.
+        """
+        if term_structure_skey is None:
+            return None
+        term_structure_id = str(term_structure_skey)
+        if structure_type is None:
+            structure_type = self.structure_types.get(term_structure_id)
+        if structure_type == 'R':
+            return self.curves.get((term_structure_id, 'R', rating_code))
+        if structure_type == 'D':
+            return self.curves.get((term_structure_id, 'D', delq_band_code))
+        return None
+
+    @staticmethod
+    def cumulative_pd(curve, bucket):
+        """Cumulative PD of bucket on curve, or MISSING."""
+        if curve is None or bucket is None or not 0 <= bucket < len(curve):
+            return MISSING
+        return curve[bucket]
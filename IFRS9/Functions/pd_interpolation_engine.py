@@ -0,0 +1,196 @@
+import math
+import numpy as np
+from functools import lru_cache
+from ..models import FSI_PD_Account_Interpolated, FSI_PD_Interpolated, Ldn_PD_Term_Structure_Dtl
+
+# Accounts interpolated together in one array by interpolate_accounts.
+ACCOUNT_CHUNK_SIZE = 10000
+
+# Maximum number of single-PD curves kept by pd_curve.
+CURVE_CACHE_SIZE = 4096
+
+# Buckets per year and cash flow bucket unit of each PD term frequency unit. Other units use yearly buckets.
+BUCKET_FREQUENCIES = {
+    'M': (12, 'M'),
+    'H': (2, 'H'),
+    'Q': (4, 'Q'),
+}
+DEFAULT_BUCKET_FREQUENCY = (1, 'Y')
+
+# Interpolation methods by FSI_LLFP_APP_PREFERENCES.pd_interpolation_method, filled by
+# register_interpolation_method.
+INTERPOLATION_METHODS = {}
+
+
+def register_interpolation_method(name):
+    """
+    Register an interpolation method under name. A method takes an array of annual PDs, the number of buckets
+    per year and the number of buckets, and returns 2D arrays of marginal and cumulative PDs with one row per
+    annual PD. NaN marks the buckets past the end of a curve.
+    """
+    def register(method):
+        INTERPOLATION_METHODS[name] = method
+        return method
+    return register
+
+
+def constant_marginal_curves(marginal_pd, periods):
+    """Curves with a constant marginal PD m per bucket, so the cumulative PD of bucket k is 1 - (1 - m) ** k."""
+    buckets = np.arange(1, periods + 1)
+    marginal = np.broadcast_to(marginal_pd[:, None], (len(marginal_pd), periods))
+    cumulative = 1 - (1 - marginal_pd[:, None]) ** buckets
+    return marginal, cumulative
+
+
+@register_interpolation_method('NL-POISSON')
+def interpolate_poisson(pd_percent, bucket_frequency, periods):
+    epsilon = 1e-6  # Keeps the logarithm finite for PDs of 0 and 1
+    pd_percent = np.clip(pd_percent, epsilon, 1 - epsilon)
+    return constant_marginal_curves(1 - np.exp(np.log(1 - pd_percent) / bucket_frequency), periods)
+
+
+@register_interpolation_method('NL-GEOMETRIC')
+def interpolate_geometric(pd_percent, bucket_frequency, periods):
+    return constant_marginal_curves((1 + pd_percent) ** (1 / bucket_frequency) - 1, periods)
+
+
+@register_interpolation_method('NL-ARITHMETIC')
+def interpolate_arithmetic(pd_percent, bucket_frequency, periods):
+    return constant_marginal_curves(pd_percent / bucket_frequency, periods)
+
+
+def round_4(values):
+    """
+    Round to 4 decimals like round(). np.round scales by 10**4 first, which can flip values lying next to a
+    half-way point, so those few are rounded one by one.
+    """
+    rounded = np.round(values, 4)
+    scaled = values * 1e4
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_half.any():
+        rounded[near_half] = [round(value, 4) for value in values[near_half].tolist()]
+    return rounded
+
+
+@register_interpolation_method('EXPONENTIAL_DECAY')
+def interpolate_exponential_decay(pd_percent, bucket_frequency, periods):
+    """
+    Marginal PDs decay with the surviving population. Every bucket is rounded to 4 decimals, so the curves are
+    built bucket by bucket (for all PDs at once) and each one ends at the bucket where no population remains.
+    """
+    if bucket_frequency != 1:
+        pd_percent = 1 - (1 - pd_percent) ** (1 / bucket_frequency)
+
+    marginal = np.full((len(pd_percent), periods), np.nan)
+    cumulative = np.full((len(pd_percent), periods), np.nan)
+    population_remaining = np.ones(len(pd_percent))
+    cumulative_pd = np.zeros(len(pd_percent))
+    active = np.ones(len(pd_percent), dtype=bool)
+    for bucket in range(periods):
+        if not active.any():
+            break
+        marginal_pd = round_4(population_remaining * pd_percent)
+        population_remaining = round_4(population_remaining - marginal_pd)
+        cumulative_pd = round_4(cumulative_pd + marginal_pd)
+        marginal[active, bucket] = marginal_pd[active]
+        cumulative[active, bucket] = cumulative_pd[active]
+        active &= population_remaining > 0
+    return marginal, cumulative
+
+
+@lru_cache(maxsize=CURVE_CACHE_SIZE)
+def pd_curve(pd_percent, bucket_frequency, pd_interpolation_method, horizon):
+    """
+    Marginal and cumulative PDs of buckets 1 to horizon for one annual PD, as read-only arrays with NaN past the
+    end of the curve. Callers round horizon up (see curve_horizon) so curves are shared between accounts.
+    """
+    marginal, cumulative = INTERPOLATION_METHODS[pd_interpolation_method](
+        np.array([pd_percent]), bucket_frequency, horizon
+    )
+    marginal, cumulative = np.array(marginal[0]), np.array(cumulative[0])
+    marginal.flags.writeable = False
+    cumulative.flags.writeable = False
+    return marginal, cumulative
+
+
+def curve_horizon(buckets):
+    """The power of two at or above buckets, so a few cached curve lengths cover every account."""
+    return 1 << max(buckets - 1, 0).bit_length()
+
+
+def interpolate_term_structures(fic_mis_date, pd_interpolation_method, pd_model_proj_cap):
+    """
+    Interpolate the PD curves of every term structure detail of fic_mis_date and return them as unsaved
+    FSI_PD_Interpolated records. Details sharing a bucket frequency are interpolated with one call of the method.
+    """
+    method = INTERPOLATION_METHODS[pd_interpolation_method]
+    details = Ldn_PD_Term_Structure_Dtl.objects.filter(
+        fic_mis_date=fic_mis_date
+    ).select_related('v_pd_term_structure_id').order_by('pk')
+
+    groups = {}
+    for detail in details:
+        frequency_unit = detail.v_pd_term_structure_id.v_pd_term_frequency_unit
+        groups.setdefault(BUCKET_FREQUENCIES.get(frequency_unit, DEFAULT_BUCKET_FREQUENCY), []).append(detail)
+
+    records = []
+    for (bucket_frequency, cash_flow_bucket_unit), group in groups.items():
+        pd_percent = np.array([float(detail.n_pd_percent) for detail in group])
+        marginal, cumulative = method(pd_percent, bucket_frequency, bucket_frequency * pd_model_proj_cap)
+
+        for detail, marginal_curve, cumulative_curve in zip(group, marginal.tolist(), cumulative.tolist()):
+            term_structure = detail.v_pd_term_structure_id
+            structure_type = term_structure.v_pd_term_structure_type
+            for bucket, (marginal_pd, cumulative_pd) in enumerate(zip(marginal_curve, cumulative_curve), start=1):
+                if math.isnan(cumulative_pd):
+                    break
+                records.append(FSI_PD_Interpolated(
+                    v_pd_term_structure_id=term_structure.v_pd_term_structure_id,
+                    fic_mis_date=term_structure.fic_mis_date,
+                    v_int_rating_code=detail.v_credit_risk_basis_cd if structure_type == 'R' else None,
+                    v_delq_band_code=detail.v_credit_risk_basis_cd if structure_type == 'D' else None,
+                    v_pd_term_structure_type=structure_type,
+                    n_pd_percent=detail.n_pd_percent,
+                    n_per_period_default_prob=marginal_pd,
+                    n_cumulative_default_prob=cumulative_pd,
+                    v_cash_flow_bucket_id=bucket,
+                    v_cash_flow_bucket_unit=cash_flow_bucket_unit,
+                ))
+    return records
+
+
+def interpolate_accounts(accounts, max_buckets, pd_interpolation_method, chunk_size=ACCOUNT_CHUNK_SIZE):
+    """
+    Yield unsaved FSI_PD_Account_Interpolated records for accounts, given as (fic_mis_date, account number, PD,
+    interest frequency unit) tuples, up to the last cash flow bucket of each account in max_buckets. Accounts
+    sharing a bucket frequency are interpolated chunk_size at a time as one array padded to the longest curve.
+    """
+    method = INTERPOLATION_METHODS[pd_interpolation_method]
+    groups = {}
+    for account in accounts:
+        groups.setdefault(BUCKET_FREQUENCIES.get(account[3], DEFAULT_BUCKET_FREQUENCY), []).append(account)
+
+    for (bucket_frequency, cash_flow_bucket_unit), group in groups.items():
+        for start in range(0, len(group), chunk_size):
+            chunk = group[start:start + chunk_size]
+            last_buckets = np.array([max_buckets[account[1]] for account in chunk])
+            marginal, cumulative = method(
+                np.array([float(account[2]) for account in chunk]), bucket_frequency, int(last_buckets.max())
+            )
+            # Blank out the padding past each account's last bucket.
+            cumulative = np.where(np.arange(1, cumulative.shape[1] + 1) <= last_buckets[:, None], cumulative, np.nan)
+
+            for account, marginal_curve, cumulative_curve in zip(chunk, marginal.tolist(), cumulative.tolist()):
+                fic_mis_date, account_number, pd_percent, _ = account
+                for bucket, (marginal_pd, cumulative_pd) in enumerate(zip(marginal_curve, cumulative_curve), start=1):
+                    if math.isnan(cumulative_pd):
+                        break
+                    yield FSI_PD_Account_Interpolated(
+                        fic_mis_date=fic_mis_date,
+                        v_account_number=account_number,
+                        n_pd_percent=pd_percent,
+                        n_per_period_default_prob=marginal_pd,
+                        n_cumulative_default_prob=cumulative_pd,
+                        v_cash_flow_bucket_id=bucket,
+                        v_cash_flow_bucket_unit=cash_flow_bucket_unit,
+                    )
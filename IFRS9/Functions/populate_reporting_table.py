@@ -2,6 +2,7 @@ from concurrent.futures import ThreadPoolExecutor
 from django.db import transaction
 from django.utils import timezone
 from ..models import FCT_Stage_Determination, FCT_Reporting_Lines, Dim_Run, ECLMethod
+from .reference_cache import reference_cache
 from .save_log import save_log
 
 def get_next_run_skey():
@@ -32,16 +33,14 @@ def get_run_skey_for_method():
     If the method is 'simple_ead', generate a new run_skey.
     """
     try:
-        ecl_method = ECLMethod.objects.get(method_name='simple_ead')
+        ecl_method = reference_cache.mapping(ECLMethod, 'method_name').get('simple_ead')
         if ecl_method:
             # Generate a new run_skey for 'simple_ead' method
             return get_next_run_skey()
         else:
+            save_log('get_run_skey_for_method', 'ERROR', "ECL Method 'simple_ead' does not exist.")
             # Default behavior: use the latest run key from Dim_Run
             return Dim_Run.objects.latest('latest_run_skey').latest_run_skey
-    except ECLMethod.DoesNotExist:
-        save_log('get_run_skey_for_method', 'ERROR', "ECL Method 'simple_ead' does not exist.")
-        return Dim_Run.objects.latest('latest_run_skey').latest_run_skey
     except Exception as e:
         save_log('get_run_skey_for_method', 'ERROR', f"Error retrieving run_skey: {e}")
         return None
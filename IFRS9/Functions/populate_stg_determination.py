@@ -1,42 +1,56 @@
 import concurrent.futures
-from django.db import transaction
+import time
+from django.db import connection, transaction
 from ..models import *
+from .prior_stages import invalidate_prior_stage_snapshot
 from .save_log import save_log
 
+# FCT_Stage_Determination fields and the Ldn_Financial_Instrument fields they are copied from.
+STAGE_FIELD_SOURCES = [
+    ('fic_mis_date', 'fic_mis_date'),
+    ('n_account_number', 'v_account_number'),
+    ('n_curr_interest_rate', 'n_curr_interest_rate'),
+    ('n_effective_interest_rate', 'n_effective_interest_rate'),
+    ('n_accrued_interest', 'n_accrued_interest'),
+    ('n_rate_chg_min', 'n_interest_changing_rate'),
+    ('n_accrual_basis_code', 'v_day_count_ind'),
+    ('n_pd_percent', 'n_pd_percent'),
+    ('n_lgd_percent', 'n_lgd_percent'),
+    ('d_acct_start_date', 'd_start_date'),
+    ('d_last_payment_date', 'd_last_payment_date'),
+    ('d_next_payment_date', 'd_next_payment_date'),
+    ('d_maturity_date', 'd_maturity_date'),
+    ('v_ccy_code', 'v_ccy_code'),
+    ('n_eop_prin_bal', 'n_eop_curr_prin_bal'),
+    ('n_carrying_amount_ncy', 'n_eop_bal'),
+    ('n_collateral_amount', 'n_collateral_amount'),
+    ('n_delinquent_days', 'n_delinquent_days'),
+    ('v_amrt_repayment_type', 'v_amrt_repayment_type'),
+    ('v_amrt_term_unit', 'v_amrt_term_unit'),
+    ('n_prod_code', 'v_prod_code'),
+    ('n_cust_ref_code', 'v_cust_ref_code'),
+    ('n_loan_type', 'v_loan_type'),
+    ('n_acct_rating_movement', 'v_acct_rating_movement'),
+    ('n_credit_rating_code', 'v_credit_rating_code'),
+    ('n_org_credit_score', 'v_org_credit_score'),
+    ('n_curr_credit_score', 'v_curr_credit_score'),
+]
+
+# Vendors that run the single INSERT ... SELECT, with the expression that truncates a decimal column to an
+# integer the way Django does when saving a Decimal into an IntegerField.
+SET_BASED_TRUNCATE_SQL = {
+    'mysql': 'TRUNCATE({}, 0)',
+    'postgresql': 'TRUNC({})',
+    'sqlite': 'CAST({} AS INTEGER)',
+}
+
 # Function to handle bulk insertion of records in chunks
 def insert_records_chunk(records_chunk):
     # Prepare list for bulk insert
-    bulk_records = []
-    for record in records_chunk:
-        bulk_records.append(FCT_Stage_Determination(
-            fic_mis_date=record.fic_mis_date,
-            n_account_number=record.v_account_number,
-            n_curr_interest_rate=record.n_curr_interest_rate,
-            n_effective_interest_rate=record.n_effective_interest_rate,
-            n_accrued_interest=record.n_accrued_interest,
-            n_rate_chg_min=record.n_interest_changing_rate,
-            n_accrual_basis_code=record.v_day_count_ind,
-            n_pd_percent=record.n_pd_percent,
-            n_lgd_percent=record.n_lgd_percent,
-            d_acct_start_date=record.d_start_date,
-            d_last_payment_date=record.d_last_payment_date,
-            d_next_payment_date=record.d_next_payment_date,
-            d_maturity_date=record.d_maturity_date,
-            v_ccy_code=record.v_ccy_code,
-            n_eop_prin_bal=record.n_eop_curr_prin_bal,
-            n_carrying_amount_ncy=record.n_eop_bal,
-            n_collateral_amount=record.n_collateral_amount,
-            n_delinquent_days=record.n_delinquent_days,
-            v_amrt_repayment_type=record.v_amrt_repayment_type,
-            v_amrt_term_unit=record.v_amrt_term_unit,
-            n_prod_code=record.v_prod_code,
-            n_cust_ref_code=record.v_cust_ref_code,
-            n_loan_type=record.v_loan_type,
-            n_acct_rating_movement=record.v_acct_rating_movement,
-            n_credit_rating_code=record.v_credit_rating_code,
-            n_org_credit_score=record.v_org_credit_score,
-            n_curr_credit_score=record.v_curr_credit_score,
-        ))
+    bulk_records = [
+        FCT_Stage_Determination(**{field: getattr(record, source) for field, source in STAGE_FIELD_SOURCES})
+        for record in records_chunk
+    ]
 
     # Perform bulk insert
     try:
@@ -45,15 +59,84 @@ def insert_records_chunk(records_chunk):
     except Exception as e:
         save_log('insert_records_chunk', 'ERROR', f"Error inserting records: {e}", status='FAILURE')
 
-            
+
+def insert_stage_sql(fic_mis_date):
+    """
+    The INSERT INTO fct_stage_determination ... SELECT ... FROM ldn_financial_instrument statement copying the
+    records of fic_mis_date, and its parameters. Fields that are not copied and have a default get it, as they
+    would from bulk_create.
+    """
+    qn = connection.ops.quote_name
+    target = FCT_Stage_Determination._meta
+    source = Ldn_Financial_Instrument._meta
+    columns = []
+    select_sql = []
+    params = []
+    for field_name, source_name in STAGE_FIELD_SOURCES:
+        field = target.get_field(field_name)
+        source_field = source.get_field(source_name)
+        value_sql = qn(source_field.column)
+        if field.get_internal_type() in ('IntegerField', 'BigIntegerField') and source_field.get_internal_type() == 'DecimalField':
+            value_sql = SET_BASED_TRUNCATE_SQL[connection.vendor].format(value_sql)
+        columns.append(qn(field.column))
+        select_sql.append(value_sql)
+
+    copied = {field_name for field_name, _ in STAGE_FIELD_SOURCES}
+    for field in target.concrete_fields:
+        if field.primary_key or field.name in copied or field.get_default() is None:
+            continue
+        columns.append(qn(field.column))
+        select_sql.append(f"CAST(%s AS {field.cast_db_type(connection)})" if connection.vendor == 'postgresql' else '%s')
+        params.append(field.get_db_prep_save(field.get_default(), connection))
+
+    sql = (
+        f"INSERT INTO {qn(target.db_table)} ({', '.join(columns)}) "
+        f"SELECT {', '.join(select_sql)} FROM {qn(source.db_table)} "
+        f"WHERE {qn(source.get_field('fic_mis_date').column)} = %s ORDER BY {qn(source.pk.column)}"
+    )
+    return sql, params + [source.get_field('fic_mis_date').get_db_prep_save(fic_mis_date, connection)]
+
+
+def insert_fct_stage_set_based(fic_mis_date):
+    """
+    Replace the FCT_Stage_Determination records of fic_mis_date with those of Ldn_Financial_Instrument in
+    one transaction: a DELETE and a single INSERT ... SELECT. Returns the number of deleted and inserted rows.
+    """
+    sql, params = insert_stage_sql(fic_mis_date)
+    with transaction.atomic():
+        deleted, _ = FCT_Stage_Determination.objects.filter(fic_mis_date=fic_mis_date).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            inserted = cursor.rowcount
+    return deleted, inserted
+
+
 def insert_fct_stage(fic_mis_date, chunk_size=100):
     """
     Inserts data into FCT_Stage_Determination table from Ldn_Financial_Instrument based on the given fic_mis_date.
-    Deletes existing records for the same fic_mis_date before inserting. Uses multi-threading to process records in chunks.
+    Deletes existing records for the same fic_mis_date before inserting. On databases with a set-based path the
+    records are copied with a single INSERT ... SELECT; otherwise multi-threading is used to process records in chunks.
     :param fic_mis_date: The date to filter records in both FCT_Stage_Determination and Ldn_Financial_Instrument.
     :param chunk_size: The size of the data chunks to process concurrently.
     """
     try:
+        # The prior stage snapshot may have been built from the records being replaced
+        invalidate_prior_stage_snapshot(fic_mis_date)
+
+        if connection.vendor in SET_BASED_TRUNCATE_SQL:
+            started = time.perf_counter()
+            deleted, inserted = insert_fct_stage_set_based(fic_mis_date)
+            elapsed = time.perf_counter() - started
+            if deleted:
+                save_log('insert_fct_stage', 'INFO', f"Deleted {deleted} existing records for {fic_mis_date} in FCT_Stage_Determination.", status='SUCCESS')
+            if inserted == 0:
+                save_log('insert_fct_stage', 'INFO', f"No records found for {fic_mis_date} in Ldn_Financial_Instrument.", status='SUCCESS')
+                return '0'
+            save_log('insert_fct_stage', 'INFO', f"{inserted} records for {fic_mis_date} inserted into FCT_Stage_Determination with INSERT ... SELECT in {elapsed:.2f}s.", status='SUCCESS')
+            return '1'
+
+        started = time.perf_counter()
+
         # Step 1: Check if data for the given fic_mis_date exists in FCT_Stage_Determination
         if FCT_Stage_Determination.objects.filter(fic_mis_date=fic_mis_date).exists():
             # If exists, delete the records
@@ -87,7 +170,7 @@ def insert_fct_stage(fic_mis_date, chunk_size=100):
                     save_log('insert_fct_stage', 'ERROR', f"Error occurred during record insertion: {exc}", status='FAILURE')
                     return '0'  # Return '0' if any thread encounters an error
 
-        save_log('insert_fct_stage', 'INFO', f"{total_records} records for {fic_mis_date} inserted successfully into FCT_Stage_Determination.", status='SUCCESS')
+        save_log('insert_fct_stage', 'INFO', f"{total_records} records for {fic_mis_date} inserted successfully into FCT_Stage_Determination in {time.perf_counter() - started:.2f}s.", status='SUCCESS')
         return '1'  # Return '1' on successful completion
 
     except Exception as e:
@@ -0,0 +1,143 @@
+from bisect import bisect_left
+from django.db import connection, transaction
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+from ..models import FCT_Prior_Stage_Snapshot, FCT_Stage_Determination
+from .bulk_sql import update_from_rows
+from .save_log import save_log
+
+# Rows fetched per round trip while streaming prior-period records.
+FETCH_SIZE = 20000
+
+# Fields of FCT_Stage_Determination kept in FCT_Prior_Stage_Snapshot.
+SNAPSHOT_FIELDS = [
+    'fic_mis_date', 'n_curr_ifrs_stage_skey', 'n_in_cooling_period_flag', 'd_cooling_start_date',
+    'n_cooling_period_duration', 'n_target_ifrs_stage_skey',
+]
+
+
+class PriorStageMap:
+    """
+    Prior-period values by account number, held as a sorted array of account numbers and one array per field
+    instead of a dict of tuples. get() finds an account by binary search.
+    """
+
+    def __init__(self, records, field_count):
+        """
+        records are (account number, *values) tuples; the first record of each account is kept. They are sorted
+        here, as the database may order account numbers differently (case-insensitive collations).
+        """
+        latest = first_per_account(records)
+        self.account_numbers = sorted(latest)
+        self.columns = [[] for _ in range(field_count)]
+        for account_number in self.account_numbers:
+            for column, value in zip(self.columns, latest[account_number]):
+                column.append(value)
+
+    def __len__(self):
+        return len(self.account_numbers)
+
+    def get(self, account_number, default=None):
+        """The values of account_number as a tuple, or default."""
+        index = bisect_left(self.account_numbers, account_number)
+        if index == len(self.account_numbers) or self.account_numbers[index] != account_number:
+            return default
+        return tuple(column[index] for column in self.columns)
+
+
+def snapshot_covers(fic_mis_date):
+    """
+    True when FCT_Prior_Stage_Snapshot holds the latest record before fic_mis_date of every account: it was
+    refreshed for an earlier MIS date and no records were added between that date and fic_mis_date since.
+    """
+    snapshot_date = FCT_Prior_Stage_Snapshot.objects.aggregate(latest=Max('fic_mis_date'))['latest']
+    if snapshot_date is None or snapshot_date >= fic_mis_date:
+        return False
+    return not FCT_Stage_Determination.objects.filter(fic_mis_date__gt=snapshot_date, fic_mis_date__lt=fic_mis_date).exists()
+
+
+def latest_records(records):
+    """The latest record of each account of the FCT_Stage_Determination queryset records, by account number."""
+    if connection.features.supports_over_clause:
+        return records.annotate(prior_rank=Window(
+            RowNumber(), partition_by=[F('n_account_number')], order_by=[F('fic_mis_date').desc(), F('pk').asc()]
+        )).filter(prior_rank=1).order_by('n_account_number')
+    return records.order_by('n_account_number', '-fic_mis_date', 'pk')
+
+
+def load_prior_stages(fic_mis_date, fields):
+    """
+    The given fields of the latest FCT_Stage_Determination record before fic_mis_date of every account of
+    fic_mis_date, as a PriorStageMap. They are read from FCT_Prior_Stage_Snapshot when it covers fic_mis_date,
+    otherwise from the stage history: with a window function where the database has them, else by streaming
+    the prior records newest first and keeping the first one of each account.
+    """
+    fic_mis_date = FCT_Stage_Determination._meta.get_field('fic_mis_date').to_python(fic_mis_date)
+    current_accounts = FCT_Stage_Determination.objects.filter(fic_mis_date=fic_mis_date).values('n_account_number')
+
+    if snapshot_covers(fic_mis_date):
+        records = FCT_Prior_Stage_Snapshot.objects.filter(n_account_number__in=current_accounts).order_by('n_account_number')
+    else:
+        records = latest_records(FCT_Stage_Determination.objects.filter(
+            fic_mis_date__lt=fic_mis_date, n_account_number__in=current_accounts
+        ))
+    return PriorStageMap(records.values_list('n_account_number', *fields).iterator(chunk_size=FETCH_SIZE), len(fields))
+
+
+def first_per_account(records):
+    """The values of the first of the (account number, *values) records of each account, by account number."""
+    latest = {}
+    for account_number, *values in records:
+        if account_number is not None:
+            latest.setdefault(account_number, values)
+    return latest
+
+
+def invalidate_prior_stage_snapshot(fic_mis_date):
+    """
+    Empty FCT_Prior_Stage_Snapshot when the FCT_Stage_Determination records of fic_mis_date are about to be
+    rewritten and the snapshot may have been built from them. The next refresh_prior_stage_snapshot rebuilds it.
+    """
+    fic_mis_date = FCT_Stage_Determination._meta.get_field('fic_mis_date').to_python(fic_mis_date)
+    if FCT_Prior_Stage_Snapshot.objects.filter(fic_mis_date__gte=fic_mis_date).exists():
+        FCT_Prior_Stage_Snapshot.objects.all().delete()
+        save_log('invalidate_prior_stage_snapshot', 'INFO', f"Prior stage snapshot cleared: the records of fic_mis_date {fic_mis_date} are rewritten.")
+
+
+def refresh_prior_stage_snapshot(fic_mis_date):
+    """
+    Bring FCT_Prior_Stage_Snapshot up to date with the FCT_Stage_Determination records of fic_mis_date. When
+    the snapshot covers fic_mis_date, those records replace the snapshot of their accounts; otherwise (empty,
+    invalidated or out of date snapshot) it is rebuilt from the latest record of every account up to fic_mis_date.
+    """
+    try:
+        fic_mis_date = FCT_Stage_Determination._meta.get_field('fic_mis_date').to_python(fic_mis_date)
+        merge = snapshot_covers(fic_mis_date)
+        if merge:
+            records = FCT_Stage_Determination.objects.filter(fic_mis_date=fic_mis_date).order_by('n_account_number', 'pk')
+        else:
+            records = latest_records(FCT_Stage_Determination.objects.filter(fic_mis_date__lte=fic_mis_date))
+        latest = first_per_account(records.values_list('n_account_number', *SNAPSHOT_FIELDS).iterator(chunk_size=FETCH_SIZE))
+
+        with transaction.atomic():
+            if merge:
+                existing = set(FCT_Prior_Stage_Snapshot.objects.values_list('n_account_number', flat=True))
+            else:
+                FCT_Prior_Stage_Snapshot.objects.all().delete()
+                existing = set()
+            new_snapshots = [
+                FCT_Prior_Stage_Snapshot(n_account_number=account_number, **dict(zip(SNAPSHOT_FIELDS, values)))
+                for account_number, values in latest.items() if account_number not in existing
+            ]
+            updated_snapshots = [
+                (account_number, *values) for account_number, values in latest.items() if account_number in existing
+            ]
+            FCT_Prior_Stage_Snapshot.objects.bulk_create(new_snapshots, batch_size=FETCH_SIZE)
+            update_from_rows(FCT_Prior_Stage_Snapshot, ['n_account_number'], SNAPSHOT_FIELDS, updated_snapshots)
+
+        save_log('refresh_prior_stage_snapshot', 'INFO', f"Prior stage snapshot {'refreshed' if merge else 'rebuilt'} for fic_mis_date {fic_mis_date}: {len(new_snapshots)} accounts added, {len(updated_snapshots)} updated.")
+        return 1
+
+    except Exception as e:
+        save_log('refresh_prior_stage_snapshot', 'ERROR', f"Error refreshing the prior stage snapshot for fic_mis_date {fic_mis_date}: {e}")
+        return 0
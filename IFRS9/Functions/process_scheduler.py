@@ -0,0 +1,105 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+from django.db import connections
+from .save_log import save_log
+
+
+def get_execution_mode():
+    """
+    'sequential' runs the functions of a process one after another in their order; 'dag' runs every function as
+    soon as the functions it depends on have succeeded, up to IFRS9_PROCESS_MAX_WORKERS at a time.
+    """
+    return getattr(settings, 'IFRS9_PROCESS_EXECUTION_MODE', 'sequential')
+
+
+def get_max_workers():
+    return getattr(settings, 'IFRS9_PROCESS_MAX_WORKERS', 4)
+
+
+def parse_tables(tables):
+    """The lower-cased table (or table.column) names of a comma or newline separated declaration."""
+    return {name.strip().lower() for name in (tables or '').replace('\n', ',').split(',') if name.strip()}
+
+
+def tables_overlap(tables, other_tables):
+    """True when a name of tables is, contains or is contained in a name of other_tables."""
+    for name in tables:
+        for other_name in other_tables:
+            if name == other_name or name.startswith(other_name + '.') or other_name.startswith(name + '.'):
+                return True
+    return False
+
+
+def build_dependencies(functions):
+    """
+    The dependencies of each function of a process, given in execution order, as sets of the indexes of the
+    earlier functions it has to wait for. A function waits for the earlier functions it lists in depends_on and
+    for those whose declared tables conflict with its own (one writes what the other reads or writes). A
+    function that declares neither tables nor dependencies waits for, and is waited for by, every other one.
+    """
+    declarations = []
+    for function in functions:
+        reads = parse_tables(function.reads_tables)
+        writes = parse_tables(function.writes_tables)
+        depends_on = {dependency.pk for dependency in function.depends_on.all()}
+        declarations.append((reads, writes, depends_on, bool(reads or writes or depends_on)))
+
+    dependencies = []
+    for index, (reads, writes, depends_on, declared) in enumerate(declarations):
+        waits_for = set()
+        for earlier_index, (earlier_reads, earlier_writes, _, earlier_declared) in enumerate(declarations[:index]):
+            if (
+                not declared or not earlier_declared
+                or functions[earlier_index].pk in depends_on
+                or tables_overlap(earlier_writes, reads | writes)
+                or tables_overlap(earlier_reads, writes)
+            ):
+                waits_for.add(earlier_index)
+        dependencies.append(waits_for)
+    return dependencies
+
+
+def run_dag(entries, dependencies, run_entry, max_workers=None, completed=()):
+    """
+    Call run_entry(entry) for every entry once all entries it depends on have succeeded, running independent
+    entries in parallel in a pool of max_workers threads. run_entry returns True when the run may go on; after
+    a False (or an exception) no further entry is started and the running ones are waited for. The entries
+    whose indexes are in completed count as succeeded and are not run. Returns True when every entry succeeded.
+    """
+    max_workers = max_workers or get_max_workers()
+
+    def run_in_worker(entry):
+        try:
+            return run_entry(entry)
+        finally:
+            # Worker threads open their own database connections.
+            connections.close_all()
+
+    succeeded = set(completed)
+    remaining = [index for index in range(len(entries)) if index not in succeeded]
+    running = {}
+    stopped = False
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            if not stopped:
+                for index in [index for index in remaining if dependencies[index] <= succeeded]:
+                    if len(running) >= max_workers:
+                        break
+                    remaining.remove(index)
+                    running[executor.submit(run_in_worker, entries[index])] = index
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    save_log('run_dag', 'ERROR', f"Error running {entries[index]}: {e}")
+                    result = False
+                if result:
+                    succeeded.add(index)
+                else:
+                    stopped = True
+    return not stopped and not remaining
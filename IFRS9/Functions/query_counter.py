@@ -0,0 +1,24 @@
+import threading
+from contextlib import contextmanager
+from django.db import connection
+
+
+class QueryCounter:
+    """
+    Counts the database queries issued while installed. The same counter can be installed from several
+    threads at once; each thread installs it on its own connection.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def install(self):
+        with connection.execute_wrapper(self):
+            yield self
@@ -0,0 +1,121 @@
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .save_log import save_log
+
+
+class ReferenceDataCache:
+    """
+    Reference tables (preferences, run keys, methods, term structures, bands, ...) loaded once per pipeline run
+    and shared by its stages. Entries are keyed by (model, fic_mis_date, variant) and dropped whenever a record
+    of their model is saved or deleted, and again when that change commits. Outside a run every lookup goes to
+    the database, so edits made by other processes between runs are always picked up. Cached records are shared
+    between threads: read, never modify.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._generations = {}
+        self._labels = set()
+        self._runs = 0
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def run_scope(self, name='pipeline run'):
+        """Cache reference data for the duration of a run and log the hit/miss counters at its end."""
+        with self._lock:
+            if self._runs == 0:
+                self._reset()
+            self._runs += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._runs -= 1
+                stats = self.stats()
+                if self._runs == 0:
+                    self._reset()
+            save_log('reference_cache', 'INFO', f"Reference data cache for {name}: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries.")
+
+    def get(self, model, loader, fic_mis_date=None, variant=None):
+        """The value loader() returns for (model, fic_mis_date, variant), loaded at most once per run."""
+        label = model._meta.label
+        key = (label, fic_mis_date, variant)
+        if not self._runs:
+            return loader()
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            self._labels.add(label)
+            generation = self._generations.get(label, 0)
+
+        value = loader()
+        with self._lock:
+            # Keep the value only if no record of the model changed while it was being loaded.
+            if self._runs and self._generations.get(label, 0) == generation:
+                self._entries[key] = value
+        return value
+
+    def first(self, model):
+        """model.objects.first()"""
+        return self.get(model, model.objects.first, variant='first')
+
+    def rows(self, model, fic_mis_date=None):
+        """The records of model as a list, only those of fic_mis_date when given."""
+        def load():
+            queryset = model.objects.all() if fic_mis_date is None else model.objects.filter(fic_mis_date=fic_mis_date)
+            return list(queryset)
+        return self.get(model, load, fic_mis_date, variant='rows')
+
+    def mapping(self, model, key_field, value_field=None, fic_mis_date=None):
+        """
+        The records of model by key_field, or their value_field when given. The first record wins when several
+        share a key.
+        """
+        def load():
+            result = {}
+            for record in self.rows(model, fic_mis_date):
+                result.setdefault(getattr(record, key_field), getattr(record, value_field) if value_field else record)
+            return result
+        return self.get(model, load, fic_mis_date, variant=('mapping', key_field, value_field))
+
+    def invalidate(self, model):
+        """Drop every entry of model."""
+        label = model._meta.label
+        if label not in self._labels:
+            return
+        with self._lock:
+            self._generations[label] = self._generations.get(label, 0) + 1
+            for key in [key for key in self._entries if key[0] == label]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+    def _reset(self):
+        self._entries.clear()
+        self._labels.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+reference_cache = ReferenceDataCache()
+
+
+@receiver([post_save, post_delete], dispatch_uid='ifrs9_reference_cache')
+def invalidate_reference_data(sender, using=None, **kwargs):
+    # The signals fire before the change commits: another thread may reload the old committed rows in between,
+    # so the entries are dropped once more on commit (at once outside a transaction).
+    reference_cache.invalidate(sender)
+    transaction.on_commit(lambda: reference_cache.invalidate(sender), using=using)
@@ -1,14 +1,20 @@
-from django.db import transaction
+from django.db import connection, transaction
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from ..models import FCT_Stage_Determination, fsi_Financial_Cash_Flow_Cal, Dim_Run
+from .bulk_sql import JOINED_UPDATE_VENDORS, joined_update_sql
+from .keyset import account_ranges, keyset_batches
+from .reference_cache import reference_cache
 from .save_log import save_log
 
+# Approximate number of cash flow rows updated per joined UPDATE statement.
+ACCOUNT_CHUNK_SIZE = 50000
+
 def get_latest_run_skey():
     """
     Retrieve the latest_run_skey from Dim_Run table.
     """
     try:
-        run_record = Dim_Run.objects.first()
+        run_record = reference_cache.first(Dim_Run)
         if not run_record:
             raise ValueError("No run key is available in the Dim_Run table.")
         return run_record.latest_run_skey
@@ -19,8 +25,59 @@ def update_financial_cash_flow(fic_mis_date, max_workers=5, batch_size=1000):
     """
     Updates the `n_effective_interest_rate` and `n_lgd_percent` fields in the `fsi_Financial_Cash_Flow_Cal`
     table using values from the `FCT_Stage_Determination` table, based on matching `v_account_number`, `fic_mis_date`,
-    and `n_run_skey`.
+    and `n_run_skey`. Uses a joined SQL UPDATE where the database supports one and a Python lookup otherwise.
+    """
+    if connection.vendor in JOINED_UPDATE_VENDORS:
+        return update_financial_cash_flow_sql(fic_mis_date)
+    return update_financial_cash_flow_python(fic_mis_date, max_workers, batch_size)
+
+
+def update_financial_cash_flow_sql(fic_mis_date, chunk_size=ACCOUNT_CHUNK_SIZE):
     """
+    Copy the stage determination values with one joined UPDATE per account range of the latest run.
+    """
+    n_run_skey = None
+    try:
+        n_run_skey = get_latest_run_skey()
+        cash_flows = fsi_Financial_Cash_Flow_Cal.objects.filter(fic_mis_date=fic_mis_date, n_run_skey=n_run_skey)
+        ranges = account_ranges(cash_flows, chunk_size)
+        if not ranges:
+            save_log('update_financial_cash_flow', 'INFO', f"No financial cash flows found for fic_mis_date {fic_mis_date} and n_run_skey {n_run_skey}.")
+            return '0'
+
+        qn = connection.ops.quote_name
+        sql = joined_update_sql(
+            f"{qn(fsi_Financial_Cash_Flow_Cal._meta.db_table)} AS c",
+            f"{qn(FCT_Stage_Determination._meta.db_table)} AS s",
+            "s.n_account_number = c.v_account_number AND s.fic_mis_date = c.fic_mis_date",
+            [
+                ('n_effective_interest_rate', 's.n_effective_interest_rate'),
+                ('n_lgd_percent', 's.n_lgd_percent'),
+            ],
+            "c.fic_mis_date = %s AND c.n_run_skey = %s AND c.v_account_number BETWEEN %s AND %s",
+        )
+
+        updated_records = 0
+        mis_date = fsi_Financial_Cash_Flow_Cal._meta.get_field('fic_mis_date').get_db_prep_value(fic_mis_date, connection)
+        with connection.cursor() as cursor:
+            for first_account, last_account in ranges:
+                with transaction.atomic():
+                    cursor.execute(sql, [mis_date, n_run_skey, first_account, last_account])
+                    updated_records += cursor.rowcount
+
+        save_log('update_financial_cash_flow', 'INFO', f"Successfully updated {updated_records} out of {cash_flows.count()} financial cash flow records for fic_mis_date {fic_mis_date} and n_run_skey {n_run_skey}.")
+        return '1' if updated_records > 0 else '0'
+
+    except Exception as e:
+        save_log('update_financial_cash_flow', 'ERROR', f"Error updating financial cash flow records for fic_mis_date {fic_mis_date} and n_run_skey {n_run_skey}: {e}")
+        return '0'
+
+
+def update_financial_cash_flow_python(fic_mis_date, max_workers=5, batch_size=1000):
+    """
+    Copy the stage determination values through an in-memory lookup of the stage rows for the MIS date.
+    """
+    n_run_skey = None
     try:
         n_run_skey = get_latest_run_skey()
         cash_flows = fsi_Financial_Cash_Flow_Cal.objects.filter(fic_mis_date=fic_mis_date, n_run_skey=n_run_skey)
@@ -30,24 +87,21 @@ def update_financial_cash_flow(fic_mis_date, max_workers=5, batch_size=1000):
             save_log('update_financial_cash_flow', 'INFO', f"No financial cash flows found for fic_mis_date {fic_mis_date} and n_run_skey {n_run_skey}.")
             return '0'
 
-        cash_flow_batches = [cash_flows[i:i + batch_size] for i in range(0, total_cash_flows, batch_size)]
+        stage_values = {
+            account_number: (effective_interest_rate, lgd_percent)
+            for account_number, effective_interest_rate, lgd_percent in FCT_Stage_Determination.objects.filter(
+                fic_mis_date=fic_mis_date
+            ).values_list('n_account_number', 'n_effective_interest_rate', 'n_lgd_percent')
+        }
         updated_records = 0
 
         def process_batch(batch):
             bulk_updates = []
             for cash_flow in batch:
-                try:
-                    stage_entry = FCT_Stage_Determination.objects.filter(
-                        n_account_number=cash_flow.v_account_number,
-                        fic_mis_date=cash_flow.fic_mis_date
-                    ).first()
-
-                    if stage_entry:
-                        cash_flow.n_effective_interest_rate = stage_entry.n_effective_interest_rate
-                        cash_flow.n_lgd_percent = stage_entry.n_lgd_percent
-                        bulk_updates.append(cash_flow)
-                except Exception as e:
-                    save_log('update_financial_cash_flow', 'ERROR', f"Error processing account {cash_flow.v_account_number}: {e}")
+                values = stage_values.get(cash_flow.v_account_number)
+                if values:
+                    cash_flow.n_effective_interest_rate, cash_flow.n_lgd_percent = values
+                    bulk_updates.append(cash_flow)
 
             if bulk_updates:
                 try:
@@ -59,7 +113,7 @@ def update_financial_cash_flow(fic_mis_date, max_workers=5, batch_size=1000):
             return 0
 
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(process_batch, batch): batch for batch in cash_flow_batches}
+            futures = {executor.submit(process_batch, batch): batch for batch in keyset_batches(cash_flows, batch_size)}
 
             for future in as_completed(futures):
                 try:
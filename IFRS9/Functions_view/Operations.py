@@ -4,7 +4,7 @@ from django.db import transaction
 import threading
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from ..models import Process, RunProcess,Function,FunctionExecutionStatus
+from ..models import Process, RunProcess,Function,FunctionExecutionStatus,ProcessJob
 from ..forms import ProcessForm, RunProcessForm
 from django.db import transaction
 from django.db.models import Q
@@ -17,6 +17,11 @@ from datetime import datetime
 from django.utils import timezone
 from django.utils.module_loading import import_string  # Used for dynamic function calling
 import sys
+from ..Functions.checkpoints import input_fingerprint, record_checkpoint, skip_completed_functions
+from ..Functions.job_queue import claim_job, default_worker_id, enqueue_job, get_process_runner, is_cancel_requested, is_lease_lost, recover_stale_jobs, request_cancel, run_job
+from ..Functions.prior_stages import refresh_prior_stage_snapshot
+from ..Functions.process_scheduler import build_dependencies, get_execution_mode, run_dag
+from ..Functions.reference_cache import reference_cache
 from ..Functions.cashflow import *
 from ..Functions.calculate_cash_flows_ead import *
 from ..Functions.pd_interpolation import *
@@ -227,8 +232,6 @@ def execute_process_view(request):
 # Handle execution
 # Function to generate the process run ID and count
 
-running_threads = {}
-cancel_flags = {}
 
 
 def generate_process_run_id(process, execution_date):
@@ -257,71 +260,131 @@ def generate_process_run_id(process, execution_date):
     return process_run_id, next_run_count
 
 
-# Background function for running the process
 # Background function for running the process
 def execute_functions_in_background(function_status_entries, process_run_id, mis_date):
-    for status_entry in function_status_entries:
-
-        if cancel_flags.get(process_run_id):  # Check if cancellation was requested
-            status_entry.status = 'Cancelled'
-            status_entry.execution_end_date = timezone.now()
-            status_entry.duration = status_entry.execution_end_date - status_entry.execution_start_date
-            status_entry.save()
-            print(f"Process {process_run_id} was cancelled.")
-            break  # Stop execution if cancelled
-
-        function_name = status_entry.function.function_name
-        print(f"Preparing to execute function: {function_name}")
+    # Reference data is loaded once and shared by all functions of the run.
+    with reference_cache.run_scope(process_run_id):
+        dag_mode = get_execution_mode() == 'dag'
+        if dag_mode:
+            dependencies = build_dependencies([status_entry.function for status_entry in function_status_entries])
+        else:
+            dependencies = [set(range(index)) for index in range(len(function_status_entries))]
 
-        # Set the function status to "Ongoing" and record the start date
-        status_entry.status = 'Ongoing'
-        status_entry.execution_start_date = timezone.now()  # Start time for the function
-        status_entry.save()
-        print(f"Function {function_name} marked as Ongoing.")
+        # A resumed run skips the functions that completed in the run it resumes
+        resume_from = ProcessJob.objects.filter(process_run_id=process_run_id).values_list('resume_from', flat=True).first()
+        skipped = skip_completed_functions(function_status_entries, dependencies, resume_from, mis_date)
 
-        # Execute the function
-        try:
-            if function_name in globals():
-                print(f"Executing function: {function_name} with date {mis_date}")
-                result = globals()[function_name](mis_date)  # Execute the function and capture the return value
-                
-                # Update status and end date based on the return value
-                status_entry.execution_end_date = timezone.now()  # End time for the function
-                if result == 1 or result == '1':
-                    status_entry.status = 'Success'
-                    print(f"Function {function_name} executed successfully.")
-                elif result == 0 or result == '0':
-                    status_entry.status = 'Failed'
-                    print(f"Function {function_name} execution failed.")
-                    status_entry.save()
-                    break  # Stop execution if the function fails
-                else:
-                    status_entry.status = 'Failed'
-                    print(f"Unexpected return value {result} from function {function_name}.")
-                    status_entry.save()
-                    break  # Stop execution for any unexpected result
+        if dag_mode:
+            # Functions start as soon as the functions they depend on have succeeded.
+            run_dag(function_status_entries, dependencies, lambda status_entry: execute_function(status_entry, process_run_id, mis_date), completed=skipped)
+        else:
+            for index, status_entry in enumerate(function_status_entries):
+                if index in skipped:
+                    continue
+                if not execute_function(status_entry, process_run_id, mis_date):
+                    break  # Stop execution if the function fails or the process is cancelled
+
+        # A completed run becomes the prior period of the next one
+        if all(status_entry.status in ('Success', 'Skipped') for status_entry in function_status_entries):
+            refresh_prior_stage_snapshot(mis_date)
+
+
+# Record a function of a cancelled process as cancelled. Only a function that was running gets a duration: the
+# start date of a pending one is when it was queued, if it is set at all.
+def mark_cancelled(status_entry):
+    started = status_entry.status == 'Ongoing' and status_entry.execution_start_date
+    status_entry.status = 'Cancelled'
+    status_entry.execution_end_date = timezone.now()
+    if started:
+        status_entry.duration = status_entry.execution_end_date - status_entry.execution_start_date
+    status_entry.save()
+
+
+# Whether the process of status_entry was cancelled while its function ran (cancel_running_process marks it).
+def was_cancelled(status_entry):
+    return FunctionExecutionStatus.objects.filter(pk=status_entry.pk, status='Cancelled').exists()
+
+
+# Run a single function of a process and record its status. Returns False when the process should stop.
+def execute_function(status_entry, process_run_id, mis_date):
+    if is_lease_lost(process_run_id):  # The job may already run again on another worker: leave its statuses alone
+        print(f"Lease of process {process_run_id} was lost; stopping.")
+        return False
+
+    if is_cancel_requested(process_run_id):  # Check if cancellation was requested
+        mark_cancelled(status_entry)
+        print(f"Process {process_run_id} was cancelled.")
+        return False  # Stop execution if cancelled
+
+    function_name = status_entry.function.function_name
+    print(f"Preparing to execute function: {function_name}")
+
+    # Set the function status to "Ongoing" and record the start date
+    status_entry.status = 'Ongoing'
+    status_entry.execution_start_date = timezone.now()  # Start time for the function
+    status_entry.save()
+    print(f"Function {function_name} marked as Ongoing.")
+
+    # Execute the function
+    try:
+        if function_name in globals():
+            print(f"Executing function: {function_name} with date {mis_date}")
+            result = globals()[function_name](mis_date)  # Execute the function and capture the return value
+
+            if is_lease_lost(process_run_id):
+                print(f"Function {function_name} finished after the lease of process {process_run_id} was lost.")
+                return False
+
+            # The process may have been cancelled while the function ran; its result must not replace that
+            if was_cancelled(status_entry):
+                mark_cancelled(status_entry)
+                print(f"Function {function_name} finished after process {process_run_id} was cancelled.")
+                return False
+
+            # Update status and end date based on the return value
+            status_entry.execution_end_date = timezone.now()  # End time for the function
+            if result == 1 or result == '1':
+                status_entry.status = 'Success'
+                # Inputs as the function left them, which is how a resumed run finds them
+                fingerprint = input_fingerprint(status_entry.function, mis_date)
+                if fingerprint is not None:
+                    record_checkpoint(status_entry, fingerprint)  # Lets a resumed run skip the function
+                print(f"Function {function_name} executed successfully.")
+            elif result == 0 or result == '0':
+                status_entry.status = 'Failed'
+                print(f"Function {function_name} execution failed.")
+                status_entry.save()
+                return False  # Stop execution if the function fails
             else:
                 status_entry.status = 'Failed'
-                print(f"Function {function_name} not found in the global scope.")
-                status_entry.execution_end_date = timezone.now()
+                print(f"Unexpected return value {result} from function {function_name}.")
                 status_entry.save()
-                break  # Stop execution if the function is not found
-
-        except Exception as e:
+                return False  # Stop execution for any unexpected result
+        else:
             status_entry.status = 'Failed'
+            print(f"Function {function_name} not found in the global scope.")
             status_entry.execution_end_date = timezone.now()
-            print(f"Error executing {function_name}: {e}")
             status_entry.save()
-            break  # Stop execution if any function throws an exception
-
-        # Calculate duration
-        if status_entry.execution_start_date and status_entry.execution_end_date:
-            status_entry.duration = status_entry.execution_end_date - status_entry.execution_start_date
-
-        # Save the final status and duration
+            return False  # Stop execution if the function is not found
+
+    except Exception as e:
+        print(f"Error executing {function_name}: {e}")
+        if was_cancelled(status_entry):
+            mark_cancelled(status_entry)
+            return False
+        status_entry.status = 'Failed'
+        status_entry.execution_end_date = timezone.now()
         status_entry.save()
-        print(f"Updated FunctionExecutionStatus for {function_name} to {status_entry.status}")
+        return False  # Stop execution if any function throws an exception
 
+    # Calculate duration
+    if status_entry.execution_start_date and status_entry.execution_end_date:
+        status_entry.duration = status_entry.execution_end_date - status_entry.execution_start_date
+
+    # Save the final status and duration
+    status_entry.save()
+    print(f"Updated FunctionExecutionStatus for {function_name} to {status_entry.status}")
+    return True
 
 @login_required
 def run_process_execution(request):
@@ -337,39 +400,77 @@ def run_process_execution(request):
         # Retrieve the selected process
         process = get_object_or_404(Process, id=process_id)
         print(f"Process selected: {process.process_name} (ID: {process.id})")
-        
-        # Fetch the RunProcess records in order of their execution (by 'order' field)
-        # run_processes = RunProcess.objects.filter(id__in=selected_function_ids).order_by('order')
-        run_processes = RunProcess.objects.filter(process=process).order_by('order')
-        print(f"Number of selected functions to execute: {run_processes.count()}")
-
-        # Generate the process_run_id and run_count
-        process_run_id, run_count = generate_process_run_id(process, execution_date)
-        print(f"Generated process_run_id: {process_run_id}, run_count: {run_count}")
-
-        # Save all functions as "Pending"
-        function_status_entries = []
-        for run_process in run_processes:
-            status_entry = FunctionExecutionStatus.objects.create(
-                process=process,
-                function=run_process.function,
-                reporting_date=mis_date,  # Use the original string date for the execution status
-                status='Pending',  # Initially marked as "Pending"
-                process_run_id=process_run_id,
-                run_count=run_count,
-                execution_order=run_process.order
-            )
-            function_status_entries.append(status_entry)
-            print(f"Function {run_process.function.function_name} marked as Pending.")
+
+        process_run_id = queue_process_run(process, execution_date)
 
         # Redirect to the monitoring page so the user can see the function statuses
-        response = redirect('monitor_specific_process', process_run_id=process_run_id)
+        return redirect('monitor_specific_process', process_run_id=process_run_id)  # Redirects immediately while the background task executes
 
-        # Execute functions in the background (thread)
-        execution_thread = threading.Thread(target=execute_functions_in_background, args=(function_status_entries, process_run_id, mis_date))
+
+# Resume a failed or cancelled run: a new run of the process that skips the functions completed with unchanged inputs
+@login_required
+def resume_process_run(request, process_run_id):
+    if request.method != 'POST':
+        return redirect('monitor_running_process_view')
+
+    previous_run = FunctionExecutionStatus.objects.filter(process_run_id=process_run_id).select_related('process').first()
+    if previous_run is None:
+        messages.error(request, f"No process run found with the given ID '{process_run_id}'.")
+        return redirect('monitor_running_process_view')
+    # A run that stopped leaves the functions after the one that failed 'Pending': its job tells whether it still runs
+    if ProcessJob.objects.filter(process_run_id=process_run_id, status__in=['Queued', 'Running']).exists():
+        messages.error(request, f"Process '{process_run_id}' is still running.")
+        return redirect('monitor_running_process_view')
+
+    execution_date = datetime.combine(previous_run.reporting_date, datetime.min.time())
+    resumed_run_id = queue_process_run(previous_run.process, execution_date, resume_from=process_run_id)
+    messages.success(request, f"Process '{process_run_id}' resumed as '{resumed_run_id}'.")
+    return redirect('monitor_specific_process', process_run_id=resumed_run_id)
+
+
+# Record a new run of the process with all its functions "Pending" and queue it. Returns the process_run_id.
+def queue_process_run(process, execution_date, resume_from=None):
+    mis_date = execution_date.strftime('%Y-%m-%d')
+
+    # Fetch the RunProcess records in order of their execution (by 'order' field)
+    run_processes = RunProcess.objects.filter(process=process).select_related('function').prefetch_related('function__depends_on').order_by('order')
+    print(f"Number of selected functions to execute: {run_processes.count()}")
+
+    # Generate the process_run_id and run_count
+    process_run_id, run_count = generate_process_run_id(process, execution_date)
+    print(f"Generated process_run_id: {process_run_id}, run_count: {run_count}")
+
+    # Save all functions as "Pending"
+    for run_process in run_processes:
+        FunctionExecutionStatus.objects.create(
+            process=process,
+            function=run_process.function,
+            reporting_date=mis_date,  # Use the original string date for the execution status
+            status='Pending',  # Initially marked as "Pending"
+            process_run_id=process_run_id,
+            run_count=run_count,
+            execution_order=run_process.order
+        )
+        print(f"Function {run_process.function.function_name} marked as Pending.")
+
+    # Queue the run; runs whose worker died are failed (or queued again for the ifrs9_worker processes)
+    recover_stale_jobs(requeue=get_process_runner() == 'worker')
+    job = enqueue_job(process, process_run_id, execution_date.date(), resume_from=resume_from)
+
+    # Execute functions in the background (thread), unless the ifrs9_worker processes pick the job up
+    if get_process_runner() == 'thread':
+        execution_thread = threading.Thread(target=run_job_in_background, args=(job.pk,))
         execution_thread.start()
 
-        return response  # Redirects immediately while the background task executes
+    return process_run_id
+
+
+# Run a queued process in a thread of the web process
+def run_job_in_background(job_id):
+    worker_id = default_worker_id()
+    job = claim_job(worker_id, job_id)
+    if job:
+        run_job(job, worker_id, execute_functions_in_background)
         
 
 @login_required
@@ -509,6 +610,9 @@ def cancel_running_process(request, process_run_id):
             status__in=['Pending', 'Ongoing']
         )
         
+        # Running functions stop at the next function boundary
+        request_cancel(process_run_id)
+
         if functions.exists():
             # Update the status of all "Pending" and "Ongoing" functions to "Cancelled"
             functions.update(status='Cancelled')
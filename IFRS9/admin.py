@@ -111,3 +111,16 @@
 #     list_filter = ('table_type',)
 #     search_fields = ('table_name', 'description')
 
+
+
+from django.contrib import admin
+from .forms import FunctionForm
+from .models import Function
+
+
+@admin.register(Function)
+class FunctionAdmin(admin.ModelAdmin):
+    form = FunctionForm
+    list_display = ('function_name', 'description')
+    search_fields = ('function_name',)
+    filter_horizontal = ('depends_on',)
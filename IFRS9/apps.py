@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class Ifrs9Config(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'IFRS9'
+
+    def ready(self):
+        # Connects the signal receivers that invalidate cached reference data.
+        from .Functions import reference_cache  # noqa: F401
@@ -415,6 +415,18 @@ class ColumnMappingForm(forms.Form):
         return {'column_mappings': column_mappings}
     
 
+# Function Form
+class FunctionForm(forms.ModelForm):
+    class Meta:
+        model = Function
+        fields = ['function_name', 'description', 'reads_tables', 'writes_tables', 'depends_on']
+        widgets = {
+            'function_name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Enter Function Name'}),
+            'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 2}),
+            'reads_tables': forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'table or table.column, comma separated'}),
+            'writes_tables': forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'table or table.column, comma separated'}),
+        }
+
 # Form for Process
 # Process Form
 class ProcessForm(forms.ModelForm):
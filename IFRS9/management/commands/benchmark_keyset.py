@@ -0,0 +1,50 @@
+import time
+from django.core.management.base import BaseCommand
+from IFRS9.Functions.keyset import keyset_batches
+from IFRS9.models import fsi_Financial_Cash_Flow_Cal
+
+
+class Command(BaseCommand):
+    help = (
+        "Read fsi_Financial_Cash_Flow_Cal in batches with OFFSET slicing and with keyset pagination and "
+        "report the timings. Read-only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fic-mis-date', help="Only read rows for this MIS date (YYYY-MM-DD).")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-rows', type=int, help="Stop each strategy after this many rows.")
+
+    def handle(self, *args, **options):
+        queryset = fsi_Financial_Cash_Flow_Cal.objects.all()
+        if options['fic_mis_date']:
+            queryset = queryset.filter(fic_mis_date=options['fic_mis_date'])
+        batch_size = options['batch_size']
+        total_rows = queryset.count()
+        max_rows = min(total_rows, options['max_rows'] or total_rows)
+        self.stdout.write(f"Reading {max_rows} of {total_rows} rows in batches of {batch_size}.")
+
+        def offset_batches():
+            ordered = queryset.order_by('pk')
+            for i in range(0, max_rows, batch_size):
+                yield list(ordered[i:i + batch_size])
+
+        for name, batches in (('OFFSET', offset_batches()), ('keyset', keyset_batches(queryset, batch_size))):
+            rows, timings = 0, []
+            started = time.perf_counter()
+            while rows < max_rows:
+                batch_started = time.perf_counter()
+                batch = next(batches, None)
+                if not batch:
+                    break
+                timings.append(time.perf_counter() - batch_started)
+                rows += len(batch)
+            elapsed = time.perf_counter() - started
+            if not timings:
+                self.stdout.write(f"{name:>7}: no rows read.")
+                continue
+            self.stdout.write(
+                f"{name:>7}: {rows} rows in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:.0f} rows/s), "
+                f"first batch {timings[0] * 1000:.1f} ms, last batch {timings[-1] * 1000:.1f} ms, "
+                f"slowest batch {max(timings) * 1000:.1f} ms."
+            )
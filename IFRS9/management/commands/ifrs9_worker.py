@@ -0,0 +1,39 @@
+import time
+from django.core.management.base import BaseCommand
+from IFRS9.Functions.job_queue import claim_job, default_worker_id, recover_stale_jobs, run_job
+from IFRS9.Functions_view.Operations import execute_functions_in_background
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued IFRS9 processes. Several workers, on one host or many, can share the queue: each job is "
+        "claimed by exactly one of them, and jobs whose worker stopped renewing its lease are recovered."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', help="Name recorded on claimed jobs (defaults to host:pid:thread).")
+        parser.add_argument('--poll-interval', type=float, default=5.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or default_worker_id()
+        self.stdout.write(f"Worker {worker_id} started.")
+        try:
+            while True:
+                recovered = recover_stale_jobs()
+                if recovered:
+                    self.stdout.write(f"Recovered {recovered} job(s) with an expired lease.")
+
+                job = claim_job(worker_id)
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f"Running {job.process_run_id} (attempt {job.attempts}).")
+                status = run_job(job, worker_id, execute_functions_in_background)
+                self.stdout.write(f"{job.process_run_id} finished: {status}.")
+        except KeyboardInterrupt:
+            # The lease of an interrupted job runs out and another worker recovers it.
+            self.stdout.write(f"Worker {worker_id} stopped.")
@@ -0,0 +1,40 @@
+# Generated by Django 5.1 on 2024-11-25 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("IFRS9", "0017_alter_ldn_customer_rating_detail_fic_mis_date"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FSI_Cashflow_Fingerprint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fic_mis_date", models.DateField()),
+                ("v_account_number", models.CharField(max_length=50)),
+                (
+                    "v_fingerprint",
+                    models.CharField(
+                        help_text="Hash of the loan attributes and payment schedule the cash flows were projected from",
+                        max_length=64,
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "FSI_Cashflow_Fingerprint",
+                "unique_together": {("fic_mis_date", "v_account_number")},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1 on 2024-11-26 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("IFRS9", "0018_fsi_cashflow_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="function",
+            name="depends_on",
+            field=models.ManyToManyField(
+                blank=True, related_name="dependents", to="IFRS9.function"
+            ),
+        ),
+        migrations.AddField(
+            model_name="function",
+            name="reads_tables",
+            field=models.TextField(
+                blank=True,
+                help_text="Tables (or table.column) the function reads, comma separated",
+            ),
+        ),
+        migrations.AddField(
+            model_name="function",
+            name="writes_tables",
+            field=models.TextField(
+                blank=True,
+                help_text="Tables (or table.column) the function writes, comma separated",
+            ),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.1 on 2024-11-27 09:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("IFRS9", "0020_processjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="processjob",
+            name="resume_from",
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name="functionexecutionstatus",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("Pending", "Pending"),
+                    ("Ongoing", "Ongoing"),
+                    ("Success", "Success"),
+                    ("Failed", "Failed"),
+                    ("Cancelled", "Cancelled"),
+                    ("Skipped", "Skipped"),
+                ],
+                default="Pending",
+                max_length=20,
+            ),
+        ),
+        migrations.CreateModel(
+            name="FunctionCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("process_run_id", models.CharField(max_length=50)),
+                ("reporting_date", models.DateField()),
+                (
+                    "input_fingerprint",
+                    models.CharField(
+                        help_text="Hash of the function's inputs when it ran",
+                        max_length=64,
+                    ),
+                ),
+                ("completed_at", models.DateTimeField(auto_now=True)),
+                (
+                    "function",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="IFRS9.function"
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "dim_function_checkpoint",
+                "unique_together": {("process_run_id", "function")},
+            },
+        ),
+    ]
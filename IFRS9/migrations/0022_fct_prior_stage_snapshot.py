@@ -0,0 +1,46 @@
+# Generated by Django 5.1 on 2024-11-28 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("IFRS9", "0021_function_checkpoints"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FCT_Prior_Stage_Snapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("n_account_number", models.CharField(max_length=50, unique=True)),
+                ("fic_mis_date", models.DateField()),
+                (
+                    "n_curr_ifrs_stage_skey",
+                    models.BigIntegerField(blank=True, null=True),
+                ),
+                ("n_in_cooling_period_flag", models.BooleanField(default=False)),
+                ("d_cooling_start_date", models.DateField(blank=True, null=True)),
+                (
+                    "n_cooling_period_duration",
+                    models.IntegerField(blank=True, null=True),
+                ),
+                (
+                    "n_target_ifrs_stage_skey",
+                    models.BigIntegerField(blank=True, null=True),
+                ),
+            ],
+            options={
+                "db_table": "fct_prior_stage_snapshot",
+            },
+        ),
+    ]
@@ -0,0 +1,214 @@
+# Generated by Django 5.1 on 2024-11-21 10:05
+
+from django.db import migrations
+
+STAGE = "fct_stage_determination"
+CASH_FLOW = "fsi_financial_cash_flow_cal"
+REPORTING = "fct_reporting_lines"
+
+
+def columns(table, *names):
+    return [f"{table}.{name}" for name in names]
+
+
+# Tables (or table.column) read and written by the pipeline functions, by function name.
+FUNCTION_TABLES = {
+    "project_cash_flows": (
+        ["ldn_financial_instrument", "ldn_payment_schedule", "fsi_interest_method"],
+        ["fsi_expected_cashflow", "fsi_cashflow_fingerprint"],
+    ),
+    "update_cash_flows_with_ead": (
+        columns("ldn_financial_instrument", "v_account_number", "n_curr_interest_rate", "v_day_count_ind", "d_last_payment_date")
+        + columns("fsi_expected_cashflow", "v_account_number", "d_cash_flow_date", "n_balance", "n_cash_flow_bucket"),
+        columns("fsi_expected_cashflow", "n_exposure_at_default", "n_accrued_interest"),
+    ),
+    "perform_interpolation": (
+        ["ldn_pd_term_structure_dtl", "ldn_pd_term_structure", "fsi_llfp_app_preferences"],
+        ["fsi_pd_interpolated"],
+    ),
+    "pd_interpolation_account_level": (
+        ["ldn_financial_instrument", "fsi_llfp_app_preferences"]
+        + columns("fsi_expected_cashflow", "v_account_number", "n_cash_flow_bucket"),
+        ["fsi_pd_account_interpolated"],
+    ),
+    "insert_fct_stage": (
+        ["ldn_financial_instrument"],
+        [STAGE, "fct_prior_stage_snapshot"],
+    ),
+    "update_stage_determination": (
+        columns(
+            STAGE, "n_account_number", "n_prod_code", "n_cust_ref_code", "n_delinquent_days", "v_amrt_term_unit",
+            "n_org_credit_score", "n_curr_credit_score", "n_collateral_amount", "n_credit_rating_code",
+        )
+        + [
+            "ldn_bank_product_info", "fsi_product_segment", "lgd_collateral", "dim_delinquency_band",
+            "ldn_customer_info", "ldn_pd_term_structure", "ldn_customer_rating_detail",
+        ],
+        columns(
+            STAGE, "n_prod_segment", "n_prod_name", "n_prod_type", "n_prod_desc", "n_segment_skey",
+            "n_collateral_amount", "n_delq_band_code", "n_partner_name", "n_party_type", "n_pd_term_structure_skey",
+            "n_pd_term_structure_name", "n_pd_term_structure_desc", "n_credit_rating_code", "n_acct_rating_movement",
+        ),
+    ),
+    "update_stage": (
+        columns(STAGE, "n_account_number", "n_credit_rating_code", "n_delinquent_days", "v_amrt_term_unit", "n_curr_ifrs_stage_skey")
+        + ["fsi_creditrating_stage", "fsi_dpd_stage_mapping", "fct_prior_stage_snapshot"],
+        columns(STAGE, "n_stage_descr", "n_curr_ifrs_stage_skey", "n_prev_ifrs_stage_skey") + ["fct_prior_stage_snapshot"],
+    ),
+    "process_cooling_period_for_accounts": (
+        columns(
+            STAGE, "n_account_number", "v_amrt_term_unit", "n_curr_ifrs_stage_skey", "n_stage_descr",
+            "n_in_cooling_period_flag", "d_cooling_start_date", "n_cooling_period_duration", "n_target_ifrs_stage_skey",
+        )
+        + ["fsi_cooling_period_definition", "fct_prior_stage_snapshot"],
+        columns(
+            STAGE, "n_curr_ifrs_stage_skey", "n_stage_descr", "n_in_cooling_period_flag", "d_cooling_start_date",
+            "n_cooling_period_duration", "n_target_ifrs_stage_skey",
+        )
+        + ["fct_prior_stage_snapshot"],
+    ),
+    "refresh_prior_stage_snapshot": (
+        columns(
+            STAGE, "n_account_number", "fic_mis_date", "n_curr_ifrs_stage_skey", "n_in_cooling_period_flag",
+            "d_cooling_start_date", "n_cooling_period_duration", "n_target_ifrs_stage_skey",
+        ),
+        ["fct_prior_stage_snapshot"],
+    ),
+    "update_stage_determination_eir": (
+        columns(STAGE, "n_curr_interest_rate", "v_amrt_term_unit"),
+        columns(STAGE, "n_effective_interest_rate"),
+    ),
+    "update_stage_determination_accrued_interest_and_ead": (
+        columns(STAGE, "n_account_number", "n_prod_code", "n_carrying_amount_ncy", "n_exposure_at_default")
+        + columns("fsi_expected_cashflow", "v_account_number", "n_accrued_interest"),
+        columns(STAGE, "n_accrued_interest", "n_exposure_at_default"),
+    ),
+    "update_lgd_for_stage_determination_term_structure": (
+        columns(STAGE, "n_segment_skey") + ["ldn_lgd_term_structure"],
+        columns(STAGE, "n_lgd_percent"),
+    ),
+    "update_lgd_for_stage_determination_collateral": (
+        columns(STAGE, "n_collateral_amount", "n_exposure_at_default") + ["collateral_lgd"],
+        columns(STAGE, "n_lgd_percent"),
+    ),
+    "calculate_account_level_pd_for_accounts": (
+        columns(STAGE, "n_account_number", "n_prod_code", "d_maturity_date", "v_amrt_term_unit")
+        + ["fsi_pd_account_interpolated"],
+        columns(STAGE, "n_twelve_months_pd", "n_lifetime_pd"),
+    ),
+    "calculate_pd_for_accounts": (
+        columns(
+            STAGE, "n_account_number", "d_maturity_date", "v_amrt_term_unit", "n_pd_term_structure_skey",
+            "n_credit_rating_code", "n_delq_band_code",
+        )
+        + ["fsi_pd_interpolated", "ldn_pd_term_structure"],
+        columns(STAGE, "n_twelve_months_pd", "n_lifetime_pd"),
+    ),
+    "insert_cash_flow_data": (
+        ["fsi_expected_cashflow", "dim_run"],
+        [CASH_FLOW, "dim_run"],
+    ),
+    "update_cash_flow_with_pd_buckets": (
+        ["dim_run", "fsi_pd_interpolated"]
+        + columns(CASH_FLOW, "n_run_skey", "v_account_number", "n_cash_flow_bucket_id")
+        + columns(
+            STAGE, "n_account_number", "n_pd_term_structure_skey", "n_credit_rating_code", "n_delq_band_code",
+            "n_lgd_percent", "v_amrt_term_unit",
+        ),
+        columns(CASH_FLOW, "n_cumulative_loss_rate", "n_cumulative_impaired_prob", "n_12m_cumulative_pd"),
+    ),
+    "update_financial_cash_flow": (
+        ["dim_run"]
+        + columns(CASH_FLOW, "n_run_skey", "v_account_number")
+        + columns(STAGE, "n_account_number", "n_effective_interest_rate", "n_lgd_percent"),
+        columns(CASH_FLOW, "n_effective_interest_rate", "n_lgd_percent"),
+    ),
+    "update_marginal_pd": (
+        ["dim_run"]
+        + columns(
+            CASH_FLOW, "n_run_skey", "v_account_number", "n_cash_flow_bucket_id", "n_cumulative_impaired_prob",
+            "n_12m_cumulative_pd",
+        ),
+        columns(CASH_FLOW, "n_per_period_impaired_prob", "n_12m_per_period_pd"),
+    ),
+    "calculate_expected_cash_flow": (
+        ["dim_run"]
+        + columns(
+            CASH_FLOW, "n_run_skey", "n_cash_flow_amount", "n_cumulative_loss_rate", "n_12m_cumulative_pd",
+            "n_lgd_percent",
+        ),
+        columns(CASH_FLOW, "n_expected_cash_flow_rate", "n_12m_exp_cash_flow", "n_expected_cash_flow"),
+    ),
+    "calculate_discount_factors": (
+        ["dim_run"] + columns(CASH_FLOW, "n_run_skey", "n_cash_flow_bucket_id", "n_effective_interest_rate"),
+        columns(CASH_FLOW, "n_discount_rate", "n_discount_factor"),
+    ),
+    "calculate_cashflow_fields": (
+        ["dim_run"]
+        + columns(
+            CASH_FLOW, "n_run_skey", "n_cash_flow_amount", "n_expected_cash_flow", "n_12m_exp_cash_flow",
+            "n_discount_factor",
+        ),
+        columns(
+            CASH_FLOW, "n_expected_cash_flow_pv", "n_12m_exp_cash_flow_pv", "n_cash_shortfall",
+            "n_12m_cash_shortfall", "n_cash_shortfall_pv", "n_12m_cash_shortfall_pv",
+        ),
+    ),
+    "calculate_forward_loss_fields": (
+        ["dim_run"]
+        + columns(
+            CASH_FLOW, "n_run_skey", "n_exposure_at_default", "n_lgd_percent", "n_per_period_impaired_prob",
+            "n_12m_per_period_pd", "n_discount_factor",
+        ),
+        columns(
+            CASH_FLOW, "n_12m_fwd_expected_loss", "n_12m_fwd_expected_loss_pv", "n_forward_expected_loss",
+            "n_forward_expected_loss_pv",
+        ),
+    ),
+    "populate_fct_reporting_lines": (
+        [STAGE, "dim_ecl_method", "dim_run"],
+        [REPORTING, "dim_run"],
+    ),
+    "calculate_ecl_based_on_method": (
+        ["dim_ecl_method", "dim_run"]
+        + columns(
+            CASH_FLOW, "n_run_skey", "v_account_number", "n_cash_shortfall", "n_12m_cash_shortfall",
+            "n_cash_shortfall_pv", "n_12m_cash_shortfall_pv", "n_forward_expected_loss",
+            "n_12m_fwd_expected_loss", "n_forward_expected_loss_pv", "n_12m_fwd_expected_loss_pv",
+        )
+        + columns(
+            REPORTING, "n_run_key", "n_account_number", "n_exposure_at_default_ncy", "n_lgd_percent",
+            "n_lifetime_pd", "n_twelve_months_pd",
+        ),
+        columns(REPORTING, "n_lifetime_ecl_ncy", "n_12m_ecl_ncy"),
+    ),
+    "update_reporting_lines_with_exchange_rate": (
+        ["dim_run", "dim_exchange_rate_conf", "dim_reporting_currency_code", "ldn_exchange_rate"]
+        + columns(
+            REPORTING, "n_run_key", "v_ccy_code", "n_exposure_at_default_ncy", "n_carrying_amount_ncy",
+            "n_lifetime_ecl_ncy", "n_12m_ecl_ncy",
+        ),
+        ["ldn_exchange_rate"]
+        + columns(REPORTING, "n_exposure_at_default_rcy", "n_carrying_amount_rcy", "n_lifetime_ecl_rcy", "n_12m_ecl_rcy"),
+    ),
+}
+
+
+def declare_function_tables(apps, schema_editor):
+    """Fill in the tables of the existing pipeline functions, leaving declarations made by hand untouched."""
+    Function = apps.get_model("IFRS9", "Function")
+    for function_name, (reads, writes) in FUNCTION_TABLES.items():
+        Function.objects.filter(function_name=function_name, reads_tables="", writes_tables="").update(
+            reads_tables=", ".join(reads), writes_tables=", ".join(writes)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("IFRS9", "0022_fct_prior_stage_snapshot"),
+    ]
+
+    operations = [
+        migrations.RunPython(declare_function_tables, migrations.RunPython.noop),
+    ]
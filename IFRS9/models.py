@@ -315,6 +315,17 @@ class FSI_Expected_Cashflow(models.Model):
         db_table = 'FSI_Expected_Cashflow'
         unique_together = ('fic_mis_date', 'v_account_number', 'd_cash_flow_date')
 
+
+class FSI_Cashflow_Fingerprint(models.Model):
+    fic_mis_date = models.DateField()
+    v_account_number = models.CharField(max_length=50)
+    v_fingerprint = models.CharField(max_length=64, help_text="Hash of the loan attributes and payment schedule the cash flows were projected from")
+
+    class Meta:
+        db_table = 'FSI_Cashflow_Fingerprint'
+        unique_together = ('fic_mis_date', 'v_account_number')
+
+
 class Ldn_Payment_Schedule(models.Model):
     fic_mis_date = models.DateField(null=False)
     v_account_number = models.CharField(max_length=50, null=False)
@@ -489,6 +500,20 @@ class FCT_Stage_Determination(models.Model):
         unique_together = ('fic_mis_date', 'n_account_number') 
 
 
+# Latest stage and cooling state of every account, refreshed when a run finishes
+class FCT_Prior_Stage_Snapshot(models.Model):
+    n_account_number = models.CharField(max_length=50, unique=True)
+    fic_mis_date = models.DateField()  # MIS date of the FCT_Stage_Determination record the values come from
+    n_curr_ifrs_stage_skey = models.BigIntegerField(null=True, blank=True)
+    n_in_cooling_period_flag = models.BooleanField(default=False)
+    d_cooling_start_date = models.DateField(null=True, blank=True)
+    n_cooling_period_duration = models.IntegerField(null=True, blank=True)
+    n_target_ifrs_stage_skey = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'fct_prior_stage_snapshot'
+
+
 # Credit Rating to Stage Mapping
 # Choices for Stages
 STAGE_CHOICES = [
@@ -697,6 +722,10 @@ class ReportColumnConfig(models.Model):
 class Function(models.Model):
     function_name = models.CharField(max_length=255, unique=True)
     description = models.TextField(blank=True)
+    # Used by the DAG execution mode to find the functions of a process that can run at the same time
+    reads_tables = models.TextField(blank=True, help_text="Tables (or table.column) the function reads, comma separated")
+    writes_tables = models.TextField(blank=True, help_text="Tables (or table.column) the function writes, comma separated")
+    depends_on = models.ManyToManyField('self', symmetrical=False, blank=True, related_name='dependents')
 
     class Meta:
         db_table = 'dim_function'
@@ -734,7 +763,7 @@ class FunctionExecutionStatus(models.Model):
     duration = models.DurationField(null=True, blank=True)
     execution_order = models.PositiveIntegerField(null=True)
     reporting_date = models.DateField(null=True)
-    status = models.CharField(max_length=20, choices=[('Pending', 'Pending'), ('Ongoing', 'Ongoing'), ('Success', 'Success'), ('Failed', 'Failed')], default='Pending')
+    status = models.CharField(max_length=20, choices=[('Pending', 'Pending'), ('Ongoing', 'Ongoing'), ('Success', 'Success'), ('Failed', 'Failed'), ('Cancelled', 'Cancelled'), ('Skipped', 'Skipped')], default='Pending')
     
     # Track process execution instances
     process_run_id = models.CharField(max_length=50)  # Combined process_id, execution_date, and run_count
@@ -750,8 +779,57 @@ class FunctionExecutionStatus(models.Model):
 
     def __str__(self):
         return f"{self.process.process_name} - {self.function.function_name} - {self.status}"
-    
-    
+
+
+class ProcessJob(models.Model):
+    STATUS_CHOICES = [
+        ('Queued', 'Queued'),
+        ('Running', 'Running'),
+        ('Succeeded', 'Succeeded'),
+        ('Failed', 'Failed'),
+        ('Cancelled', 'Cancelled'),
+    ]
+    process = models.ForeignKey(Process, on_delete=models.CASCADE)
+    process_run_id = models.CharField(max_length=50, unique=True)
+    mis_date = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Queued')
+    cancel_requested = models.BooleanField(default=False)
+    resume_from = models.CharField(max_length=50, null=True, blank=True)  # Run whose completed functions are skipped
+    worker_id = models.CharField(max_length=255, null=True, blank=True)  # Worker holding the lease
+    lease_expires_at = models.DateTimeField(null=True, blank=True)  # The job is recovered when the lease runs out
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'dim_process_job'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='process_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.process_run_id} - {self.status}"
+
+
+class FunctionCheckpoint(models.Model):
+    process_run_id = models.CharField(max_length=50)
+    function = models.ForeignKey(Function, on_delete=models.CASCADE)
+    reporting_date = models.DateField()
+    input_fingerprint = models.CharField(max_length=64, help_text="Hash of the function's inputs when it ran")
+    completed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'dim_function_checkpoint'
+        unique_together = ('process_run_id', 'function')
+
+    def __str__(self):
+        return f"{self.process_run_id} - {self.function.function_name}"
+
+
 class Log(models.Model):
     LOG_LEVEL_CHOICES = [
         ('INFO', 'Info'),
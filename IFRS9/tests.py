@@ -1,3 +1,484 @@
-from django.test import TestCase
+import datetime
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .Functions import calculate_marginal_pd, cashflow, cashflow_shards, job_queue
+from .Functions.band_resolver import BandResolver
+from .Functions.checkpoints import input_fingerprint, record_checkpoint, skip_completed_functions
+from .Functions.cooling_period import apply_cooling_period
+from .Functions.populate_stg_determination import insert_fct_stage_set_based, insert_records_chunk
+from .Functions.process_scheduler import build_dependencies, run_dag
+from .Functions_view import Operations
+from .models import (
+    Dim_Run, FCT_Stage_Determination, FSI_Expected_Cashflow, Fsi_Interest_Method, Function, FunctionCheckpoint,
+    FunctionExecutionStatus, Ldn_Financial_Instrument, Ldn_Payment_Schedule, Process, ProcessJob, RunProcess,
+    fsi_Financial_Cash_Flow_Cal,
+)
+
+MIS_DATE = datetime.date(2024, 7, 31)
+
+
+@override_settings(IFRS9_PROCESS_RUNNER='worker')
+class ProcessRunTestCase(TestCase):
+    """
+    Runs processes whose functions are stand-ins patched into Operations, the namespace execute_function
+    dispatches from. Jobs are queued for a worker and run in the test thread with run_job.
+    """
+
+    function_names = ['first_step', 'second_step', 'third_step']
+
+    def setUp(self):
+        self.calls = []
+        self.failing = set()
+        self.process = Process.objects.create(process_name='Test process')
+        for order, function_name in enumerate(self.function_names, start=1):
+            function = Function.objects.create(function_name=function_name, reads_tables='dim_run')
+            RunProcess.objects.create(process=self.process, function=function, order=order)
+            patcher = mock.patch.object(Operations, function_name, self.stand_in(function_name), create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def stand_in(self, function_name):
+        def run(mis_date):
+            self.calls.append(function_name)
+            return 0 if function_name in self.failing else 1
+        return run
+
+    def run_job(self, process_run_id):
+        job = job_queue.claim_job('test-worker', ProcessJob.objects.get(process_run_id=process_run_id).pk)
+        return job_queue.run_job(job, 'test-worker', Operations.execute_functions_in_background)
+
+    def statuses(self, process_run_id):
+        return list(
+            FunctionExecutionStatus.objects.filter(process_run_id=process_run_id)
+            .order_by('execution_order').values_list('status', flat=True)
+        )
+
+
+class ResumeProcessRunTests(ProcessRunTestCase):
+
+    def setUp(self):
+        super().setUp()
+        user = get_user_model().objects.create_user('operator@example.com', 'Operator')
+        self.client.force_login(user)
+
+    def resume(self, process_run_id):
+        return self.client.post(reverse('resume_process_run', args=[process_run_id]))
+
+    def test_resume_after_a_middle_function_failed(self):
+        self.failing.add('second_step')
+        failed_run_id = Operations.queue_process_run(self.process, datetime.datetime.combine(MIS_DATE, datetime.time()))
+        self.assertEqual(self.run_job(failed_run_id), 'Failed')
+        self.assertEqual(self.statuses(failed_run_id), ['Success', 'Failed', 'Pending'])
+
+        self.failing.clear()
+        self.calls.clear()
+        self.resume(failed_run_id)
+        resumed_run_id = ProcessJob.objects.get(resume_from=failed_run_id).process_run_id
+        self.assertEqual(self.run_job(resumed_run_id), 'Succeeded')
+        self.assertEqual(self.statuses(resumed_run_id), ['Skipped', 'Success', 'Success'])
+        self.assertEqual(self.calls, ['second_step', 'third_step'])
+
+    def test_running_process_is_not_resumed(self):
+        run_id = Operations.queue_process_run(self.process, datetime.datetime.combine(MIS_DATE, datetime.time()))
+        self.resume(run_id)
+        self.assertFalse(ProcessJob.objects.filter(resume_from=run_id).exists())
+
+
+class ProcessSchedulerTests(TestCase):
+
+    def function(self, name, reads='', writes='', depends_on=()):
+        function = Function.objects.create(function_name=name, reads_tables=reads, writes_tables=writes)
+        function.depends_on.set(depends_on)
+        return function
+
+    def test_functions_wait_for_conflicting_tables(self):
+        load = self.function('load', writes='ldn_financial_instrument')
+        other = self.function('other', reads='dim_run', writes='fsi_pd_interpolated')
+        stage = self.function('stage', reads='ldn_financial_instrument', writes='fct_stage_determination')
+        overwrite = self.function('overwrite', writes='ldn_financial_instrument')
+        self.assertEqual(build_dependencies([load, other, stage, overwrite]), [set(), set(), {0}, {0, 2}])
+
+    def test_columns_of_a_table_conflict_only_when_they_overlap(self):
+        eir = self.function('eir', writes='fct_stage_determination.n_effective_interest_rate')
+        lgd = self.function('lgd', reads='fct_stage_determination.n_segment_skey', writes='fct_stage_determination.n_lgd_percent')
+        report = self.function('report', reads='fct_stage_determination')
+        self.assertEqual(build_dependencies([eir, lgd, report]), [set(), set(), {0, 1}])
+
+    def test_depends_on_and_undeclared_functions(self):
+        first = self.function('first', writes='dim_run')
+        second = self.function('second', writes='fsi_pd_interpolated', depends_on=[first])
+        undeclared = self.function('undeclared')
+        last = self.function('last', writes='fct_reporting_lines')
+        self.assertEqual(build_dependencies([first, second, undeclared, last]), [set(), {0}, {0, 1}, {2}])
+
+
+class RunDagTests(SimpleTestCase):
+
+    def test_entries_start_after_their_dependencies_succeeded(self):
+        events = []
+        lock = threading.Lock()
+
+        def run_entry(entry):
+            with lock:
+                events.append(('start', entry))
+            with lock:
+                events.append(('end', entry))
+            return True
+
+        self.assertTrue(run_dag(['a', 'b', 'c', 'd'], [set(), set(), {0, 1}, {2}], run_entry, max_workers=2))
+        self.assertLess(events.index(('end', 'a')), events.index(('start', 'c')))
+        self.assertLess(events.index(('end', 'b')), events.index(('start', 'c')))
+        self.assertLess(events.index(('end', 'c')), events.index(('start', 'd')))
+
+    def test_completed_entries_are_not_run(self):
+        calls = []
+        self.assertTrue(run_dag(['a', 'b'], [set(), {0}], lambda entry: calls.append(entry) or True, completed={0}))
+        self.assertEqual(calls, ['b'])
+
+    def test_no_entry_starts_after_a_failure(self):
+        calls = []
+
+        def run_entry(entry):
+            calls.append(entry)
+            return entry != 'a'
+
+        self.assertFalse(run_dag(['a', 'b', 'c'], [set(), {0}, set()], run_entry, max_workers=1))
+        self.assertEqual(calls, ['a'])
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.process = Process.objects.create(process_name='Test process')
+
+    def job(self, process_run_id, **fields):
+        return ProcessJob.objects.create(process=self.process, process_run_id=process_run_id, mis_date=MIS_DATE, **fields)
+
+    def test_one_of_two_racing_workers_claims_the_job(self):
+        job = self.job('run_1')
+        now = timezone.now
+        claims = {}
+
+        def claimed_by_worker_b_first():
+            # Worker B claims the job after worker A picked it as a candidate but before A's UPDATE runs.
+            if not claims:
+                claims['B'] = None
+                claims['B'] = job_queue.claim_job('B')
+            return now()
+
+        with mock.patch.object(job_queue.timezone, 'now', side_effect=claimed_by_worker_b_first):
+            claims['A'] = job_queue.claim_job('A')
+
+        self.assertIsNone(claims['A'])
+        self.assertEqual(claims['B'].pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker_id, job.attempts), ('Running', 'B', 1))
+
+    def test_claim_a_given_job(self):
+        self.job('run_1')
+        second = self.job('run_2')
+        self.assertEqual(job_queue.claim_job('A', second.pk).pk, second.pk)
+        self.assertIsNone(job_queue.claim_job('B', second.pk))
+
+    def stale_job(self, process_run_id, attempts):
+        job = self.job(
+            process_run_id, status='Running', worker_id='dead-worker', attempts=attempts,
+            lease_expires_at=timezone.now() - datetime.timedelta(minutes=1),
+        )
+        function = Function.objects.create(function_name=f'{process_run_id}_function')
+        for status in ['Success', 'Ongoing', 'Cancelled']:
+            FunctionExecutionStatus.objects.create(
+                process=self.process, function=function, status=status, process_run_id=process_run_id, run_count=1
+            )
+        return job
+
+    def function_statuses(self, process_run_id):
+        return sorted(FunctionExecutionStatus.objects.filter(process_run_id=process_run_id).values_list('status', flat=True))
+
+    def test_stale_job_is_queued_again_to_resume_from_itself(self):
+        job = self.stale_job('run_1', attempts=1)
+        self.assertEqual(job_queue.recover_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.resume_from, job.worker_id, job.lease_expires_at), ('Queued', 'run_1', None, None))
+        self.assertEqual(self.function_statuses('run_1'), ['Cancelled', 'Pending', 'Pending'])
+
+    @override_settings(IFRS9_JOB_MAX_ATTEMPTS=2)
+    def test_stale_job_without_attempts_left_fails(self):
+        job = self.stale_job('run_1', attempts=2)
+        self.assertEqual(job_queue.recover_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.resume_from), ('Failed', None))
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(self.function_statuses('run_1'), ['Cancelled', 'Failed', 'Success'])
+
+    def test_stale_job_fails_when_not_requeued(self):
+        job = self.stale_job('run_1', attempts=1)
+        self.assertEqual(job_queue.recover_stale_jobs(requeue=False), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'Failed')
+
+    def test_job_with_a_valid_lease_is_left_alone(self):
+        job = self.job('run_1', status='Running', worker_id='live-worker', lease_expires_at=timezone.now() + datetime.timedelta(minutes=1))
+        self.assertEqual(job_queue.recover_stale_jobs(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker_id), ('Running', 'live-worker'))
+
+
+class SkipCompletedFunctionsTests(TestCase):
+
+    def setUp(self):
+        self.process = Process.objects.create(process_name='Test process')
+        Dim_Run.objects.create(latest_run_skey=1)
+        self.functions = [
+            Function.objects.create(function_name='uses_run', reads_tables='dim_run'),
+            Function.objects.create(function_name='uses_stages', reads_tables='fct_stage_determination.n_account_number'),
+            Function.objects.create(function_name='undeclared'),
+        ]
+        for status_entry in self.status_entries('old_run'):
+            fingerprint = input_fingerprint(status_entry.function, MIS_DATE)
+            if fingerprint is not None:
+                record_checkpoint(status_entry, fingerprint)
+
+    def status_entries(self, process_run_id):
+        return [
+            FunctionExecutionStatus.objects.create(
+                process=self.process, function=function, execution_order=order, reporting_date=MIS_DATE,
+                process_run_id=process_run_id, run_count=1,
+            )
+            for order, function in enumerate(self.functions, start=1)
+        ]
+
+    def test_functions_with_unchanged_inputs_are_skipped(self):
+        status_entries = self.status_entries('new_run')
+        self.assertEqual(skip_completed_functions(status_entries, [set(), set(), set()], 'old_run', MIS_DATE), {0, 1})
+        self.assertEqual([entry.status for entry in status_entries], ['Skipped', 'Skipped', 'Pending'])
+        self.assertEqual(
+            set(FunctionCheckpoint.objects.filter(process_run_id='new_run').values_list('function__function_name', flat=True)),
+            {'uses_run', 'uses_stages'},
+        )
+
+    def test_changed_inputs_run_again_with_their_dependents(self):
+        Dim_Run.objects.update(latest_run_skey=2)
+        status_entries = self.status_entries('new_run')
+        self.assertEqual(skip_completed_functions(status_entries, [set(), {0}, set()], 'old_run', MIS_DATE), set())
+        self.assertEqual(skip_completed_functions(self.status_entries('other_run'), [set(), set(), set()], 'old_run', MIS_DATE), {1})
+
+    def test_nothing_is_skipped_without_a_run_to_resume(self):
+        self.assertEqual(skip_completed_functions(self.status_entries('new_run'), [set(), set(), set()], None, MIS_DATE), set())
+
+
+class BandResolverTests(TestCase):
+
+    def setUp(self):
+        self.resolver = BandResolver([
+            ('M', None, 30, 'Stage 1'),
+            ('M', 31, 90, 'Stage 2'),
+            ('M', 91, None, 'Stage 3'),
+            ('Q', 0, 10, 'A'),
+            ('Q', 20, 30, 'B'),
+            ('Q', 25, 40, 'C'),
+            ('Y', 5, 1, 'Empty'),
+        ], 'Test band')
+
+    def test_bounds_are_inclusive_and_none_is_unbounded(self):
+        cases = [(-100, 'Stage 1'), (30, 'Stage 1'), (31, 'Stage 2'), (90, 'Stage 2'), (91, 'Stage 3'), (10 ** 9, 'Stage 3')]
+        for value, label in cases:
+            self.assertEqual(self.resolver.resolve('M', value), label)
+
+    def test_gaps_overlaps_and_unknown_keys(self):
+        self.assertIsNone(self.resolver.resolve('Q', 15))
+        self.assertIsNone(self.resolver.resolve('Q', 41))
+        self.assertEqual(self.resolver.resolve('Q', 20), 'B')
+        self.assertEqual(self.resolver.resolve('Q', 25), 'C')
+        self.assertIsNone(self.resolver.resolve('M', None))
+        self.assertIsNone(self.resolver.resolve('W', 5))
+        self.assertIn('M', self.resolver)
+        self.assertNotIn('Y', self.resolver)
+        self.assertEqual(len(self.resolver.problems), 3)
+
+    def test_resolve_many_agrees_with_resolve(self):
+        keys = ['M', 'M', 'M', 'Q', 'Q', 'Q', 'Q', 'W', 'M', 'Y']
+        values = [30, 31, 91, 10, 15, 25, 40, 5, None, 3]
+        self.assertEqual(
+            self.resolver.resolve_many(keys, values),
+            [self.resolver.resolve(key, value) for key, value in zip(keys, values)],
+        )
+
+
+class CoolingPeriodTests(SimpleTestCase):
+
+    start_date = datetime.date(2024, 6, 30)
+
+    def test_moving_to_a_lower_stage_starts_cooling(self):
+        self.assertEqual(
+            apply_cooling_period((1, 'Stage 1', False, None, None, None), (2, False, None, None, None), MIS_DATE, 90),
+            (2, 'Stage 2', True, MIS_DATE, 90, 1),
+        )
+
+    def test_cooling_account_keeps_its_previous_stage(self):
+        self.assertEqual(
+            apply_cooling_period((1, 'Stage 1', False, None, None, None), (2, True, self.start_date, 90, 1), MIS_DATE, 30),
+            (2, 'Stage 2', True, self.start_date, 90, 1),
+        )
+
+    def test_lower_stage_takes_effect_when_cooling_is_over(self):
+        self.assertEqual(
+            apply_cooling_period((1, 'Stage 1', False, None, None, None), (2, True, self.start_date, 31, 1), MIS_DATE, 90),
+            (1, 'Stage 1', False, None, None, None),
+        )
+
+    def test_returning_to_the_previous_stage_ends_cooling(self):
+        self.assertEqual(
+            apply_cooling_period((3, 'Stage 3', False, None, None, None), (2, True, self.start_date, 90, 1), MIS_DATE, 90),
+            (3, 'Stage 3', False, None, None, None),
+        )
+
+    def test_unchanged_or_higher_stage_does_not_cool(self):
+        for current_stage in [2, 3]:
+            self.assertEqual(
+                apply_cooling_period((current_stage, None, False, None, None, None), (2, False, None, None, None), MIS_DATE, 90),
+                (current_stage, f'Stage {current_stage}', False, None, None, None),
+            )
+
+
+class InsertFctStageTests(TestCase):
+
+    def setUp(self):
+        common = {'fic_mis_date': MIS_DATE, 'd_maturity_date': datetime.date(2027, 7, 31), 'n_curr_interest_rate': Decimal('5.50')}
+        Ldn_Financial_Instrument.objects.bulk_create([
+            Ldn_Financial_Instrument(
+                v_account_number='A1', n_eop_bal=Decimal('1000.00'), v_acct_rating_movement=Decimal('2.7'),
+                v_curr_credit_score=Decimal('-3.7'), v_org_credit_score=Decimal('650.25'), n_delinquent_days=45,
+                d_start_date=datetime.date(2020, 2, 29), v_amrt_term_unit='M', v_ccy_code='USD', **common
+            ),
+            Ldn_Financial_Instrument(v_account_number='A2', n_eop_bal=Decimal('0.00'), v_day_count_ind='ACT', **common),
+            Ldn_Financial_Instrument(
+                v_account_number='A3', n_eop_bal=Decimal('1.00'), fic_mis_date=datetime.date(2024, 6, 30),
+                d_maturity_date=datetime.date(2027, 7, 31), n_curr_interest_rate=Decimal('1.00'),
+            ),
+        ])
+
+    def stage_rows(self):
+        fields = [field.name for field in FCT_Stage_Determination._meta.concrete_fields if not field.primary_key]
+        return sorted(FCT_Stage_Determination.objects.values_list(*fields))
+
+    def test_set_based_insert_matches_the_orm_insert(self):
+        FCT_Stage_Determination.objects.create(fic_mis_date=MIS_DATE, n_account_number='OLD')
+        self.assertEqual(insert_fct_stage_set_based(MIS_DATE), (1, 2))
+        set_based = self.stage_rows()
+
+        FCT_Stage_Determination.objects.all().delete()
+        insert_records_chunk(list(Ldn_Financial_Instrument.objects.filter(fic_mis_date=MIS_DATE)))
+        self.assertEqual(set_based, self.stage_rows())
+
+        stage = FCT_Stage_Determination.objects.get(n_account_number='A1')
+        self.assertEqual((stage.n_acct_rating_movement, stage.n_curr_credit_score), (2, -3))
+
+
+class MarginalPdTests(TestCase):
+
+    def setUp(self):
+        cumulative = {
+            'A1': [(1, '0.01', '0.02'), (2, '0.03', '0.05'), (3, None, '0.04'), (5, '0.10', None)],
+            'A2': [(2, '0.20', '0.30'), (1, '0.05', '0.10'), (None, '0.50', '0.50')],
+            'A3': [(1, '0.07', '0.07')],
+        }
+        for account_number, buckets in cumulative.items():
+            for day, (bucket, impaired_prob, twelve_month_pd) in enumerate(buckets, start=1):
+                fsi_Financial_Cash_Flow_Cal.objects.create(
+                    v_account_number=account_number, d_cash_flow_date=MIS_DATE + datetime.timedelta(days=day),
+                    fic_mis_date=MIS_DATE, n_run_skey=1, n_cash_flow_bucket_id=bucket,
+                    n_cumulative_impaired_prob=impaired_prob and Decimal(impaired_prob),
+                    n_12m_cumulative_pd=twelve_month_pd and Decimal(twelve_month_pd),
+                    n_per_period_impaired_prob=Decimal('9'), n_12m_per_period_pd=Decimal('9'),
+                )
+        fsi_Financial_Cash_Flow_Cal.objects.create(
+            v_account_number='A1', d_cash_flow_date=MIS_DATE, fic_mis_date=MIS_DATE, n_run_skey=2,
+            n_cash_flow_bucket_id=1, n_cumulative_impaired_prob=Decimal('0.5'),
+        )
+
+    def per_period_pds(self):
+        return sorted(fsi_Financial_Cash_Flow_Cal.objects.values_list(
+            'v_account_number', 'n_run_skey', 'n_cash_flow_bucket_id', 'n_per_period_impaired_prob', 'n_12m_per_period_pd'
+        ), key=str)
+
+    def test_sql_and_python_paths_agree(self):
+        before = self.per_period_pds()
+        self.assertEqual(calculate_marginal_pd.update_marginal_pd_sql(MIS_DATE, 1), 7)
+        sql_result = self.per_period_pds()
+
+        fsi_Financial_Cash_Flow_Cal.objects.update(n_per_period_impaired_prob=Decimal('9'), n_12m_per_period_pd=Decimal('9'))
+        fsi_Financial_Cash_Flow_Cal.objects.filter(n_run_skey=2).update(n_per_period_impaired_prob=None, n_12m_per_period_pd=None)
+        self.assertEqual(self.per_period_pds(), before)
+        calculate_marginal_pd.update_marginal_pd_python(fsi_Financial_Cash_Flow_Cal.objects.filter(fic_mis_date=MIS_DATE, n_run_skey=1))
+        self.assertEqual(sql_result, self.per_period_pds())
+
+        per_period = {
+            (account_number, bucket): (impaired_prob, twelve_month_pd)
+            for account_number, run_skey, bucket, impaired_prob, twelve_month_pd in sql_result if run_skey == 1
+        }
+        self.assertEqual(per_period['A1', 2], (Decimal('0.02'), Decimal('0.03')))
+        self.assertEqual(per_period['A1', 3], (Decimal('9'), Decimal('0.01')))
+        self.assertEqual(per_period['A1', 5], (Decimal('0.1'), Decimal('9')))
+        self.assertEqual(per_period['A2', 2], (Decimal('0.15'), Decimal('0.2')))
+        self.assertEqual(per_period['A2', None], (Decimal('9'), Decimal('9')))
+
+
+class CashFlowEngineTests(TransactionTestCase):
+    """The loan, vectorized and sharded engines project the same cash flows and skip the same loans."""
+
+    def setUp(self):
+        rng = random.Random(7)
+        loans = []
+        for index in range(120):
+            next_payment_date = MIS_DATE + datetime.timedelta(days=rng.randint(-5, 40))
+            loans.append(Ldn_Financial_Instrument(
+                fic_mis_date=MIS_DATE, v_account_number=f'A{index:03}',
+                n_curr_interest_rate=Decimal(rng.choice(['0', '5.5', '12.25'])),
+                n_eop_bal=Decimal(rng.randint(100, 100000)),
+                n_wht_percent=rng.choice([None, Decimal('0.1')]),
+                v_day_count_ind=rng.choice(['30/360', '30/365', 'ACT']),
+                d_start_date=rng.choice([datetime.date(2020, 2, 29), datetime.date(2021, 3, 1), None, datetime.date(2022, 5, 5)]),
+                d_next_payment_date=rng.choice([next_payment_date, next_payment_date, None]),
+                d_maturity_date=next_payment_date + datetime.timedelta(days=rng.randint(-40, 3000)),
+                v_amrt_repayment_type=rng.choice(['bullet', 'amortized', 'other', None]),
+                v_amrt_term_unit=rng.choice(['M', 'Q', 'H', 'Y', 'W', 'D', None]),
+                v_ccy_code=rng.choice(['USD', 'USD', None]),
+            ))
+        Ldn_Financial_Instrument.objects.bulk_create(loans)
+        for index in range(0, 120, 7):
+            for period in range(3):
+                Ldn_Payment_Schedule.objects.create(
+                    fic_mis_date=MIS_DATE, v_account_number=f'A{index:03}',
+                    d_payment_date=MIS_DATE + datetime.timedelta(days=30 * (period + 1)),
+                    n_principal_payment_amt=Decimal('10.5'),
+                    n_interest_payment_amt=None if period == 1 else Decimal('2'),
+                )
+
+    def project(self, engine):
+        with override_settings(IFRS9_CASHFLOW_ENGINE=engine, IFRS9_CASHFLOW_SHARDS=3), \
+                mock.patch.object(cashflow_shards, 'ProcessPoolExecutor', ThreadPoolExecutor):
+            self.assertEqual(cashflow.project_cash_flows(MIS_DATE), 1)
+        return sorted(FSI_Expected_Cashflow.objects.values_list(
+            'v_account_number', 'n_cash_flow_bucket', 'd_cash_flow_date', 'n_principal_payment', 'n_interest_payment',
+            'n_cash_flow_amount', 'n_balance', 'V_CASH_FLOW_TYPE', 'management_fee_added', 'V_CCY_CODE',
+        ), key=str)
+
+    def test_engines_project_the_same_cash_flows(self):
+        for interest_method in ['Simple', 'Amortized']:
+            Fsi_Interest_Method.objects.all().delete()
+            Fsi_Interest_Method.objects.create(v_interest_method=interest_method)
+            with self.subTest(interest_method=interest_method):
+                loan = self.project('loan')
+                self.assertTrue(loan)
+                self.assertEqual(self.project('vectorized'), loan)
+                self.assertEqual(self.project('sharded'), loan)
@@ -146,6 +146,7 @@ urlpatterns = [
     path('get-updated-status-table/', views.get_updated_status_table, name='get_updated_status_table'),
     path('running-processes/', running_processes_view, name='running_processes'),
     path('cancel-process/<str:process_run_id>/', cancel_running_process, name='cancel_running_process'),
+    path('process/resume/<str:process_run_id>/', views.resume_process_run, name='resume_process_run'),
 
 
     path('reports-home/', views.reporting_home, name='reporting_home'),